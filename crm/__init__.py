@@ -1,4 +1,5 @@
 import os
+import threading
 import warnings
 from importlib import import_module
 from logging.config import dictConfig
@@ -16,7 +17,7 @@ from graphene_sqlalchemy import SQLAlchemyObjectType
 
 from crm.apps.admin.config import NAV_BAR_ORDER
 from crm.graphql import BaseMutation, BaseQuery
-from crm.settings import DATA_DIR
+from crm.settings import DATA_DIR, GRAPHQL_SCHEMA_PREBUILD
 from .db import BaseModel, db
 from .settings import LOGGING_CONF, STATIC_DIR, IMAGES_DIR, ATTACHMENTS_DIR, STATIC_URL_PATH, CACHE_BACKEND_URI
 
@@ -44,7 +45,10 @@ class CRM(object):
         self.load_settings()
         self.init_db()
         self.init_admin_app()
-        self._graphql_schema = self.init_graphql_schema()
+        # Built on first use, see graphql_schema
+        self._graphql_schema = None
+        self._graphql_introspection = None
+        self._graphql_lock = threading.Lock()
 
     def ensure_static_dirs(self):
         """
@@ -189,6 +193,7 @@ class CRM(object):
                     viewcls(all_models[extra_model], db.session, category="Extra"))
 
         admin.add_link(MenuLink(name='reports', url='/reports', category="Extra"))
+        admin.add_link(MenuLink(name='search', url='/search'))
         self._app.admin = admin
 
     @staticmethod
@@ -209,11 +214,31 @@ class CRM(object):
     @property
     def graphql_schema(self):
         """
+        Schema is built on first use, so commands that don't need graphql
+        i.e (flask dumpcache) don't import all graphql modules
+
         :return: Graphql Schema 
         :rtype: graphene.Schema
         """
+        if self._graphql_schema is None:
+            with self._graphql_lock:
+                if self._graphql_schema is None:
+                    self._graphql_schema = self.init_graphql_schema()
         return self._graphql_schema
 
+    @property
+    def graphql_introspection(self):
+        """
+        Introspection result of the schema, computed once per process
+        (schema doesn't change while running)
+
+        :return: result of the standard introspection query
+        :rtype: dict
+        """
+        if self._graphql_introspection is None:
+            self._graphql_introspection = self.graphql_schema.introspect()
+        return self._graphql_introspection
+
     @staticmethod
     def init_graphql_schema():
         """
@@ -287,9 +312,6 @@ crm = CRM()
 app = crm.app
 app.cache = crm.cache
 
-# Initialize app.graphql_schema with apps defined graphql Schema
-app.graphql_schema = crm.graphql_schema
-
 db.app = app
 db.init_app(app)
 db.session.autocommit = True
@@ -302,3 +324,7 @@ manager.add_command('db', MigrateCommand)
 
 # Import all sub apps (views.py) to initialize all routes
 crm.initialize_all_routes()
+
+if GRAPHQL_SCHEMA_PREBUILD:
+    # i.e in uwsgi master process, so that forked workers share the built schema
+    crm.graphql_introspection
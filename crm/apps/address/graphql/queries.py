@@ -2,7 +2,7 @@ from graphene import relay
 
 from crm.apps.address.graphql.arguments import AddressArguments
 from crm.apps.address.graphql.types import AddressType
-from crm.graphql import BaseQuery, CRMConnectionField
+from crm.graphql import BaseQuery, CRMConnectionField, CRMAggregateField
 
 
 class AddressQuery(BaseQuery):
@@ -11,5 +11,11 @@ class AddressQuery(BaseQuery):
         **AddressArguments.fields()
     )
 
+    # count/sum/avg/min/max of addresses, optionally grouped by some fields
+    addresses_aggregate = CRMAggregateField(
+        AddressType,
+        **AddressArguments.fields()
+    )
+
     class Meta:
         interfaces = (relay.Node,)
@@ -0,0 +1,108 @@
+"""
+AJAX relationship select fields of admin forms
+
+Select fields of relationships (owner, contact, company, currency, countries, ...) render every
+row of the target table as an option. Relationships to models of LOOKUP_FIELDS are instead
+select2 fields searching (ADMIN_AJAX_LOOKUP_LIMIT) options at a time while typing.
+They're configured for all EnhancedModelView forms & their inline forms, see get_ajax_refs().
+
+Big models having a search document are searched with the full text search index (crm.apps.search),
+others by (fields) starting with the typed text, enum fields by their values.
+"""
+
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from flask_admin.model.ajax import DEFAULT_PAGE_SIZE
+from sqlalchemy import false, or_
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm.interfaces import ONETOMANY
+from sqlalchemy.types import Enum as EnumType
+
+from crm.apps.company.models import Company
+from crm.apps.contact.models import Activity, Contact, Subgroup
+from crm.apps.country.models import Country
+from crm.apps.currency.models import Currency
+from crm.apps.deal.models import Deal
+from crm.apps.organization.models import Organization
+from crm.apps.project.models import Project
+from crm.apps.search.index import search_condition
+from crm.apps.sprint.models import Sprint
+from crm.apps.tag.models import Tag
+from crm.apps.user.models import User
+from crm.settings import ADMIN_AJAX_LOOKUP_LIMIT
+
+# {model: fields} searched by select fields of relationships to model
+LOOKUP_FIELDS = {
+    User: ('username', 'firstname', 'lastname'),
+    Contact: ('firstname', 'lastname'),
+    Company: ('name',),
+    Deal: ('name',),
+    Organization: ('name',),
+    Project: ('name',),
+    Sprint: ('name',),
+    Currency: ('name',),
+    Country: ('name',),
+    Subgroup: ('groupname',),
+    Activity: ('type',),
+    Tag: ('tag',),
+}
+
+
+class LookupAjaxModelLoader(QueryAjaxModelLoader):
+    """
+    Options of a relationship select field matching typed text, see module doc
+    """
+
+    def condition(self, term):
+        condition = search_condition(self.model, term)
+        if condition is not None:
+            return condition
+
+        conditions = []
+        pattern = '%s%%' % term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        for field in self._cached_fields:
+            column_type = getattr(field, 'type', None)
+            if isinstance(column_type, EnumType) and column_type.enum_class is not None:
+                # Enum values i.e countries names, matched here so the unique index is used
+                members = [
+                    m for m in column_type.enum_class
+                    if str(m.value).lower().startswith(term.lower()) or m.name.lower().startswith(term.lower())
+                ]
+                conditions.append(field.in_(members) if members else false())
+            else:
+                conditions.append(field.ilike(pattern, escape='\\'))
+        return or_(*conditions)
+
+    def get_list(self, term, offset=0, limit=DEFAULT_PAGE_SIZE):
+        limit = min(limit or ADMIN_AJAX_LOOKUP_LIMIT, ADMIN_AJAX_LOOKUP_LIMIT)
+        query = self.session.query(self.model)
+
+        term = (term or '').strip()
+        if term:
+            query = query.filter(self.condition(term))
+
+        if self.order_by:
+            query = query.order_by(self.order_by)
+        else:
+            query = query.order_by(*self._cached_fields)
+
+        return query.offset(offset or 0).limit(limit).all()
+
+
+def get_ajax_refs(model, session, prefix=''):
+    """
+    AJAX select fields of all relationships of (model) to models of LOOKUP_FIELDS
+
+    :param prefix: loaders names prefix, inline forms loaders are named {inline model}-{field}
+    :return: {relationship name: loader} for form_ajax_refs
+    :rtype: dict
+    """
+    refs = {}
+    for relationship in sa_inspect(model).relationships:
+        fields = LOOKUP_FIELDS.get(relationship.mapper.class_)
+        if fields is None or relationship.direction is ONETOMANY or relationship.viewonly:
+            # Collections of children are edited inline
+            continue
+        refs[relationship.key] = LookupAjaxModelLoader(
+            prefix + relationship.key, session, relationship.mapper.class_, fields=fields
+        )
+    return refs
@@ -0,0 +1,103 @@
+"""
+Row count strategies of admin list views (EnhancedModelView.count_strategy)
+
+- (exact) runs SELECT count(*) with all filters & joins, on every page
+- (cached) exact count cached per (count statement, parameters) and version counters
+  of all tables it reads (crm.cache.get_table_versions), so it's run again only after
+  one of these tables is written
+- (estimate) row count estimated by PostgreSQL planner (EXPLAIN), displayed as ~N,
+  small estimates (< ADMIN_COUNT_ESTIMATE_MIN) are counted exactly (cached)
+  and other databases fall back to (cached)
+"""
+
+import hashlib
+import json
+
+from sqlalchemy import Table, literal_column
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.util import find_tables
+
+from crm.cache import LRUCache, get_redis, get_table_versions
+from crm.settings import ADMIN_COUNT_CACHE_TIMEOUT, ADMIN_COUNT_ESTIMATE_MIN
+
+COUNT_STRATEGIES = ('exact', 'cached', 'estimate')
+
+COUNT_REDIS_KEY = 'crm:admin_count:%s'
+
+_local = LRUCache(1024)
+
+
+class EstimatedCount(int):
+    """
+    Approximate count, rendered as ~N in list pages
+    """
+    estimated = True
+
+
+class CountQuery(Query):
+    """
+    Count query of a list view, scalar() counts using (count_strategy)
+
+    Filters & joins are added by flask-admin as usual, generative methods
+    keep the query class and its strategy
+    """
+    count_strategy = 'exact'
+
+    def scalar(self):
+        if self.count_strategy == 'estimate':
+            estimate = self.estimate()
+            if estimate is not None and estimate >= ADMIN_COUNT_ESTIMATE_MIN:
+                return EstimatedCount(estimate)
+            return self.cached_count()
+        if self.count_strategy == 'cached':
+            return self.cached_count()
+        return super().scalar()
+
+    def tables(self):
+        """
+        :return: names of all tables read by the count statement
+        :rtype: set
+        """
+        return {t.name for t in find_tables(self.statement, check_columns=True) if isinstance(t, Table)}
+
+    def cached_count(self):
+        compiled = self.statement.compile(dialect=self.session.connection().dialect)
+        key = json.dumps([str(compiled), compiled.params], sort_keys=True, default=str)
+        key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        versions = get_table_versions(self.tables())
+
+        redis = get_redis()
+        entry = _local.get(key)
+        if entry is None and redis is not None:
+            raw = redis.get(COUNT_REDIS_KEY % key)
+            entry = json.loads(raw.decode('utf-8')) if raw is not None else None
+        if entry is not None and entry['versions'] == versions:
+            return entry['count']
+
+        count = super().scalar()
+        entry = {'versions': versions, 'count': count}
+        _local.set(key, entry)
+        if redis is not None:
+            redis.setex(COUNT_REDIS_KEY % key, ADMIN_COUNT_CACHE_TIMEOUT, json.dumps(entry))
+        return count
+
+    def estimate(self):
+        """
+        :return: rows estimated by PostgreSQL planner for the filtered rows or None on other databases
+        :rtype: int
+        """
+        connection = self.session.connection()
+        if connection.dialect.name != 'postgresql':
+            return None
+
+        # Estimate of rows matched, not of the single count(*) row
+        compiled = self.with_entities(literal_column('1')).statement.compile(dialect=connection.dialect)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute('EXPLAIN (FORMAT JSON) %s' % compiled, compiled.params)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
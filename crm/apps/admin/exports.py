@@ -0,0 +1,240 @@
+"""
+Streaming exports of admin list views (EnhancedModelView.export)
+
+flask-admin export loads all filtered records at once and renders every cell with
+list formatters. Here ids of the filtered & sorted records are read through a server side
+cursor and records are loaded (ADMIN_EXPORT_CHUNK_SIZE) at a time with the view eager load plan.
+Cells are raw values i.e enums names, related records as text, dates as dates.
+
+- csv is streamed in the response
+- xlsx is written by XlsxWriter then sent
+- exports of more than (ADMIN_EXPORT_SYNC_MAX_ROWS) records run in the RQ worker when running
+  with redis, the export page reloads until the file is written in (ADMIN_EXPORT_DIR).
+  Workers and web nodes must share that directory (i.e NFS mount) when they run on different hosts
+"""
+
+import csv
+import io
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
+import xlsxwriter
+from flask import Response, abort, flash, g, redirect, request, send_file, send_from_directory, stream_with_context
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from sqlalchemy.orm import Query
+from werkzeug.utils import secure_filename
+
+from crm.cache import get_redis
+from crm.rq import conn, queue
+from crm.settings import ADMIN_EXPORT_CHUNK_SIZE, ADMIN_EXPORT_SYNC_MAX_ROWS, ADMIN_EXPORT_DIR, ADMIN_EXPORT_TTL, \
+    ADMIN_EXPORT_JOB_TIMEOUT
+from .formatters import get_value, prefetch
+
+EXPORT_TYPES = ('csv', 'xlsx')
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def raw_value(value):
+    """
+    :return: (value) as written in an export cell
+    """
+    if value is None or isinstance(value, Query):
+        # Dynamic relationships aren't exported, they're not rendered in list pages either
+        return ''
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, (str, bool, int, float, Decimal, date, datetime)):
+        return value
+    if isinstance(value, (list, tuple, set)):
+        return ', '.join(str(raw_value(item)) for item in value)
+    return str(value)
+
+
+def export_value(model, name):
+    """
+    Raw value of column (name) of (model) i.e (currency.name)
+    """
+    names = name.split('.')
+    try:
+        value = get_value(model, names[0])
+    except AttributeError:
+        # Rendered as empty cells in list pages too (flask-admin rec_getattr) i.e short_description without description
+        value = None
+    for attribute in names[1:]:
+        value = getattr(value, attribute, None) if value is not None else None
+    return raw_value(value)
+
+
+def get_export_query(view):
+    """
+    Records selected by list page arguments of current request (filters, search, sort)
+
+    :return: (count, query)
+    """
+    view_args = view._get_list_extra_args()
+    sort_column = view._get_column_by_idx(view_args.sort)
+    if sort_column is not None:
+        sort_column = sort_column[0]
+
+    return view.get_list(
+        0, sort_column, view_args.sort_desc, view_args.search, view_args.filters,
+        execute=False, page_size=view.export_max_rows
+    )
+
+
+def _load_chunk(view, ids):
+    query = view.session.query(view.model).filter(view.model.id.in_(ids)).options(*view.get_eager_load_options())
+    found = {model.id: model for model in query}
+    models = [found[id] for id in ids if id in found]
+
+    # Prefetched values of previous chunk aren't needed anymore
+    g.formatters_prefetched = {}
+    prefetch(view, models, [name for name, _ in view._export_columns])
+    return models
+
+
+def iter_records(view, query):
+    """
+    Generate records of (query) in its order, ids are read with a server side cursor
+    and records loaded by chunks so memory use doesn't depend on the number of records
+    """
+    chunk = []
+    for id, in query.with_entities(view.model.id).yield_per(ADMIN_EXPORT_CHUNK_SIZE):
+        chunk.append(id)
+        if len(chunk) == ADMIN_EXPORT_CHUNK_SIZE:
+            yield from _load_chunk(view, chunk)
+            chunk = []
+    if chunk:
+        yield from _load_chunk(view, chunk)
+
+
+class _Echo(object):
+    """
+    File like object returning written lines, for csv.writer
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(view, records):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([label for _, label in view._export_columns])
+    for model in records:
+        yield writer.writerow([export_value(model, name) for name, _ in view._export_columns])
+
+
+def write_xlsx(view, records, output):
+    """
+    :param output: file path or file object
+    """
+    options = {
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        'remove_timezone': True,
+        # Cells are data, never formulas or links
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    }
+    if isinstance(output, str):
+        # Rows are flushed to disk as they're written
+        options['constant_memory'] = True
+    else:
+        options['in_memory'] = True
+
+    workbook = xlsxwriter.Workbook(output, options)
+    sheet = workbook.add_worksheet()
+    sheet.write_row(0, 0, [label for _, label in view._export_columns])
+    for row, model in enumerate(records, 1):
+        sheet.write_row(row, 0, [export_value(model, name) for name, _ in view._export_columns])
+    workbook.close()
+
+
+def write_export(view, export_type, prefix=None):
+    """
+    Write export of records selected by current request arguments into (ADMIN_EXPORT_DIR)
+
+    :param prefix: file name prefix i.e id of the RQ job, export names are only unique per second
+    :return: written file name
+    """
+    os.makedirs(ADMIN_EXPORT_DIR, exist_ok=True)
+    remove_expired_exports()
+
+    _, query = get_export_query(view)
+    filename = secure_filename(view.get_export_name(export_type))
+    if prefix:
+        filename = '%s_%s' % (secure_filename(prefix), filename)
+    path = os.path.join(ADMIN_EXPORT_DIR, filename)
+    if export_type == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            for line in iter_csv(view, iter_records(view, query)):
+                f.write(line)
+    else:
+        write_xlsx(view, iter_records(view, query), path)
+    return filename
+
+
+def remove_expired_exports():
+    expired = time.time() - ADMIN_EXPORT_TTL
+    for filename in os.listdir(ADMIN_EXPORT_DIR):
+        path = os.path.join(ADMIN_EXPORT_DIR, filename)
+        if os.path.isfile(path) and os.path.getmtime(path) < expired:
+            os.remove(path)
+
+
+def export(view, export_type):
+    """
+    Response of export page, streamed file or redirection to the page of a background export
+    """
+    from .tasks import export_view
+
+    count, query = get_export_query(view)
+    if count is not None and count > ADMIN_EXPORT_SYNC_MAX_ROWS and get_redis() is not None:
+        job = queue.enqueue(
+            export_view, view.endpoint, export_type, request.query_string.decode('utf-8'),
+            timeout=ADMIN_EXPORT_JOB_TIMEOUT, result_ttl=ADMIN_EXPORT_TTL
+        )
+        return redirect(view.get_url('.export_job_view', job_id=job.id))
+
+    filename = secure_filename(view.get_export_name(export_type))
+    if export_type == 'csv':
+        return Response(
+            stream_with_context(iter_csv(view, iter_records(view, query))),
+            headers={'Content-Disposition': 'attachment;filename=%s' % filename},
+            mimetype='text/csv'
+        )
+
+    output = io.BytesIO()
+    write_xlsx(view, iter_records(view, query), output)
+    output.seek(0)
+    return send_file(output, mimetype=XLSX_MIMETYPE, as_attachment=True, attachment_filename=filename)
+
+
+def export_job(view, job_id):
+    """
+    Response of a background export page, the file once written
+    """
+    try:
+        job = Job.fetch(job_id, connection=conn)
+    except NoSuchJobError:
+        abort(404)
+    if not job.args or job.args[0] != view.endpoint:
+        abort(404)
+
+    if job.is_finished:
+        if not os.path.isfile(os.path.join(ADMIN_EXPORT_DIR, job.result)):
+            # Written on a worker host not sharing (ADMIN_EXPORT_DIR) or expired
+            flash('Export file is not available anymore, please export again', 'error')
+            return redirect(view.get_url('.index_view'))
+        # Downloaded without the job id prefix
+        return send_from_directory(
+            ADMIN_EXPORT_DIR, job.result, as_attachment=True, attachment_filename=job.result.split('_', 1)[-1]
+        )
+    if job.is_failed:
+        flash('Export failed, please try again or narrow it down with filters', 'error')
+        return redirect(view.get_url('.index_view'))
+    return view.render('admin/model/export.html', job=job)
@@ -1,13 +1,33 @@
 from datetime import datetime
 from itertools import cycle
+
+from flask import g
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.collections import InstrumentedList
+from sqlalchemy.orm.interfaces import MANYTOONE
 from jinja2 import Markup
-from flask_misaka import markdown
+
+from crm.db import db, chunks
+from crm.markdown_cache import render_markdown
+
+
+def get_value(model, name):
+    """
+    Value of (model.name) prefetched for the current page if any, see prefetch()
+    """
+    prefetched = getattr(g, 'formatters_prefetched', None)
+    if prefetched:
+        key = (model.__class__, getattr(model, 'id', None), name)
+        if key in prefetched:
+            return prefetched[key]
+    return getattr(model, name)
 
 
 def format_instrumented_list(view, context, model, name):
 
-    value = getattr(model, name)
+    value = get_value(model, name)
     out = ""
     if isinstance(value, InstrumentedList):
         out = "<ul>"
@@ -24,7 +44,7 @@ def format_instrumented_list(view, context, model, name):
 
 
 def format_tasks(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     out = ""
     if isinstance(value, InstrumentedList):
         out = "<ul>"
@@ -45,19 +65,19 @@ def format_tasks(view, context, model, name):
 
 
 def format_url(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if value:
         return Markup("<a href='{url}'>{url}</a>".format(url=value))
 
 
 def format_datetime(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if isinstance(value, datetime):
         return value.strftime("%Y-%m-%d")
 
 
 def format_messages(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     out = "<ul>"
 
     auto_tasks = []
@@ -80,7 +100,7 @@ def format_messages(view, context, model, name):
     return Markup(out)
 
 def format_referrer1_deals(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     out = ""
     if isinstance(value, InstrumentedList):
         out = "<ul>"
@@ -97,7 +117,7 @@ def format_referrer1_deals(view, context, model, name):
 
 
 def format_comments(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     out = ""
 
     if isinstance(value, InstrumentedList):
@@ -113,13 +133,13 @@ def format_comments(view, context, model, name):
 
 
 def format_markdown(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if value:
-        return markdown(value)
+        return render_markdown(value)
     return value
 
 def format_emails(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
     out = "<ul>"
@@ -130,7 +150,7 @@ def format_emails(view, context, model, name):
 
 
 def format_telephones(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
     out = "<ul>"
@@ -141,14 +161,14 @@ def format_telephones(view, context, model, name):
 
 
 def format_notification_emails(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     formatted_values = [
         '<a href="mailto:{email}">{email}</a>'.format(email=item) for item in value]
     return Markup(", ".join(formatted_values))
 
 
 def format_images(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
     out = "<ul>"
@@ -161,7 +181,7 @@ def format_images(view, context, model, name):
 
 
 def format_image(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
 
@@ -169,14 +189,14 @@ def format_image(view, context, model, name):
 
 
 def format_author(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
     return value
 
 
 def format_user_no_markup(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
 
@@ -184,7 +204,7 @@ def format_user_no_markup(view, context, model, name):
 
 
 def format_time_sent(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
     return value.strftime('%H:%M:%S %p %Z').strip()
@@ -195,13 +215,13 @@ format_end=  format_datetime
 
 
 def format_last_login(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
     return value.strftime('%Y-%b-%d %H:%M:%S %p %Z').strip()
 
 def format_user(view, context, model, name):
-    value = getattr(model, name)
+    value = get_value(model, name)
     if not value:
         return ''
     return Markup('<a href="/user/details/?id={id}">{username}</a>'.format(id=value.id, username=value.username))
@@ -230,3 +250,125 @@ column_formatters = {**column_formatters, **
 
 column_formatters = {**column_formatters, **
                      dict(list(zip(["description", "bio", "belief_statement", "content"], cycle([format_markdown]))))}
+
+
+def _prefetch_relationship(model_class, models, name, nested=()):
+    """
+    Load relationship (name) of all (models) and relationships (nested) of its items
+    using one query per relationship
+    """
+    relationship = sa_inspect(model_class).relationships.get(name)
+    if relationship is None or relationship.lazy == 'dynamic':
+        return
+
+    option = subqueryload(getattr(model_class, name)) if relationship.uselist else joinedload(getattr(model_class, name))
+    target = relationship.mapper
+    for nested_name in nested:
+        if nested_name in target.relationships:
+            option = option.joinedload(getattr(target.class_, nested_name))
+
+    # Loaded instances are the ones in the page (identity map), their unloaded relationship gets populated
+    unloaded = [m.id for m in models if name in sa_inspect(m).unloaded]
+    for ids in chunks(unloaded):
+        db.session.query(model_class).filter(model_class.id.in_(ids)).options(option).all()
+
+    items = []
+    for model in models:
+        value = getattr(model, name)
+        g.formatters_prefetched[(model_class, model.id, name)] = value
+        if relationship.uselist:
+            items.extend(value)
+        elif value is not None:
+            items.append(value)
+
+    # Relationships loaded before (i.e by the eager load plan of the view) don't have nested ones
+    for nested_name in nested:
+        _prefetch_nested(target, [i for i in items if nested_name in sa_inspect(i).unloaded], nested_name)
+
+
+def _prefetch_nested(mapper, items, name):
+    """
+    Load relationship (name) of (items) of (mapper) class
+    Many to one relationships i.e (assignee) of tasks are loaded by one IN query on the foreign keys of items
+    """
+    relationship = mapper.relationships.get(name)
+    if not items or relationship is None or relationship.lazy == 'dynamic':
+        return
+
+    if relationship.direction is MANYTOONE and len(relationship.local_remote_pairs) == 1:
+        local, remote = relationship.local_remote_pairs[0]
+        local_key = mapper.get_property_by_column(local).key
+        target = relationship.mapper
+        remote_attribute = getattr(target.class_, target.get_property_by_column(remote).key)
+
+        keys = {getattr(item, local_key) for item in items} - {None}
+        found = {}
+        for chunk in chunks(list(keys)):
+            for obj in db.session.query(target.class_).filter(remote_attribute.in_(chunk)):
+                found[getattr(obj, remote_attribute.key)] = obj
+        for item in items:
+            # Set as loaded, not as a change
+            set_committed_value(item, name, found.get(getattr(item, local_key)))
+        return
+
+    option = subqueryload(getattr(mapper.class_, name)) if relationship.uselist else joinedload(getattr(mapper.class_, name))
+    for ids in chunks([item.id for item in items]):
+        db.session.query(mapper.class_).filter(mapper.class_.id.in_(ids)).options(option).all()
+
+
+def _prefetch_authors(model_class, models, name):
+    """
+    (author_last) & (author_original) are properties querying a user each, load all users of the page at once
+    """
+    from crm.apps.user.models import User
+
+    if not isinstance(getattr(model_class, name, None), property):
+        return
+
+    ids = {getattr(m, name + '_id') for m in models} - {None}
+    users = {}
+    for chunk in chunks(list(ids)):
+        users.update((u.id, u) for u in User.query.filter(User.id.in_(chunk)))
+
+    for model in models:
+        g.formatters_prefetched[(model_class, model.id, name)] = users.get(getattr(model, name + '_id'))
+
+
+# {formatter: relationships of rendered items it uses}
+# columns rendered by these formatters are loaded for a whole page at once, see prefetch()
+prefetched_formatters = {
+    format_instrumented_list: (),
+    format_tasks: ('assignee',),
+    format_messages: ('user',),
+    format_referrer1_deals: (),
+    format_comments: (),
+    format_emails: (),
+    format_telephones: (),
+    format_images: (),
+}
+
+
+def prefetch(view, models, names):
+    """
+    Prefetch phase of formatters, run once per page before rendering rows
+
+    Gathers everything formatters of (names) columns need for all (models)
+    into a per request lookup (flask.g) so each formatter renders from memory
+    instead of querying per row
+
+    :param view: model view rendering the page
+    :param models: models of the page
+    :param names: rendered column names
+    """
+    if not models:
+        return
+    if getattr(g, 'formatters_prefetched', None) is None:
+        g.formatters_prefetched = {}
+
+    model_class = models[0].__class__
+    for name in names:
+        formatter = view.column_formatters.get(name)
+        if formatter is format_author:
+            _prefetch_authors(model_class, models, name)
+        elif formatter in prefetched_formatters:
+            _prefetch_relationship(model_class, models, name, prefetched_formatters[formatter])
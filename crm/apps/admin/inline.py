@@ -0,0 +1,156 @@
+"""
+Windowed inline editing of collections in edit forms (inline_models)
+
+flask-admin builds one subform per child record on every edit page & POST,
+i.e thousands of message subforms for a busy contact. Here edit forms see collections
+through an InlineWindow instead of loading them:
+
+- edit pages render the newest (ADMIN_INLINE_WINDOW_SIZE) children, "Load more" renders the next
+  ones (keyset, see crm.apps.admin.panels.keyset_page) into the same table
+- unchanged rows aren't submitted (disabled by edit page before submit)
+- on POST only submitted rows are loaded, validated and applied: changed rows are updated,
+  checked rows deleted, new rows added. Other children aren't touched
+"""
+
+from sqlalchemy import inspect as sa_inspect
+from flask_admin.contrib.sqla.fields import InlineModelFormList
+from flask_admin.contrib.sqla.form import InlineModelConverter
+from wtforms.utils import unset_value
+
+from crm.settings import ADMIN_INLINE_WINDOW_SIZE
+from .ajax import get_ajax_refs
+from .panels import keyset_page
+
+
+class InlineWindow(object):
+    """
+    Collection (name) of (parent) as seen by edit forms, not loaded
+    """
+
+    def __init__(self, parent, name):
+        self.parent = parent
+        self.name = name
+        self.model = sa_inspect(parent.__class__).relationships[name].mapper.class_
+
+    def query(self):
+        return self.model.query.with_parent(self.parent, self.name)
+
+    def rows(self, after=None, size=ADMIN_INLINE_WINDOW_SIZE):
+        """
+        :return: (children, whether there are more children)
+        """
+        return keyset_page(self.query(), self.model, after, size)
+
+    def get(self, ids):
+        """
+        :return: {id: child} of children (ids), ids of other records are ignored
+        :rtype: dict
+        """
+        if not ids:
+            return {}
+        return {child.id: child for child in self.query().filter(self.model.id.in_(ids))}
+
+
+class InlineFormObject(object):
+    """
+    Record given to edit forms, windowed collections are InlineWindow instead of loaded lists
+    """
+
+    def __init__(self, obj, windowed):
+        self._obj = obj
+        self._windowed = windowed
+
+    def __getattr__(self, name):
+        if name in self._windowed:
+            return InlineWindow(self._obj, name)
+        return getattr(self._obj, name)
+
+
+class WindowedInlineModelFormList(InlineModelFormList):
+    """
+    Inline model form list of a window of the collection, see module doc
+    """
+
+    window = None
+
+    # Whether collection has children after the rendered ones
+    window_more = False
+
+    def process(self, formdata, data=unset_value):
+        self.window = data if isinstance(data, InlineWindow) else None
+        self._posted = {}
+        if self.window is not None:
+            if formdata:
+                # Children of submitted rows in rows order, None for new rows
+                indices = sorted(set(self._extract_indices(self.name, formdata)))
+                ids = [formdata.get('%s-%d-%s' % (self.name, index, self._pk)) for index in indices]
+                self._posted = self.window.get([id for id in ids if id])
+                data = [self._posted.get(id) if id else None for id in ids]
+            else:
+                data, self.window_more = self.window.rows()
+        return super(WindowedInlineModelFormList, self).process(formdata, data)
+
+    def load_window(self, after, start):
+        """
+        Replace entries by children after child (after), numbered from (start)
+        i.e for "Load more" of an edit page
+        """
+        rows, self.window_more = self.window.rows(after)
+        self.entries = []
+        self.last_index = start - 1
+        for row in rows:
+            self._add_entry(None, row)
+
+    def window_more_args(self):
+        """
+        :return: url arguments of next rows or None if all rows are rendered
+        :rtype: dict
+        """
+        if self.window is None or not self.window_more or not self.entries:
+            return None
+        return {
+            'id': self.window.parent.id,
+            'name': self.short_name,
+            'after': self.entries[-1].get_pk(),
+            'start': self.last_index + 1,
+        }
+
+    def populate_obj(self, obj, name):
+        if self.window is None:
+            # Create form, the collection is new
+            return super(WindowedInlineModelFormList, self).populate_obj(obj, name)
+
+        reverse = sa_inspect(self.model).relationships.get(self.prop)
+        for field in self.entries:
+            field_id = field.get_pk()
+            is_created = not field_id
+            if is_created:
+                model = self.model()
+                if reverse is not None and not reverse.uselist:
+                    # Sets the foreign key without loading the parent collection
+                    setattr(model, self.prop, obj)
+                else:
+                    getattr(obj, name).append(model)
+                self.session.add(model)
+            else:
+                model = self._posted.get(field_id)
+                if model is None:
+                    # Child of another record or deleted meanwhile
+                    continue
+                if self.should_delete(field):
+                    self.session.delete(model)
+                    continue
+
+            field.populate_obj(model, None)
+            self.inline_view._on_model_change(field, model, is_created)
+
+
+class WindowedInlineModelConverter(InlineModelConverter):
+    inline_field_list_type = WindowedInlineModelFormList
+
+    def process_ajax_refs(self, info):
+        # Relationship select fields of inline forms are AJAX lookups too (crm.apps.admin.ajax)
+        refs = get_ajax_refs(info.model, self.session, prefix='%s-' % info.model.__name__.lower())
+        refs.update(getattr(info, 'form_ajax_refs', None) or {})
+        info.form_ajax_refs = refs
+        return super(WindowedInlineModelConverter, self).process_ajax_refs(info)
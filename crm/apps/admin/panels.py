@@ -0,0 +1,71 @@
+"""
+Paginated related panels of details pages
+
+Collections of a record (i.e messages of a contact) aren't rendered with its details page.
+The page has one placeholder per collection, the browser loads them once the record is shown,
+(ADMIN_DETAILS_PANEL_SIZE) items at a time, newest first. "Load more" asks for items after
+the last rendered one (keyset on created_at, id) so deep pages cost the same as the first one.
+"""
+
+from flask import g
+from sqlalchemy import and_, or_
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.collections import InstrumentedList
+
+from crm.db import db
+from .formatters import format_instrumented_list, prefetched_formatters
+
+
+def panel_page(view, model, name, after=None, size=20):
+    """
+    :param view: details page view
+    :param model: record of the details page
+    :param name: collection relationship i.e (messages)
+    :param after: id of last item already rendered
+    :param size: number of items
+    :return: (items, whether there are more items)
+    :rtype: tuple
+    """
+    target = sa_inspect(model.__class__).relationships[name].mapper
+    query = db.session.query(target.class_).with_parent(model, name)
+
+    # Relationships of items used by the formatter i.e assignees of tasks
+    formatter = view.column_formatters.get(name)
+    for nested in prefetched_formatters.get(formatter, ()):
+        if nested in target.relationships:
+            query = query.options(joinedload(getattr(target.class_, nested)))
+
+    return keyset_page(query, target.class_, after, size)
+
+
+def keyset_page(query, model_class, after=None, size=20):
+    """
+    One page of (query) records newest first, (after) the record of id (after)
+
+    :return: (records, whether there are more records)
+    :rtype: tuple
+    """
+    created_at, id = model_class.created_at, model_class.id
+    if after:
+        last = db.session.query(created_at).filter(id == after).scalar()
+        if last is None:
+            # Record deleted since last page was rendered
+            return [], False
+        query = query.filter(or_(created_at < last, and_(created_at == last, id < after)))
+
+    records = query.order_by(created_at.desc(), id.desc()).limit(size + 1).all()
+    return records[:size], len(records) > size
+
+
+def render_panel(view, model, name, items):
+    """
+    :return: (items) rendered by the formatter of column (name) as in details pages
+    """
+    if getattr(g, 'formatters_prefetched', None) is None:
+        g.formatters_prefetched = {}
+    # Formatters read the collection with get_value(), make them render this page only
+    g.formatters_prefetched[(model.__class__, model.id, name)] = InstrumentedList(items)
+
+    formatter = view.column_formatters.get(name, format_instrumented_list)
+    return formatter(view, None, model, name)
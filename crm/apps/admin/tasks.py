@@ -0,0 +1,20 @@
+# RQ tasks
+
+
+def export_view(endpoint, export_type, query_string):
+    """
+    Export records of admin view (endpoint) selected by list page arguments (query_string).
+    Enqueued by crm.apps.admin.exports.export for big exports
+
+    :return: name of written file in ADMIN_EXPORT_DIR
+    """
+    from rq import get_current_job
+
+    from crm import app
+    from .exports import write_export
+
+    view = next(v for v in app.admin._views if getattr(v, 'endpoint', None) == endpoint)
+    job = get_current_job()
+    # Filters, search & sort are parsed from request arguments by flask-admin
+    with app.test_request_context('/', query_string=query_string):
+        return write_export(view, export_type, prefix=job.id if job is not None else None)
@@ -17,18 +17,31 @@ from crm.apps.project.models import Project as ProjectModel
 from crm.apps.sprint.models import Sprint as SprintModel
 from crm.apps.task.models import Task as TaskModel
 from crm.apps.tag.models import Tag as TagModel
+from flask import Response
+from flask import abort
+from flask import current_app
+from flask import flash
+from flask import make_response
+from flask import redirect
 from flask import request
 from flask import session
 from flask_admin import AdminIndexView
 from flask_admin import form
 from flask_admin._compat import string_types
+from flask_admin.babel import gettext
 from flask_admin.base import expose
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.contrib.sqla import tools
 from flask_admin.contrib.sqla.tools import is_relationship
+from flask_admin.helpers import get_redirect_target
 from flask_admin.model.form import InlineFormAdmin
+from flask_admin.model.helpers import get_mdict_item_or_list
+from sqlalchemy import func
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import joinedload, subqueryload
 from wtforms import fields
 from wtforms.fields import StringField
+from wtforms.fields.core import UnboundField
 from wtforms.widgets import HTMLString
 
 from crm.apps.address.models import Address as AddressModel
@@ -36,10 +49,45 @@ from crm.apps.passport.models import Passport as PassportModel
 from crm.apps.link.models import Link as LinkModel
 from crm.apps.email.models import Email as EmailModel
 from crm.apps.phone.models import Phone as PhoneModel
+from crm.apps.search.index import search_condition
+from crm.cache import get_table_versions
+from crm.conditional import is_not_modified, record_etag, set_validators
 from crm.db import db
-from crm.settings import IMAGES_DIR
+from crm.settings import IMAGES_DIR, ADMIN_DETAILS_PANEL_SIZE
 from .converters import CustomAdminConverter
-from .formatters import column_formatters
+from .counts import CountQuery
+from . import exports
+from .ajax import get_ajax_refs
+from .inline import InlineFormObject, WindowedInlineModelConverter, WindowedInlineModelFormList
+from .panels import panel_page, render_panel
+from .formatters import column_formatters, prefetch
+
+
+# {view class: instance} of views embedded in index, edit & details pages, see get_panel_view()
+_panel_views = {}
+
+
+def get_panel_view(view_class, model):
+    """
+    Get a view to be embedded in another page (filtered_objects)
+
+    Constructing a ModelView runs flask-admin scaffolding (forms, filters...)
+    so views registered in admin on app start are reused, other views are built once
+
+    :return: instance of (view_class) for (model)
+    :rtype: EnhancedModelView
+    """
+    view = _panel_views.get(view_class)
+    if view is None:
+        admin = getattr(current_app, 'admin', None)
+        for registered in admin._views if admin is not None else []:
+            if type(registered) is view_class and registered.model is model:
+                view = registered
+                break
+        else:
+            view = view_class(model, db.session)
+        _panel_views[view_class] = view
+    return view
 
 
 # Create customized index view class that handles login & registration
@@ -52,26 +100,20 @@ class MyAdminIndexView(AdminIndexView):
             filtered_objects = {}
 
             filtered_objects['tasksview'] = [
-                TaskModelView(TaskModel, db.session), self.mainfilter]
+                get_panel_view(TaskModelView, TaskModel), self.mainfilter]
             filtered_objects['contactsview'] = [
-                ContactModelView(ContactModel, db.session), self.mainfilter]
+                get_panel_view(ContactModelView, ContactModel), self.mainfilter]
             filtered_objects['ownstasksview'] = [
-                TaskModelView(TaskModel, db.session), 'assignee / Users / Id']
+                get_panel_view(TaskModelView, TaskModel), 'assignee / Users / Id']
 
             filtered_objects['companiesview'] = [
-                CompanyModelView(CompanyModel, db.session), self.mainfilter]
-            filtered_objects['messagesview'] = [MessageModelView(
-                MessageModel, db.session), self.mainfilter]
-            filtered_objects['projectsview'] = [ProjectModelView(
-                ProjectModel, db.session), self.mainfilter]
-            filtered_objects['sprintsview'] = [SprintModelView(
-                SprintModel, db.session), self.mainfilter]
-            filtered_objects['dealsview'] = [DealModelView(
-                DealModel, db.session), self.mainfilter]
-            filtered_objects['commentsview'] = [CommentModelView(
-                CommentModel, db.session), self.mainfilter]
-            filtered_objects['linksview'] = [LinkModelView(
-                LinkModel, db.session), self.mainfilter]
+                get_panel_view(CompanyModelView, CompanyModel), self.mainfilter]
+            filtered_objects['messagesview'] = [get_panel_view(MessageModelView, MessageModel), self.mainfilter]
+            filtered_objects['projectsview'] = [get_panel_view(ProjectModelView, ProjectModel), self.mainfilter]
+            filtered_objects['sprintsview'] = [get_panel_view(SprintModelView, SprintModel), self.mainfilter]
+            filtered_objects['dealsview'] = [get_panel_view(DealModelView, DealModel), self.mainfilter]
+            filtered_objects['commentsview'] = [get_panel_view(CommentModelView, CommentModel), self.mainfilter]
+            filtered_objects['linksview'] = [get_panel_view(LinkModelView, LinkModel), self.mainfilter]
             self._template_args['filtered_objects'] = filtered_objects
             self._template_args['current_user_id'] = session[
                 'user']['id'] if 'user' in session else ''
@@ -83,10 +125,12 @@ class EnhancedModelView(ModelView):
     columns_list_extra = ['author_last', 'updated_at']
     can_view_details = True
     can_export = True
+    export_types = list(exports.EXPORT_TYPES)
     column_formatters = column_formatters
     # create_modal = True
     # edit_modal = True
     model_form_converter = CustomAdminConverter
+    inline_model_form_converter = WindowedInlineModelConverter
     mainfilter = ""
 
     form_widget_args = {
@@ -123,13 +167,190 @@ class EnhancedModelView(ModelView):
 
     page_size = 200
 
+    # How list pages count rows, one of crm.apps.admin.counts.COUNT_STRATEGIES
+    count_strategy = 'cached'
+
+    # {(filter name, operation): url argument name} resolved by get_filter_arg_helper()
+    _filter_args = None
+
     def get_filter_arg_helper(self, filter_name, filter_op='equals'):
-        filters = self._filter_groups[filter_name].filters
-        position = list(self._filter_groups.keys()).index(filter_name)
+        if self._filter_args is None:
+            self._filter_args = {}
 
-        for f in filters:
-            if f['operation'] == filter_op:
-                return 'flt%d_%d' % (position, f['index'])
+        key = (filter_name, filter_op)
+        if key not in self._filter_args:
+            filters = self._filter_groups[filter_name].filters
+            position = list(self._filter_groups.keys()).index(filter_name)
+
+            self._filter_args[key] = None
+            for f in filters:
+                if f['operation'] == filter_op:
+                    self._filter_args[key] = 'flt%d_%d' % (position, f['index'])
+                    break
+        return self._filter_args[key]
+
+    # Relationships eager loaded by list view i.e ('currency', 'contact.owner')
+    # None means derived from column_list, see get_eager_load_paths()
+    column_eager_load = None
+
+    # [[(relationship attribute, uselist), ...] per path] resolved by get_eager_load_options()
+    _eager_load_plan = None
+
+    def get_eager_load_paths(self):
+        """
+        Override to customize relationships loaded with list pages rows
+
+        :return: relationship paths rendered by list view, i.e ('emails', 'currency')
+                 for column_list ('firstname', 'emails', 'currency.name')
+        :rtype: list
+        """
+        if self.column_eager_load is not None:
+            return list(self.column_eager_load)
+
+        paths = []
+        for column in self.column_list or []:
+            if not isinstance(column, string_types):
+                continue
+            model, path = self.model, []
+            for name in column.split('.'):
+                relationship = sa_inspect(model).relationships.get(name)
+                if relationship is None or relationship.lazy == 'dynamic':
+                    break
+                path.append(name)
+                model = relationship.mapper.class_
+            if path and '.'.join(path) not in paths:
+                paths.append('.'.join(path))
+        return paths
+
+    def get_eager_load_options(self):
+        """
+        Loader options of get_eager_load_paths(), many to one relationships are joined
+        to the list query, collections are loaded by one extra query each
+
+        :return: list of sqlalchemy loader options
+        """
+        if self._eager_load_plan is None:
+            plan = []
+            for path in self.get_eager_load_paths():
+                model, steps = self.model, []
+                for name in path.split('.'):
+                    relationship = sa_inspect(model).relationships[name]
+                    steps.append((getattr(model, name), relationship.uselist))
+                    model = relationship.mapper.class_
+                plan.append(steps)
+            self._eager_load_plan = plan
+
+        options = []
+        for steps in self._eager_load_plan:
+            option = None
+            for attribute, uselist in steps:
+                if option is None:
+                    option = subqueryload(attribute) if uselist else joinedload(attribute)
+                else:
+                    option = option.subqueryload(attribute) if uselist else option.joinedload(attribute)
+            options.append(option)
+        return options
+
+    def get_query(self):
+        return super().get_query().options(*self.get_eager_load_options())
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        """
+        Primary key is the last sort key, without it pages have no (or a partial) ORDER BY:
+        their rows could change between requests and collections subquery loaded by
+        re-running the LIMIT/OFFSET query (get_eager_load_options) could go to other rows
+        """
+        query, joins = super()._apply_sorting(query, joins, sort_column, sort_desc)
+        return query.order_by(self.model.id), joins
+
+    def get_count_query(self):
+        query = CountQuery([func.count('*')], session=self.session()).select_from(self.model)
+        query.count_strategy = self.count_strategy
+        return query
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        """
+        Search indexed models using the full text search index (crm.apps.search)
+        instead of ILIKE on every column_searchable_list column
+        """
+        condition = search_condition(self.model, search)
+        if condition is None:
+            return super()._apply_search(query, count_query, joins, count_joins, search)
+
+        query = query.filter(condition)
+        if count_query is not None:
+            count_query = count_query.filter(condition)
+        return query, count_query, joins, count_joins
+
+    def get_list(self, *args, **kwargs):
+        count, data = super().get_list(*args, **kwargs)
+        if isinstance(data, list):
+            # Loaded page (not a query i.e execute=False), formatters render it from memory
+            prefetch(self, data, [name for name, _ in self._list_columns])
+        return count, data
+
+    @expose('/export/<export_type>/')
+    def export(self, export_type):
+        """
+        Streaming export of raw values, see crm.apps.admin.exports
+        """
+        return_url = get_redirect_target() or self.get_url('.index_view')
+
+        if not self.can_export or export_type not in self.export_types:
+            flash(gettext('Permission denied.'), 'error')
+            return redirect(return_url)
+
+        return exports.export(self, export_type)
+
+    @expose('/export/job/<job_id>/')
+    def export_job_view(self, job_id):
+        return exports.export_job(self, job_id)
+
+    def _process_ajax_references(self):
+        """
+        Relationship select fields are AJAX lookups (crm.apps.admin.ajax),
+        form_ajax_refs of a view are added to or override them
+        """
+        refs = get_ajax_refs(self.model, self.session)
+        refs.update(self.__class__.form_ajax_refs or {})
+        self.form_ajax_refs = refs
+        return super()._process_ajax_references()
+
+    # Names of windowed inline collections of edit form, see edit_form()
+    _inline_window_names = None
+
+    def edit_form(self, obj=None):
+        """
+        Collections of inline_models are seen by the form as windows, not loaded (crm.apps.admin.inline)
+        """
+        if self._inline_window_names is None:
+            form_class = self._edit_form_class
+            self._inline_window_names = {
+                name for name in dir(form_class)
+                if isinstance(getattr(form_class, name), UnboundField)
+                and issubclass(getattr(form_class, name).field_class, WindowedInlineModelFormList)
+            }
+        if obj is not None and self._inline_window_names:
+            obj = InlineFormObject(obj, self._inline_window_names)
+        return super().edit_form(obj=obj)
+
+    @expose('/edit/inline/', methods=('GET',))
+    def edit_inline_view(self):
+        """
+        Next rows of a windowed inline collection of edit page
+        i.e /contact/edit/inline/?id=x&name=messages&after={id of last row}&start={index of next row}
+        """
+        if not self.can_edit:
+            abort(404)
+        model = self.get_one(request.args.get('id', ''))
+        if model is None:
+            abort(404)
+
+        field = self.edit_form(obj=model)._fields.get(request.args.get('name'))
+        if not isinstance(field, WindowedInlineModelFormList):
+            abort(404)
+        field.load_window(request.args.get('after'), request.args.get('start', 0, type=int))
+        return self.render('admin/model/inline_rows.html', field=field)
 
     @expose('/edit/', methods=('GET', 'POST'))
     def edit_view(self):
@@ -137,57 +358,140 @@ class EnhancedModelView(ModelView):
             filtered_objects = {}
 
             filtered_objects['tasksview'] = [
-                TaskModelView(TaskModel, db.session), self.mainfilter]
-            filtered_objects['contactsview'] = [ContactModelView(
-                ContactModel, db.session), self.mainfilter]
+                get_panel_view(TaskModelView, TaskModel), self.mainfilter]
+            filtered_objects['contactsview'] = [get_panel_view(ContactModelView, ContactModel), self.mainfilter]
             # filtered_objects['eventsview'] = [EventModelView(
             #     EventModel, db.session), self.mainfilter]
 
             filtered_objects['companiesview'] = [
-                CompanyModelView(CompanyModel, db.session), self.mainfilter]
-            filtered_objects['messagesview'] = [MessageModelView(
-                MessageModel, db.session), self.mainfilter]
-            filtered_objects['projectsview'] = [ProjectModelView(
-                ProjectModel, db.session), self.mainfilter]
-            filtered_objects['sprintsview'] = [SprintModelView(
-                SprintModel, db.session), self.mainfilter]
-            filtered_objects['dealsview'] = [DealModelView(
-                DealModel, db.session), self.mainfilter]
-            filtered_objects['commentsview'] = [CommentModelView(
-                CommentModel, db.session), self.mainfilter]
-            filtered_objects['linksview'] = [LinkModelView(
-                LinkModel, db.session), self.mainfilter]
+                get_panel_view(CompanyModelView, CompanyModel), self.mainfilter]
+            filtered_objects['messagesview'] = [get_panel_view(MessageModelView, MessageModel), self.mainfilter]
+            filtered_objects['projectsview'] = [get_panel_view(ProjectModelView, ProjectModel), self.mainfilter]
+            filtered_objects['sprintsview'] = [get_panel_view(SprintModelView, SprintModel), self.mainfilter]
+            filtered_objects['dealsview'] = [get_panel_view(DealModelView, DealModel), self.mainfilter]
+            filtered_objects['commentsview'] = [get_panel_view(CommentModelView, CommentModel), self.mainfilter]
+            filtered_objects['linksview'] = [get_panel_view(LinkModelView, LinkModel), self.mainfilter]
 
             self._template_args['filtered_objects'] = filtered_objects
         return super().edit_view()
 
+    # Tables rendered in details page of this model, see details_tables()
+    _details_tables = None
+
+    # Models listed in related panels of details page (filtered_objects)
+    details_panels_models = [
+        TaskModel, ContactModel, EventModel, CompanyModel, MessageModel,
+        ProjectModel, SprintModel, DealModel, CommentModel, LinkModel
+    ]
+
+    # Collections rendered in details page as paginated panels loaded by the browser (crm.apps.admin.panels)
+    # None means collections of (details_panels_models) in column_details_list, see get_details_lazy_columns()
+    column_details_lazy = None
+
+    details_panel_size = ADMIN_DETAILS_PANEL_SIZE
+
+    _details_lazy_columns = None
+
+    def get_details_lazy_columns(self):
+        """
+        :return: names of details columns rendered as lazy panels i.e ('tasks', 'messages')
+        :rtype: set
+        """
+        if self._details_lazy_columns is None:
+            if self.column_details_lazy is not None:
+                self._details_lazy_columns = set(self.column_details_lazy)
+            else:
+                relationships = sa_inspect(self.model).relationships
+                self._details_lazy_columns = {
+                    name for name in self.column_details_list or []
+                    if isinstance(name, string_types) and name in relationships
+                    and relationships[name].uselist
+                    and relationships[name].mapper.class_ in self.details_panels_models
+                }
+        return self._details_lazy_columns
+
+    def details_tables(self):
+        """
+        :return: names of all tables a details page depends on, the model table,
+                 tables of its relations and of related panels models
+        :rtype: set
+        """
+        if self._details_tables is None:
+            tables = {self.model.__table__.name}
+            for relation in sa_inspect(self.model).relationships:
+                tables.add(relation.mapper.local_table.name)
+                if relation.secondary is not None:
+                    tables.add(relation.secondary.name)
+            if self.mainfilter:
+                tables.update(m.__table__.name for m in self.details_panels_models)
+            self._details_tables = tables
+        return self._details_tables
+
     @expose('/details/', methods=('GET',))
     def details_view(self):
+        """
+        Details pages are answered with an ETag derived from (model, id, updated_at)
+        and versions of related tables, (304) if browser copy is up to date
+
+        Denied & missing records are redirected by flask-admin, pages with pending
+        flashed messages are always rendered so messages show on the page they're for
+        """
+        etag = None
+        id = get_mdict_item_or_list(request.args, 'id')
+        if self.can_view_details and id is not None and not session.get('_flashes'):
+            # Same instance (identity map) is rendered by flask-admin details_view
+            model = self.get_one(id)
+            if model is not None:
+                etag = record_etag(self.model, model.id, model.updated_at, get_table_versions(self.details_tables()))
+                if is_not_modified(etag):
+                    return set_validators(Response(status=304), etag)
+
+        response = make_response(self._render_details_view())
+        if etag is not None and response.status_code == 200:
+            set_validators(response, etag)
+        return response
+
+    @expose('/details/panel/', methods=('GET',))
+    def details_panel_view(self):
+        """
+        One page of a lazy panel of details page
+        i.e /contact/details/panel/?id=x&name=messages&after={id of last rendered message}
+        """
+        name = request.args.get('name')
+        after = request.args.get('after')
+        if not self.can_view_details or name not in self.get_details_lazy_columns():
+            abort(404)
+        model = self.get_one(request.args.get('id', ''))
+        if model is None:
+            abort(404)
+
+        items, more = panel_page(self, model, name, after, self.details_panel_size)
+        if not items and not after:
+            return ''
+        next_url = self.get_url('.details_panel_view', id=model.id, name=name, after=items[-1].id) if more else None
+        return self.render(
+            'admin/model/details_panel.html', content=render_panel(self, model, name, items), next_url=next_url
+        )
+
+    def _render_details_view(self):
+        self._template_args['details_lazy_columns'] = self.get_details_lazy_columns()
         if self.mainfilter:
             filtered_objects = {}
             filtered_objects['tasksview'] = [
-                TaskModelView(TaskModel, db.session), self.mainfilter]
+                get_panel_view(TaskModelView, TaskModel), self.mainfilter]
             filtered_objects['ownstasksview'] = [
-                TaskModelView(TaskModel, db.session), 'assignee / Users / Id']
-            filtered_objects['contactsview'] = [ContactModelView(
-                ContactModel, db.session), self.mainfilter]
-            filtered_objects['eventsview'] = [EventModelView(
-                EventModel, db.session), self.mainfilter]
+                get_panel_view(TaskModelView, TaskModel), 'assignee / Users / Id']
+            filtered_objects['contactsview'] = [get_panel_view(ContactModelView, ContactModel), self.mainfilter]
+            filtered_objects['eventsview'] = [get_panel_view(EventModelView, EventModel), self.mainfilter]
 
             filtered_objects['companiesview'] = [
-                CompanyModelView(CompanyModel, db.session), self.mainfilter]
-            filtered_objects['messagesview'] = [MessageModelView(
-                MessageModel, db.session), self.mainfilter]
-            filtered_objects['projectsview'] = [ProjectModelView(
-                ProjectModel, db.session), self.mainfilter]
-            filtered_objects['sprintsview'] = [SprintModelView(
-                SprintModel, db.session), self.mainfilter]
-            filtered_objects['dealsview'] = [DealModelView(
-                DealModel, db.session), self.mainfilter]
-            filtered_objects['commentsview'] = [CommentModelView(
-                CommentModel, db.session), self.mainfilter]
-            filtered_objects['linksview'] = [LinkModelView(
-                LinkModel, db.session), self.mainfilter]
+                get_panel_view(CompanyModelView, CompanyModel), self.mainfilter]
+            filtered_objects['messagesview'] = [get_panel_view(MessageModelView, MessageModel), self.mainfilter]
+            filtered_objects['projectsview'] = [get_panel_view(ProjectModelView, ProjectModel), self.mainfilter]
+            filtered_objects['sprintsview'] = [get_panel_view(SprintModelView, SprintModel), self.mainfilter]
+            filtered_objects['dealsview'] = [get_panel_view(DealModelView, DealModel), self.mainfilter]
+            filtered_objects['commentsview'] = [get_panel_view(CommentModelView, CommentModel), self.mainfilter]
+            filtered_objects['linksview'] = [get_panel_view(LinkModelView, LinkModel), self.mainfilter]
 
             self._template_args['filtered_objects'] = filtered_objects
         return super().details_view()
@@ -747,6 +1051,8 @@ class TaskModelView(EnhancedModelView):
 
     ]
 
+    count_strategy = 'estimate'
+
 
 class MessageModelView(EnhancedModelView):
     column_list = ('author_original', 'title', 'short_content','user',
@@ -763,6 +1069,8 @@ class MessageModelView(EnhancedModelView):
 
     can_edit = False
 
+    count_strategy = 'estimate'
+
 class TaskAssignmentModelView(EnhancedModelView):
     column_list = ('percent_completed', 'contact',
                    'task', *EnhancedModelView.columns_list_extra)
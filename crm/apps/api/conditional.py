@@ -0,0 +1,69 @@
+"""
+ETag / Last-Modified of graphql query responses, computed before execution
+
+- A query reading one record by uid i.e { deal(uid: "d7y2t") { name value } }
+  and nothing but that record's table, is validated by (model, uid, updated_at)
+  using one indexed query
+- Any other read only query is validated by version counters of all tables it reads
+- Mutations and queries whose tables can't be determined get no validators
+"""
+
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.type.definition import get_named_type
+
+from crm.conditional import record_etag, tables_etag
+from crm.db import db
+from .response_cache import NotCacheable, document_tables, get_type_model
+
+
+def _single_record(schema, document, tables, variables=None):
+    """
+    :return: (model, uid) if document reads one record by uid and nothing else
+    :rtype: tuple
+    """
+    operations = [d for d in document.definitions if isinstance(d, ast.OperationDefinition)]
+    if len(operations) != 1 or len(operations[0].selection_set.selections) != 1:
+        return None
+
+    field = operations[0].selection_set.selections[0]
+    if not isinstance(field, ast.Field):
+        return None
+
+    field_def = schema.get_query_type().fields.get(field.name.value)
+    model = get_type_model(get_named_type(field_def.type)) if field_def is not None else None
+    if model is None or tables != {model.__table__.name}:
+        return None
+
+    for argument in field.arguments or []:
+        if argument.name.value != 'uid':
+            continue
+        if isinstance(argument.value, ast.Variable):
+            return model, (variables or {}).get(argument.value.name.value)
+        if isinstance(argument.value, ast.StringValue):
+            return model, argument.value.value
+    return None
+
+
+def document_validators(schema, document, variables=None, operation_name=None):
+    """
+    :return: (etag, last_modified), (None, None) if response can't be validated
+    :rtype: tuple
+    """
+    try:
+        tables = document_tables(schema, document)
+    except NotCacheable:
+        return None, None
+
+    key = [print_ast(document), variables or {}, operation_name]
+
+    record = _single_record(schema, document, tables, variables)
+    if record is not None:
+        model, uid = record
+        updated_at = db.session.query(model.updated_at).filter(model.id == uid).scalar()
+        if updated_at is None:
+            # Not found, let the query answer it
+            return None, None
+        return record_etag(model, uid, updated_at, key), updated_at
+
+    return tables_etag(tables, key), None
@@ -0,0 +1,95 @@
+import graphene
+from graphene import relay
+from graphene_sqlalchemy import SQLAlchemyObjectType
+from graphql.error.base import GraphQLError
+
+from crm.db import chunks
+from crm.graphql import BaseQuery
+
+
+def get_node_types(info):
+    """
+    :return: {type name: graphene type} of all model types implementing relay Node
+    :rtype: dict
+    """
+    types = {}
+    for name, graphql_type in info.schema.get_type_map().items():
+        graphene_type = getattr(graphql_type, 'graphene_type', None)
+        if isinstance(graphene_type, type) and issubclass(graphene_type, SQLAlchemyObjectType) \
+                and relay.Node in graphene_type._meta.interfaces:
+            types[name] = graphene_type
+    return types
+
+
+class NodeQuery(BaseQuery):
+    """
+    Fetch many records of any types at once
+
+    {
+      nodes(uids: ["RGVhbDpkN3kydA==", "g30ty"], type: "Contact") {
+        ... on Deal { name }
+        ... on Contact { firstname }
+      }
+    }
+    """
+    # Arguments given as (args), (type) is a parameter of graphene.Field itself
+    nodes = graphene.Field(
+        graphene.List(relay.Node),
+        args={
+            'uids': graphene.List(graphene.String, required=True),
+            'type': graphene.String(description='Type of raw uids, they are looked up in all types if not given'),
+        }
+    )
+
+    def resolve_nodes(self, info, uids, type=None):
+        node_types = get_node_types(info)
+        if type is not None and type not in node_types:
+            raise GraphQLError('Invalid type (%s)' % type)
+
+        # {type name: set(ids)}
+        wanted = {}
+        # [(type name or None, id)] in input order
+        keys = []
+        raw = set()
+
+        for uid in uids:
+            try:
+                type_name, id = relay.Node.from_global_id(uid)
+            except Exception:
+                type_name, id = None, None
+            if type_name not in node_types or not id:
+                # Raw uid
+                type_name, id = type, uid
+            if type_name is None:
+                raw.add(id)
+            else:
+                wanted.setdefault(type_name, set()).add(id)
+            keys.append((type_name, id))
+
+        if raw:
+            for type_name in node_types:
+                wanted.setdefault(type_name, set()).update(raw)
+
+        # {(type name, id): object}, one IN query per type
+        found = {}
+        # {raw uid: [objects]} to detect uids matching many types
+        raw_found = {}
+        for type_name, ids in wanted.items():
+            graphene_type = node_types[type_name]
+            model = graphene_type._meta.model
+            for chunk in chunks(list(ids)):
+                for obj in graphene_type.get_query(info).filter(model.id.in_(chunk)):
+                    found[(type_name, obj.id)] = obj
+                    if obj.id in raw:
+                        raw_found.setdefault(obj.id, []).append(obj)
+
+        result = []
+        for type_name, id in keys:
+            if type_name is not None:
+                result.append(found.get((type_name, id)))
+                continue
+            objs = raw_found.get(id, [])
+            if len(objs) > 1:
+                raise GraphQLError('uid (%s) matches many types, use a global id or (type) argument' % id)
+            result.append(objs[0] if objs else None)
+        return result
@@ -0,0 +1,204 @@
+"""
+Per field instrumentation of graphql execution
+
+(FieldInstrumentation) is a graphql middleware measuring, for every resolved field,
+time spent in its resolver and number of SQL statements executed meanwhile
+(including lazy loads triggered by the resolver).
+
+- When a request has (DEBUG_HEADER) header, a summary per path i.e (contacts.edges.node.deals)
+  is returned in the response (extensions)
+- When (GRAPHQL_FIELD_METRICS) is enabled, timings of every request are aggregated
+  per field i.e (Contact.deals) into histograms, kept in Redis (shared by all workers)
+  or in process, and exported on (/api/metrics) in prometheus text format
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+
+from graphql.execution.middleware import MiddlewareManager
+from sqlalchemy.engine import Engine
+from sqlalchemy.event import listen
+
+from crm.cache import get_redis
+
+DEBUG_HEADER = 'X-CRM-Debug'
+
+# Upper bounds (milliseconds) of histogram buckets
+BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+METRICS_REDIS_KEY = 'crm:graphql_field_metrics'
+
+_current = threading.local()
+
+_local_metrics = {}
+_local_metrics_lock = threading.Lock()
+
+
+def count_sql_statements(conn, cursor, statement, parameters, context, executemany):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats['sql'] += 1
+
+
+listen(Engine, 'before_cursor_execute', count_sql_statements)
+
+
+def _is_scalar(value):
+    return value is None or isinstance(value, (str, bytes, int, float, bool, Enum))
+
+
+class FieldInstrumentation(object):
+    """
+    Graphql middleware, one instance per executed operation
+    """
+
+    def __init__(self):
+        # {path: {'field': 'Type.field', 'calls': n, 'time': ms, 'sql': n}}
+        self.paths = OrderedDict()
+        # {id(resolved object): (resolved object, path)} to find path of child fields,
+        # objects are kept referenced so their ids aren't reused by other objects during the operation
+        self._objects = {}
+
+    def resolve(self, next, root, info, **args):
+        field_ast = info.field_asts[0]
+        name = (field_ast.alias or field_ast.name).value
+        parent = self._objects.get(id(root))
+        path = (parent[1] if parent is not None and parent[0] is root else ()) + (name,)
+
+        stats = self.paths.get(path)
+        if stats is None:
+            stats = self.paths[path] = {
+                'field': '%s.%s' % (info.parent_type.name, info.field_name),
+                'calls': 0,
+                'time': 0.0,
+                'sql': 0
+            }
+
+        previous = getattr(_current, 'stats', None)
+        _current.stats = stats
+        start = time.perf_counter()
+        try:
+            result = next(root, info, **args)
+        finally:
+            stats['time'] += (time.perf_counter() - start) * 1000
+            stats['calls'] += 1
+            _current.stats = previous
+
+        if not _is_scalar(result):
+            self._objects[id(result)] = (result, path)
+            if isinstance(result, (list, tuple)):
+                for item in result:
+                    if not _is_scalar(item):
+                        self._objects[id(item)] = (item, path)
+        return result
+
+    def middleware(self):
+        """
+        :return: middleware to be passed to graphql execute()
+        """
+        # Resolvers results are measured as they are, not wrapped in promises
+        return MiddlewareManager(self, wrap_in_promise=False)
+
+    def summary(self):
+        """
+        :return: debug summary to be returned in response extensions
+        :rtype: dict
+        """
+        return {
+            'fields': [
+                OrderedDict([
+                    ('path', '.'.join(path)),
+                    ('field', stats['field']),
+                    ('calls', stats['calls']),
+                    ('time_ms', round(stats['time'], 3)),
+                    ('sql', stats['sql']),
+                ])
+                for path, stats in self.paths.items()
+            ],
+            'total_time_ms': round(sum(s['time'] for s in self.paths.values()), 3),
+            'total_sql': sum(s['sql'] for s in self.paths.values()),
+        }
+
+    def record_metrics(self):
+        """
+        Add timings of this operation to per field histograms
+        """
+        # {(field, metric): increment}
+        increments = {}
+        for stats in self.paths.values():
+            # Average call time, a list field resolved for many parents counts as many calls
+            per_call = stats['time'] / stats['calls'] if stats['calls'] else 0
+            bucket = next((str(b) for b in BUCKETS if per_call <= b), '+Inf')
+            for metric, value in (
+                    ('bucket:%s' % bucket, stats['calls']),
+                    ('count', stats['calls']),
+                    ('sum', stats['time']),
+                    ('sql', stats['sql'])):
+                key = (stats['field'], metric)
+                increments[key] = increments.get(key, 0) + value
+
+        if not increments:
+            return
+
+        redis = get_redis()
+        if redis is None:
+            with _local_metrics_lock:
+                for key, value in increments.items():
+                    _local_metrics[key] = _local_metrics.get(key, 0) + value
+            return
+
+        pipe = redis.pipeline(transaction=False)
+        for (field, metric), value in increments.items():
+            if metric == 'sum':
+                pipe.hincrbyfloat(METRICS_REDIS_KEY, '%s|%s' % (field, metric), value)
+            else:
+                pipe.hincrby(METRICS_REDIS_KEY, '%s|%s' % (field, metric), value)
+        pipe.execute()
+
+
+def get_metrics():
+    """
+    :return: {(field, metric): value} aggregated over all requests
+    :rtype: dict
+    """
+    redis = get_redis()
+    if redis is None:
+        with _local_metrics_lock:
+            return dict(_local_metrics)
+
+    metrics = {}
+    for key, value in redis.hgetall(METRICS_REDIS_KEY).items():
+        field, metric = key.decode('utf-8').split('|', 1)
+        metrics[(field, metric)] = float(value)
+    return metrics
+
+
+def render_metrics():
+    """
+    :return: per field histograms in prometheus text exposition format
+    :rtype: str
+    """
+    metrics = get_metrics()
+    fields = sorted(set(field for field, _ in metrics))
+
+    lines = [
+        '# HELP crm_graphql_field_duration_ms Time spent in graphql field resolvers',
+        '# TYPE crm_graphql_field_duration_ms histogram',
+    ]
+    for field in fields:
+        cumulative = 0
+        for bucket in [str(b) for b in BUCKETS] + ['+Inf']:
+            cumulative += metrics.get((field, 'bucket:%s' % bucket), 0)
+            lines.append('crm_graphql_field_duration_ms_bucket{field="%s",le="%s"} %d' % (field, bucket, cumulative))
+        lines.append('crm_graphql_field_duration_ms_sum{field="%s"} %f' % (field, metrics.get((field, 'sum'), 0)))
+        lines.append('crm_graphql_field_duration_ms_count{field="%s"} %d' % (field, metrics.get((field, 'count'), 0)))
+
+    lines.extend([
+        '# HELP crm_graphql_field_sql_statements_total SQL statements executed by graphql field resolvers',
+        '# TYPE crm_graphql_field_sql_statements_total counter',
+    ])
+    for field in fields:
+        lines.append('crm_graphql_field_sql_statements_total{field="%s"} %d' % (field, metrics.get((field, 'sql'), 0)))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,199 @@
+"""
+Limits applied on graphql queries before & while executing them
+
+- Static cost estimation on the validated query document, every field that
+  returns an object costs its weight (default 1) for each item it may return,
+  lists and connections multiply the cost of their sub selections by their
+  (first)/(last) argument or by (GRAPHQL_DEFAULT_LIST_SIZE) if not given
+- Depth limit, connection wrappers (edges & node) don't count as levels
+- Per request statement timeout on the database connection
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from graphql.language import ast
+from graphql.type.definition import GraphQLList, GraphQLNonNull, get_named_type
+
+from crm.db import db
+from crm.settings import GRAPHQL_MAX_COST, GRAPHQL_MAX_DEPTH, GRAPHQL_DEFAULT_LIST_SIZE
+
+# Extra weights for expensive fields {'TypeName.fieldName': weight}
+FIELD_WEIGHTS = {}
+
+
+class QueryLimitError(Exception):
+    pass
+
+
+def _is_list(graphql_type):
+    while isinstance(graphql_type, GraphQLNonNull):
+        graphql_type = graphql_type.of_type
+    return isinstance(graphql_type, GraphQLList)
+
+
+def _argument_value(node, variables):
+    if isinstance(node, ast.Variable):
+        return (variables or {}).get(node.name.value)
+    if isinstance(node, ast.IntValue):
+        return int(node.value)
+    return None
+
+
+def _multiplier(field_node, field_type, named_type, variables, default_list_size):
+    """
+    How many items a field may return
+    """
+    for argument in field_node.arguments or []:
+        if argument.name.value in ('first', 'last'):
+            value = _argument_value(argument.value, variables)
+            if value is not None:
+                return max(int(value), 0)
+
+    if _is_list(field_type) or named_type.name.endswith('Connection'):
+        return default_list_size
+    return 1
+
+
+def _is_connection_wrapper(parent_type, field_name):
+    return (parent_type.name.endswith('Connection') and field_name == 'edges') or \
+           (parent_type.name.endswith('Edge') and field_name == 'node')
+
+
+def estimate(schema, document, variables=None, operation_name=None, weights=None,
+             default_list_size=GRAPHQL_DEFAULT_LIST_SIZE):
+    """
+    Estimate cost and depth of a validated query document
+
+    :param schema: graphql schema
+    :param document: parsed & validated query document
+    :param variables: query variables
+    :param operation_name: operation to be executed, all operations are estimated if not given
+    :param weights: {'TypeName.fieldName': weight} overriding default weight of 1 for object fields
+    :param default_list_size: multiplier for lists & connections without (first) or (last)
+    :return: (cost, depth)
+    :rtype: tuple
+    """
+    weights = FIELD_WEIGHTS if weights is None else weights
+    fragments = {}
+    operations = []
+
+    for definition in document.definitions:
+        if isinstance(definition, ast.FragmentDefinition):
+            fragments[definition.name.value] = definition
+        elif isinstance(definition, ast.OperationDefinition):
+            if operation_name is None or (definition.name and definition.name.value == operation_name):
+                operations.append(definition)
+
+    type_map = schema.get_type_map()
+
+    def walk(parent_type, selection_set, visited_fragments):
+        """
+        :return: (cost, depth) of a selection set
+        """
+        cost, depth = 0, 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                if name in visited_fragments:
+                    continue
+                fragment = fragments[name]
+                c, d = walk(
+                    type_map[fragment.type_condition.name.value],
+                    fragment.selection_set,
+                    visited_fragments | {name}
+                )
+            elif isinstance(selection, ast.InlineFragment):
+                condition_type = parent_type
+                if selection.type_condition is not None:
+                    condition_type = type_map[selection.type_condition.name.value]
+                c, d = walk(condition_type, selection.selection_set, visited_fragments)
+            else:
+                name = selection.name.value
+                fields = getattr(parent_type, 'fields', None) or {}
+                if name.startswith('__') or name not in fields or selection.selection_set is None:
+                    # Scalars are fetched with their parent object
+                    continue
+
+                field_type = fields[name].type
+                named_type = get_named_type(field_type)
+                c, d = walk(named_type, selection.selection_set, visited_fragments)
+
+                # Items are counted on the connection field itself
+                if not _is_connection_wrapper(parent_type, name):
+                    weight = weights.get('%s.%s' % (parent_type.name, name), 1)
+                    c = _multiplier(selection, field_type, named_type, variables, default_list_size) * (weight + c)
+                    d += 1
+
+            cost += c
+            depth = max(depth, d)
+        return cost, depth
+
+    cost, depth = 0, 0
+    for operation in operations:
+        if operation.operation == 'mutation':
+            root_type = schema.get_mutation_type()
+        elif operation.operation == 'subscription':
+            root_type = schema.get_subscription_type()
+        else:
+            root_type = schema.get_query_type()
+        c, d = walk(root_type, operation.selection_set, frozenset())
+        cost, depth = max(cost, c), max(depth, d)
+    return cost, depth
+
+
+def check_query(schema, document, variables=None, operation_name=None,
+                max_cost=GRAPHQL_MAX_COST, max_depth=GRAPHQL_MAX_DEPTH):
+    """
+    Reject queries over budget before executing them
+
+    :raises QueryLimitError: if query is too deep or too expensive
+    :return: (cost, depth)
+    :rtype: tuple
+    """
+    cost, depth = estimate(schema, document, variables, operation_name)
+    if max_depth and depth > max_depth:
+        raise QueryLimitError('Query depth %d exceeds the maximum allowed depth %d' % (depth, max_depth))
+    if max_cost and cost > max_cost:
+        raise QueryLimitError(
+            'Query cost %d exceeds the maximum allowed cost %d, '
+            'use (first) argument to limit nested lists' % (cost, max_cost)
+        )
+    return cost, depth
+
+
+@contextmanager
+def statement_timeout(milliseconds):
+    """
+    Abort database statements running longer than (milliseconds)
+    within this block
+
+    - Postgres: (SET LOCAL statement_timeout) lasts till the end of current transaction
+    - Sqlite: progress handler interrupting statements after the deadline
+    """
+    if not milliseconds:
+        yield
+        return
+
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        connection.execute('SET LOCAL statement_timeout = %d' % int(milliseconds))
+        yield
+    elif dialect == 'sqlite':
+        # sqlite3 connection itself, the pool proxy is released by commits within the block
+        raw_connection = connection.connection.connection
+        deadline = time.time() + milliseconds / 1000.0
+        raw_connection.set_progress_handler(lambda: int(time.time() > deadline), 10000)
+        try:
+            yield
+        finally:
+            try:
+                raw_connection.set_progress_handler(None, 0)
+            except sqlite3.ProgrammingError:
+                # Closed on commit (file databases aren't pooled)
+                pass
+    else:
+        yield
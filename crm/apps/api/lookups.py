@@ -0,0 +1,112 @@
+"""
+Precompiled point lookups served on /api/lookup/{model}/{field}/{value}
+
+Each lookup is one SELECT of a fixed list of columns by an indexed column,
+compiled once per process (no graphql parsing, validation or ORM objects)
+and serialized using converters chosen per column type ahead of time.
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
+from graphene.utils.str_converters import to_camel_case
+from sqlalchemy import Date, DateTime, Numeric, bindparam, select
+
+from crm.apps.company.models import Company
+from crm.apps.contact.models import Contact
+from crm.apps.deal.models import Deal
+from crm.apps.email.models import Email
+from crm.apps.phone.models import Phone
+from crm.apps.user.models import User
+from crm.db import db
+
+
+def _enum(value):
+    return value.name if isinstance(value, Enum) else value
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _number(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+def _converter(column):
+    """
+    :return: function converting column values to JSON values or None if not needed
+    """
+    if isinstance(column.type, db.Enum):
+        return _enum
+    if isinstance(column.type, (Date, DateTime)):
+        return _isoformat
+    if isinstance(column.type, Numeric):
+        return _number
+    return None
+
+
+class Lookup(object):
+    """
+    Lookup of one record of (model) by (key) column
+
+    (key) may be a column of another table referencing the model through (via)
+    i.e Lookup(Contact, Email.email, [...], via=Email.contact_id)
+    """
+
+    def __init__(self, model, key, columns, via=None):
+        self.model = model
+        table = model.__table__
+        key = key.property.columns[0] if hasattr(key, 'property') else key
+        columns = [table.c.id] + [table.c[name] for name in columns]
+
+        # [(response field name, converter)] in select order
+        self.plan = [
+            ('uid' if column.name == 'id' else to_camel_case(column.name), _converter(column))
+            for column in columns
+        ]
+
+        from_ = table
+        self.tables = {table.name}
+        if via is not None:
+            via = via.property.columns[0] if hasattr(via, 'property') else via
+            from_ = table.join(key.table, via == table.c.id)
+            self.tables.add(key.table.name)
+
+        self.statement = select(columns).select_from(from_).where(key == bindparam('value')).limit(1)
+        self._compiled_cache = {}
+
+    def get(self, value):
+        """
+        :param value: key value
+        :return: record serialized as dict or None if not found
+        :rtype: dict
+        """
+        connection = db.session.connection().execution_options(compiled_cache=self._compiled_cache)
+        row = connection.execute(self.statement, value=value).first()
+        if row is None:
+            return None
+        return {
+            name: converter(value) if converter is not None else value
+            for (name, converter), value in zip(self.plan, row)
+        }
+
+
+CONTACT_COLUMNS = ['firstname', 'lastname', 'gender', 'referral_code', 'message_channels', 'owner_id', 'updated_at']
+USER_COLUMNS = ['username', 'firstname', 'lastname', 'message_channels', 'last_login']
+
+# {(model, field): Lookup} exposed as /api/lookup/{model}/{field}/{value}
+LOOKUPS = {
+    ('contact', 'email'): Lookup(Contact, Email.email, CONTACT_COLUMNS, via=Email.contact_id),
+    ('contact', 'telephone'): Lookup(Contact, Phone.telephone, CONTACT_COLUMNS, via=Phone.contact_id),
+    ('contact', 'referral_code'): Lookup(Contact, Contact.referral_code, CONTACT_COLUMNS),
+    ('user', 'username'): Lookup(User, User.username, USER_COLUMNS),
+    ('user', 'email'): Lookup(User, Email.email, USER_COLUMNS, via=Email.user_id),
+    ('deal', 'referral_code'): Lookup(
+        Deal,
+        Deal.referral_code,
+        ['name', 'value', 'deal_type', 'deal_state', 'is_paid', 'contact_id', 'company_id', 'referral_code']
+    ),
+    ('company', 'vatnumber'): Lookup(Company, Company.vatnumber, ['name', 'vatnumber', 'website', 'owner_id']),
+}
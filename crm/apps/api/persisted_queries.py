@@ -0,0 +1,147 @@
+"""
+Persisted queries for the /api end point
+
+A client registers (or ships) a query once, after that it only sends the
+sha256 hex digest of the query text as its id together with the variables.
+Queries are looked up in an in-process map loaded from (PERSISTED_QUERIES_DIR)
+and in a Redis hash shared between all workers, queries read from Redis are kept
+in a bounded in-process cache.
+Only queries that parse & validate against the schema are registered.
+Parsed and validated documents are kept per process, so a persisted query is
+parsed & validated once per worker.
+"""
+
+import hashlib
+import os
+
+from graphql.error import GraphQLError
+from graphql.language.parser import parse
+from graphql.language.source import Source
+from graphql.validation import validate
+
+from crm.cache import LRUCache, get_redis
+
+
+class PersistedQueryError(Exception):
+    pass
+
+
+class PersistedQueryStore(object):
+    REDIS_KEY = 'crm:persisted_queries'
+
+    def __init__(self, directory=None, documents_cache_size=512, queries_cache_size=1024):
+        # Queries of (directory), never evicted
+        self._queries = {}
+        # Queries registered by clients or read from Redis
+        self._registered = LRUCache(queries_cache_size)
+        self._documents = LRUCache(documents_cache_size)
+        if directory:
+            self.load_directory(directory)
+
+    @staticmethod
+    def query_id(query):
+        """
+        :param query: query text
+        :return: sha256 hex digest of the query text
+        :rtype: str
+        """
+        return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+    def load_directory(self, directory):
+        """
+        Register all (*.graphql) files under a directory
+
+        :param directory: path to directory
+        :return: registered query ids
+        :rtype: list
+        """
+        ids = []
+        for root, _, files in os.walk(directory):
+            for file_ in sorted(files):
+                if not file_.endswith('.graphql'):
+                    continue
+                with open(os.path.join(root, file_)) as f:
+                    query = f.read()
+                query_id = self.query_id(query)
+                self._queries[query_id] = query
+                ids.append(query_id)
+        return ids
+
+    def get(self, query_id):
+        """
+        :param query_id: sha256 of the query text
+        :return: query text or None if not registered
+        :rtype: str
+        """
+        query = self._queries.get(query_id)
+        if query is None:
+            query = self._registered.get(query_id)
+        if query is not None:
+            return query
+
+        redis = get_redis()
+        if redis is not None:
+            query = redis.hget(self.REDIS_KEY, query_id)
+            if query is not None:
+                query = query.decode('utf-8')
+                self._registered.set(query_id, query)
+        return query
+
+    def register(self, schema, query, query_id=None):
+        """
+        Register a new query once it's parsed & validated
+
+        :param schema: graphql schema
+        :param query: query text
+        :param query_id: id sent by the client, must match sha256 of the query
+        :return: query id
+        :rtype: str
+        :raises PersistedQueryError: if the id doesn't match or the query is invalid
+        """
+        actual_id = self.query_id(query)
+        if query_id is not None and query_id != actual_id:
+            raise PersistedQueryError('provided sha does not match query')
+
+        self._documents.set(actual_id, self.parse(schema, query))
+        if actual_id not in self._queries:
+            self._registered.set(actual_id, query)
+
+        redis = get_redis()
+        if redis is not None:
+            redis.hset(self.REDIS_KEY, actual_id, query)
+        return actual_id
+
+    def get_document(self, schema, query_id):
+        """
+        Parsed & validated document of a registered query
+
+        :param schema: graphql schema
+        :param query_id: sha256 of the query text
+        :return: graphql Document AST
+        """
+        document = self._documents.get(query_id)
+        if document is not None:
+            return document
+
+        query = self.get(query_id)
+        if query is None:
+            raise PersistedQueryError('PersistedQueryNotFound')
+
+        document = self.parse(schema, query)
+        self._documents.set(query_id, document)
+        return document
+
+    @staticmethod
+    def parse(schema, query):
+        """
+        :return: parsed & validated document of (query)
+        :raises PersistedQueryError: on syntax or validation errors
+        """
+        try:
+            document = parse(Source(query, 'GraphQL request'))
+        except GraphQLError as ex:
+            raise PersistedQueryError(str(ex))
+        errors = validate(schema, document)
+        if errors:
+            raise PersistedQueryError(*[str(e) for e in errors])
+        return document
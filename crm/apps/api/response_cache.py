@@ -0,0 +1,306 @@
+"""
+Response cache for read only graphql queries
+
+Cache key is (normalized query, variables, operation name, user)
+Each entry is stored together with the version counter of every table the
+query touches, tables are found by walking the query document against the
+schema and collecting models behind every selected type and relationships
+used by filter arguments i.e contacts(deals: [{dealState: CLOSED}]) reads deals.
+Version counters are bumped after each commit for written tables
+(crm.events.bump_table_versions) so an entry is valid as long as the versions
+stored with it are the current ones.
+
+Entries live in Redis (if CACHE_BACKEND_URI is a redis URL) with a small
+in-process LRU in front of it. Without Redis, entries and table versions are
+per process (per uwsgi worker): a write handled by another worker doesn't
+invalidate them, in-process entries expire after (timeout) like Redis ones
+to bound how long such entries are served.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from flask import session
+from graphql.language import ast
+from graphql.language.parser import parse
+from graphql.language.printer import print_ast
+from graphql.language.source import Source
+from graphql.type.definition import GraphQLInputObjectType, GraphQLObjectType, get_named_type
+from graphene.utils.str_converters import to_snake_case
+from sqlalchemy import inspect as sa_inspect
+
+from crm.cache import LRUCache, get_redis, get_table_versions
+
+
+# Root fields whose results don't depend on models tables only
+# i.e (search) reads the search index which is updated asynchronously
+NOT_CACHEABLE_FIELDS = {'search'}
+
+
+class NotCacheable(Exception):
+    pass
+
+
+def get_type_model(graphql_type):
+    graphene_type = getattr(graphql_type, 'graphene_type', None)
+    meta = getattr(graphene_type, '_meta', None)
+    return getattr(meta, 'model', None)
+
+
+def get_field_model(graphql_type):
+    """
+    :return: model of a type or of the nodes of a connection type
+    """
+    model = get_type_model(graphql_type)
+    if model is None:
+        node = getattr(getattr(getattr(graphql_type, 'graphene_type', None), '_meta', None), 'node', None)
+        model = getattr(getattr(node, '_meta', None), 'model', None)
+    return model
+
+
+def _argument_names(value, input_type, visited_types=None):
+    """
+    :return: names of input fields of an argument value at any depth i.e {dealState, contact, firstname},
+        all names of its input type when given as a variable
+    :param visited_types: names of input types whose names are collected already, each type is walked once
+    :rtype: set
+    """
+    if visited_types is None:
+        visited_types = set()
+    names = set()
+    if isinstance(value, ast.ListValue):
+        for item in value.values:
+            names |= _argument_names(item, input_type, visited_types)
+    elif isinstance(value, ast.ObjectValue):
+        fields = getattr(input_type, 'fields', {})
+        for field in value.fields:
+            names.add(field.name.value)
+            field_type = fields[field.name.value].type if field.name.value in fields else None
+            names |= _argument_names(field.value, get_named_type(field_type), visited_types)
+    elif isinstance(value, ast.Variable) and isinstance(input_type, GraphQLInputObjectType):
+        if input_type.name in visited_types:
+            return names
+        visited_types.add(input_type.name)
+        for name, field in input_type.fields.items():
+            names.add(name)
+            names |= _argument_names(value, get_named_type(field.type), visited_types)
+    return names
+
+
+def argument_tables(field_def, field):
+    """
+    Tables read by filter arguments of a connection field (crm.graphql.CRMConnectionField.compile_query)
+
+    Nested filters are applied as relationships of the queried model
+    i.e (deals.name) becomes Contact.deals.any(Deal.name == ...)
+
+    :param field_def: graphql field definition
+    :param field: field selection
+    :return: set of table names
+    :rtype: set
+    """
+    model = get_field_model(get_named_type(field_def.type))
+    if model is None or not field.arguments:
+        return set()
+
+    names = set()
+    for argument in field.arguments:
+        names.add(argument.name.value)
+        arg_def = field_def.args.get(argument.name.value)
+        names |= _argument_names(argument.value, get_named_type(arg_def.type) if arg_def is not None else None)
+
+    tables = set()
+    relationships = sa_inspect(model).relationships
+    for name in names:
+        relationship = relationships.get(to_snake_case(name))
+        if relationship is None:
+            continue
+        tables.add(relationship.mapper.local_table.name)
+        if relationship.secondary is not None:
+            # Many to many association table
+            tables.add(relationship.secondary.name)
+    return tables
+
+
+def document_tables(schema, document):
+    """
+    Get all tables a query document depends on
+
+    :param schema: graphql schema
+    :param document: parsed query document
+    :return: set of table names
+    :rtype: set
+    :raises NotCacheable: on mutations, or if tables can't be determined
+    """
+    type_map = schema.get_type_map()
+    fragments = {}
+    operations = []
+
+    for definition in document.definitions:
+        if isinstance(definition, ast.FragmentDefinition):
+            fragments[definition.name.value] = definition
+        elif isinstance(definition, ast.OperationDefinition):
+            if definition.operation != 'query':
+                raise NotCacheable()
+            operations.append(definition)
+
+    tables = set()
+
+    def walk(graphql_type, selection_set, visited_fragments):
+        model = get_type_model(graphql_type)
+        if model is not None:
+            tables.add(model.__table__.name)
+
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                if name in visited_fragments:
+                    continue
+                fragment = fragments[name]
+                walk(
+                    type_map[fragment.type_condition.name.value],
+                    fragment.selection_set,
+                    visited_fragments | {name}
+                )
+            elif isinstance(selection, ast.InlineFragment):
+                condition_type = graphql_type
+                if selection.type_condition is not None:
+                    condition_type = type_map[selection.type_condition.name.value]
+                walk(condition_type, selection.selection_set, visited_fragments)
+            else:
+                name = selection.name.value
+                if name.startswith('__'):
+                    continue
+                if not isinstance(graphql_type, GraphQLObjectType):
+                    # Interface fields without type condition (i.e node(id:))
+                    # may come from any model
+                    raise NotCacheable()
+                field_def = graphql_type.fields[name]
+                tables.update(argument_tables(field_def, selection))
+                field_type = get_named_type(field_def.type)
+                if selection.selection_set is not None:
+                    walk(field_type, selection.selection_set, visited_fragments)
+
+    query_type = schema.get_query_type()
+    for operation in operations:
+        for selection in operation.selection_set.selections:
+            if getattr(getattr(selection, 'name', None), 'value', '') in NOT_CACHEABLE_FIELDS:
+                raise NotCacheable()
+            before = set(tables)
+            walk(query_type, ast.SelectionSet(selections=[selection]), frozenset())
+            name = getattr(getattr(selection, 'name', None), 'value', '')
+            # A root field that doesn't reach any model means that
+            # we don't know what it reads, (__schema) & (__type) are static
+            if tables == before and not name.startswith('__'):
+                raise NotCacheable()
+    return tables
+
+
+class CachedQuery(object):
+    """
+    Cache lookup for one query execution
+    """
+
+    def __init__(self, cache, key, versions):
+        self.cache = cache
+        self.key = key
+        self.versions = versions
+        self.data = cache.get(key, versions)
+
+    def store(self, data):
+        self.cache.set(self.key, self.versions, data)
+
+
+class ResponseCache(object):
+    REDIS_KEY = 'crm:graphql_response:%s'
+
+    def __init__(self, enabled=False, timeout=3600, maxsize=512):
+        self.enabled = enabled
+        self.timeout = timeout
+        self._local = LRUCache(maxsize)
+
+    @staticmethod
+    def make_key(document, variables=None, operation_name=None, user_id=None):
+        key = json.dumps(
+            [print_ast(document), variables or {}, operation_name, user_id],
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key, versions):
+        expires, entry = self._local.get(key, (None, None))
+        if entry is not None and expires <= time.time():
+            self._local.delete(key)
+            entry = None
+        if entry is None:
+            redis = get_redis()
+            raw = redis.get(self.REDIS_KEY % key) if redis is not None else None
+            if raw is None:
+                return None
+            entry = json.loads(raw.decode('utf-8'), object_pairs_hook=OrderedDict)
+            self._local.set(key, (time.time() + self.timeout, entry))
+
+        if entry['versions'] != versions:
+            return None
+        return entry['data']
+
+    def set(self, key, versions, data):
+        entry = {'versions': versions, 'data': data}
+        self._local.set(key, (time.time() + self.timeout, entry))
+
+        redis = get_redis()
+        if redis is not None:
+            redis.setex(self.REDIS_KEY % key, self.timeout, json.dumps(entry, default=str))
+
+    def lookup(self, schema, query=None, variables=None, operation_name=None, document=None):
+        """
+        Prepare cache lookup for a query
+
+        Table versions are read before execution, so if data changes while
+        executing, the stored entry is outdated right away
+
+        :return: CachedQuery with (data) set on cache hits
+                 or None if query is not cacheable
+        :rtype: CachedQuery
+        """
+        if not self.enabled:
+            return None
+        try:
+            if document is None:
+                document = parse(Source(query, 'GraphQL request'))
+            tables = document_tables(schema, document)
+        except Exception:
+            # Mutations, invalid queries, ... are handled without cache
+            return None
+
+        user = session.get('user') or {} if session else {}
+        key = self.make_key(document, variables, operation_name, user.get('id'))
+        versions = get_table_versions(tables)
+        return CachedQuery(self, key, versions)
+
+    def get_or_set(self, key_parts, tables, func):
+        """
+        Cache result of func() outside graphql i.e REST lookups
+
+        :param key_parts: JSON serializable parts identifying the result, current user is added
+        :param tables: tables the result depends on
+        :param func: function computing the result, None results aren't cached
+        :return: result of func()
+        """
+        if not self.enabled:
+            return func()
+
+        user = session.get('user') or {} if session else {}
+        key = json.dumps([key_parts, user.get('id')], sort_keys=True, default=str)
+        key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        versions = get_table_versions(tables)
+
+        data = self.get(key, versions)
+        if data is None:
+            data = func()
+            if data is not None:
+                self.set(key, versions, data)
+        return data
@@ -0,0 +1,168 @@
+"""
+Streaming responses for large list queries on /api
+
+A query with one root connection field i.e
+    { contacts(firstname: "contains(ali)") { edges { node { uid firstname } } } }
+is executed in chunks of (API_STREAM_CHUNK_SIZE) records, each chunk is serialized
+and sent right away using a chunked HTTP response, then dropped from the db session.
+So worker memory is bounded by the chunk size not the result size.
+
+Records are streamed in id order, chunks after the first one start after the last streamed id
+(keyset, see crm.graphql.CRMConnectionField.get_query), the document is executed with
+the StreamedQuery as context for that. (first) & (after) of the client are honoured,
+edges cursors are offsets in the streamed order. (last) & (before) can't be streamed.
+
+Only (edges) of the root field are streamed, other fields of the connection
+(i.e pageInfo) are ignored.
+"""
+
+import copy
+import json
+
+from graphql.language import ast
+from graphql.type.definition import get_named_type
+from graphql_relay.connection.arrayconnection import cursor_to_offset, offset_to_cursor
+
+from crm.db import db
+
+PAGINATION_ARGUMENTS = ('first', 'last', 'before', 'after')
+
+
+def _argument_value(value, variables):
+    if isinstance(value, ast.Variable):
+        return (variables or {}).get(value.name.value)
+    if isinstance(value, ast.IntValue):
+        return int(value.value)
+    if isinstance(value, ast.StringValue):
+        return value.value
+    return None
+
+
+class NotStreamable(Exception):
+    pass
+
+
+class StreamedQuery(object):
+    """
+    Document prepared to be executed chunk by chunk
+    """
+
+    def __init__(self, schema, document, chunk_size=500, variables=None):
+        """
+        :param schema: graphql schema
+        :param document: parsed & validated query document, it's copied not modified
+        :param chunk_size: records fetched per chunk
+        :param variables: query variables
+        :raises NotStreamable: if document is not a query with one root connection field
+        """
+        self.chunk_size = chunk_size
+        self.document = copy.deepcopy(document)
+
+        operations = [d for d in self.document.definitions if isinstance(d, ast.OperationDefinition)]
+        if len(operations) != 1 or operations[0].operation != 'query':
+            raise NotStreamable('Only documents with one query operation can be streamed')
+
+        selections = operations[0].selection_set.selections
+        if len(selections) != 1 or not isinstance(selections[0], ast.Field):
+            raise NotStreamable('Only queries with one root field can be streamed')
+
+        self.field = selections[0]
+        field_def = schema.get_query_type().fields.get(self.field.name.value)
+        if field_def is None or not get_named_type(field_def.type).name.endswith('Connection'):
+            raise NotStreamable('Only connection fields i.e (contacts) can be streamed')
+
+        self.key = (self.field.alias or self.field.name).value
+
+        # Pagination is handled here
+        pagination = {
+            a.name.value: _argument_value(a.value, variables)
+            for a in self.field.arguments or [] if a.name.value in PAGINATION_ARGUMENTS
+        }
+        if pagination.get('last') is not None or pagination.get('before') is not None:
+            raise NotStreamable('(last) & (before) can not be streamed, use (first) & (after)')
+        self.arguments = [a for a in self.field.arguments or [] if a.name.value not in PAGINATION_ARGUMENTS]
+
+        # Max records to stream, all if None
+        self.limit = pagination.get('first')
+        if self.limit is not None and self.limit < 0:
+            raise NotStreamable('(first) must be positive')
+        # Offset of the first record, after the client (after) cursor
+        self.offset = cursor_to_offset(pagination['after']) + 1 if pagination.get('after') else 0
+        if self.offset < 0:
+            raise NotStreamable('Invalid (after) cursor')
+
+        # Number of streamed records & id of the last one
+        self.sent = 0
+        self.after_id = None
+        self.set_chunk()
+
+    def set_chunk(self):
+        """
+        Make the document fetch the next chunk of records
+        """
+        self.size = self.chunk_size if self.limit is None else min(self.chunk_size, self.limit - self.sent)
+        arguments = list(self.arguments)
+        arguments.append(ast.Argument(name=ast.Name(value='first'), value=ast.IntValue(value=str(self.size))))
+        if self.after_id is None and self.offset:
+            # First chunk, next ones start after (after_id)
+            arguments.append(ast.Argument(
+                name=ast.Name(value='after'),
+                value=ast.StringValue(value=offset_to_cursor(self.offset - 1))
+            ))
+        self.field.arguments = arguments
+
+    def is_streamed_field(self, info):
+        """
+        :param info: graphql resolve info
+        :return: True if (info) is of the streamed root field
+        :rtype: bool
+        """
+        return bool(info.field_asts) and info.field_asts[0] is self.field
+
+    def chunk_loaded(self, edges):
+        """
+        Called with edges of the streamed field once a chunk is loaded (crm.graphql.CRMConnectionField)
+        """
+        for i, edge in enumerate(edges):
+            edge.cursor = offset_to_cursor(self.offset + self.sent + i)
+        if edges:
+            self.after_id = edges[-1].node.id
+
+    def edges(self, result):
+        """
+        :param result: execution result of one chunk
+        :return: edges of the root field
+        :rtype: list
+        """
+        connection = result.data[self.key] or {}
+        return connection.get('edges') or []
+
+    def stream(self, execute_chunk, first_result):
+        """
+        Generate response body parts
+
+        :param execute_chunk: function executing current document, returning ExecutionResult
+        :param first_result: result of the first chunk executed by the caller,
+                             errors are reported before the response starts
+        """
+        # Same shape as non streamed /api responses
+        yield '{%s: {"edges": [' % json.dumps(self.key)
+
+        result = first_result
+        while True:
+            edges = self.edges(result)
+            if edges:
+                yield (',' if self.sent else '') + ','.join(json.dumps(edge, default=str) for edge in edges)
+            self.sent += len(edges)
+            if len(edges) < self.size or (self.limit is not None and self.sent >= self.limit):
+                break
+
+            # Loaded objects of previous chunk aren't needed anymore
+            db.session.expunge_all()
+            self.set_chunk()
+            result = execute_chunk()
+            if result.errors:
+                # Response has started already, a truncated body tells the client it failed
+                raise Exception(result.errors[0])
+
+        yield ']}}'
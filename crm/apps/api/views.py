@@ -1,32 +1,526 @@
-from flask import request, jsonify
+import json
+from collections import namedtuple
+
+from flask import request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import BadRequest
 
 from flask_graphql import GraphQLView
+from flask_graphql.graphqlview import HttpError
+from graphql.execution import execute, ExecutionResult
+from graphql.language import ast
+from graphql.language.parser import parse
+from graphql.language.source import Source
+from graphql.utils.introspection_query import introspection_query
+from graphql.validation import validate
+
+from crm import app, crm
+from crm.cache import LRUCache
+from crm.changes import Subscription, listen_changes
+from crm.conditional import is_not_modified, set_validators
+from crm.db import db
+from crm.settings import PERSISTED_QUERIES_DIR, PERSISTED_QUERIES_ONLY, PERSISTED_QUERIES_REGISTRATION, \
+    PERSISTED_QUERIES_CACHE_SIZE, GRAPHQL_RESPONSE_CACHE, \
+    GRAPHQL_RESPONSE_CACHE_TIMEOUT, GRAPHQL_STATEMENT_TIMEOUT, GRAPHQL_MAX_BATCH_SIZE, API_STREAM_CHUNK_SIZE, GRAPHQL_FIELD_METRICS, \
+    API_CHANGES_KEEPALIVE, API_CHANGES_MAX_AGE
+from .conditional import document_validators
+from .instrumentation import FieldInstrumentation, DEBUG_HEADER, render_metrics
+from .limits import check_query, statement_timeout, QueryLimitError
+from .lookups import LOOKUPS
+from .persisted_queries import PersistedQueryStore, PersistedQueryError
+from .response_cache import ResponseCache
+from .streaming import StreamedQuery, NotStreamable
+
+persisted_queries = PersistedQueryStore(directory=PERSISTED_QUERIES_DIR, queries_cache_size=PERSISTED_QUERIES_CACHE_SIZE)
+
+response_cache = ResponseCache(enabled=GRAPHQL_RESPONSE_CACHE, timeout=GRAPHQL_RESPONSE_CACHE_TIMEOUT)
+
+
+def _get_persisted_query_id(data):
+    """
+    Query id can be sent as {"id": sha256} or the way apollo client does
+    {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": sha256}}}
+    """
+    if data.get('id'):
+        return data['id']
+    extensions = data.get('extensions') or {}
+    return (extensions.get('persistedQuery') or {}).get('sha256Hash')
+
+
+def _get_instrumentation():
+    """
+    :return: FieldInstrumentation if current request is instrumented
+    :rtype: FieldInstrumentation
+    """
+    if GRAPHQL_FIELD_METRICS or request.headers.get(DEBUG_HEADER):
+        return FieldInstrumentation()
+    return None
+
+
+def _finish_instrumentation(instrumentation):
+    """
+    Record metrics of an instrumented execution
+
+    :return: response extensions if debug header is sent
+    :rtype: dict
+    """
+    if instrumentation is None:
+        return None
+    if GRAPHQL_FIELD_METRICS:
+        instrumentation.record_metrics()
+    if request.headers.get(DEBUG_HEADER):
+        return {'instrumentation': instrumentation.summary()}
+    return None
+
+
+class OperationError(Exception):
+    def __init__(self, errors, status=400):
+        super().__init__(*errors)
+        self.errors = errors
+        self.status = status
+
+
+def _get_document(data):
+    """
+    Parsed & validated document of an operation sent to /api
+
+    :param data: {"query": ..., "id": ..., "variables": ...}
+    :return: (document, variables)
+    :rtype: tuple
+    :raises OperationError: if operation is invalid or not allowed
+    """
+    if not isinstance(data, dict):
+        raise OperationError(['Operation must be a JSON object'])
+
+    query = data.get('query', None)
+    query_id = _get_persisted_query_id(data)
+    variables = data.get('variables') or None
+
+    if not query and not query_id:
+        raise OperationError(['query field is missing'])
+
+    if query and PERSISTED_QUERIES_ONLY:
+        query_id = persisted_queries.query_id(query)
+        if persisted_queries.get(query_id) is None:
+            raise OperationError(['Only persisted queries are allowed'], 403)
+    try:
+        if query_id and query and not PERSISTED_QUERIES_ONLY:
+            if PERSISTED_QUERIES_REGISTRATION:
+                # Registering new query is done by sending both query & its id
+                persisted_queries.register(crm.graphql_schema, query, query_id)
+            elif persisted_queries.query_id(query) != query_id:
+                raise PersistedQueryError('provided sha does not match query')
+            elif persisted_queries.get(query_id) is None:
+                # Not registered, executed as sent
+                query_id = None
+        if query_id:
+            document = persisted_queries.get_document(crm.graphql_schema, query_id)
+        else:
+            document = parse(Source(query, 'GraphQL request'))
+            validation_errors = validate(crm.graphql_schema, document)
+            if validation_errors:
+                raise OperationError([str(e) for e in validation_errors])
+    except PersistedQueryError as ex:
+        raise OperationError(list(ex.args))
+    return document, variables
+
+
+# Outcome of one /api operation, (etag) & (last_modified) are set for read only queries
+OperationResult = namedtuple('OperationResult', ['data', 'errors', 'status', 'extensions', 'etag', 'last_modified'])
+
+
+def _execute_operation(data, conditional=False):
+    """
+    Execute one operation sent to /api
+
+    :param data: {"query": ..., "id": ..., "variables": ...}
+    :param conditional: GET requests, only queries are executed, validators of the response are computed
+                        and (304) is answered without executing if client copy is up to date
+    :rtype: OperationResult
+    """
+    instrumentation = None
+    etag = last_modified = None
+    try:
+        document, variables = _get_document(data)
+        if conditional and any(
+                isinstance(d, ast.OperationDefinition) and d.operation != 'query' for d in document.definitions):
+            raise OperationError(['Only queries can be sent with GET, use POST'], 405)
+
+        check_query(crm.graphql_schema, document, variables)
+
+        if conditional:
+            etag, last_modified = document_validators(crm.graphql_schema, document, variables)
+            if (etag or last_modified) and is_not_modified(etag, last_modified):
+                return OperationResult(None, None, 304, None, etag, last_modified)
+
+        instrumentation = _get_instrumentation()
+        cached = None
+        if instrumentation is None or not request.headers.get(DEBUG_HEADER):
+            cached = response_cache.lookup(crm.graphql_schema, variables=variables, document=document)
+
+        if cached is not None and cached.data is not None:
+            execresult = ExecutionResult(data=cached.data)
+        else:
+            with statement_timeout(GRAPHQL_STATEMENT_TIMEOUT):
+                execresult = execute(
+                    crm.graphql_schema,
+                    document,
+                    variable_values=variables,
+                    middleware=instrumentation.middleware() if instrumentation else None
+                )
+        extensions = _finish_instrumentation(instrumentation)
+
+        if execresult.errors:
+            # BAD REQUEST ON ERRORS
+            return OperationResult(None, [str(e) for e in execresult.errors], 400, extensions, None, None)
+        if cached is not None and cached.data is None:
+            cached.store(execresult.data)
+        result = list(execresult.data.items())[0][1]
+        if result is None:
+            return OperationResult(execresult.data, None, 404, extensions, None, None)
+        return OperationResult(execresult.data, None, 200, extensions, etag, last_modified)
+
+    except OperationError as ex:
+        return OperationResult(None, ex.errors, ex.status, None, None, None)
+    except QueryLimitError as ex:
+        return OperationResult(None, [str(ex)], 400, None, None, None)
+    except Exception as ex:
+        return OperationResult(None, [str(ex)], 400, None, None, None)
+
+
+def _stream_operation(data):
+    """
+    Execute a list query chunk by chunk into a chunked response
+    see crm.apps.api.streaming
+    """
+    try:
+        document, variables = _get_document(data)
+        streamed = StreamedQuery(crm.graphql_schema, document, API_STREAM_CHUNK_SIZE, variables)
+        # Limits are checked against one chunk
+        check_query(crm.graphql_schema, streamed.document, variables)
+
+        def execute_chunk():
+            with statement_timeout(GRAPHQL_STATEMENT_TIMEOUT):
+                # Streamed root field is read by chunks in id order, see CRMConnectionField.get_query
+                return execute(crm.graphql_schema, streamed.document, context_value=streamed, variable_values=variables)
+
+        first_result = execute_chunk()
+        if first_result.errors:
+            return jsonify(errors=[str(e) for e in first_result.errors]), 400
+
+    except OperationError as ex:
+        return jsonify(errors=ex.errors), ex.status
+    except (NotStreamable, QueryLimitError) as ex:
+        return jsonify(errors=[str(ex)]), 400
+    except Exception as ex:
+        return jsonify(errors=[str(ex)]), 400
+
+    return Response(
+        stream_with_context(streamed.stream(execute_chunk, first_result)),
+        content_type='application/json'
+    )
+
+
+def _get_request_data():
+    """
+    Operation of a GET request i.e /api?id={sha256}&variables={"uid":"d7y2t"}
+
+    :return: {"query": ..., "id": ..., "variables": ..., "extensions": ...} as sent in POST requests
+    :rtype: dict
+    :raises OperationError: if (variables) or (extensions) aren't JSON
+    """
+    data = {'query': request.args.get('query'), 'id': request.args.get('id')}
+    for name in ('variables', 'extensions'):
+        if request.args.get(name):
+            try:
+                data[name] = json.loads(request.args[name])
+            except ValueError:
+                raise OperationError(['Invalid JSON in (%s)' % name])
+    return data
+
+
+def _operation_response(outcome):
+    if outcome.status == 304:
+        return set_validators(Response(status=304), outcome.etag, outcome.last_modified)
+    if outcome.errors:
+        if outcome.extensions:
+            return jsonify(errors=outcome.errors, extensions=outcome.extensions), outcome.status
+        return jsonify(errors=outcome.errors), outcome.status
+    if outcome.status == 404:
+        return '', 404
 
-from crm import app
+    result = outcome.data
+    if outcome.extensions:
+        # /api responses are the data itself, extensions are added next to root fields
+        result = dict(result, extensions=outcome.extensions)
+    return set_validators(jsonify(result), outcome.etag, outcome.last_modified), outcome.status
 
 
-@app.route('/api', methods=["POST"])
+@app.route('/api', methods=["GET", "POST"])
 def api():
+    if request.method == 'GET':
+        # Queries in the query string or persisted queries ids, answered conditionally (ETag/Last-Modified)
+        try:
+            data = _get_request_data()
+        except OperationError as ex:
+            return jsonify(errors=ex.errors), ex.status
+        return _operation_response(_execute_operation(data, conditional=True))
+
     if request.headers.get('Content-Type', '').lower() != 'application/json':
         return jsonify(errors=['Only accepts Content-Type: application/json']), 400
 
     data = request.json
-    query = data.get('query', None)
-    if not query:
-        return jsonify(errors=['query field is missing']), 400
-    if query:
+
+    if isinstance(data, list):
+        # Batch of operations, executed in order within this request (and its db session)
+        if len(data) > GRAPHQL_MAX_BATCH_SIZE:
+            return jsonify(errors=['A batch can have %d operations at most' % GRAPHQL_MAX_BATCH_SIZE]), 400
+        results = []
+        for operation in data:
+            outcome = _execute_operation(operation)
+            results.append({'errors': outcome.errors} if outcome.errors else {'data': outcome.data})
+            if outcome.extensions:
+                results[-1]['extensions'] = outcome.extensions
+        return jsonify(results), 200
+
+    if data.get('stream'):
+        return _stream_operation(data)
+
+    return _operation_response(_execute_operation(data))
+
+
+@app.route('/api/lookup/<model>/<field>/<path:value>', methods=["GET"])
+def api_lookup(model, field, value):
+    """
+    Fast point lookups i.e /api/lookup/contact/email/john@example.com
+    see crm.apps.api.lookups
+    """
+    lookup = LOOKUPS.get((model, field))
+    if lookup is None:
+        return jsonify(errors=['Unknown lookup (%s/%s)' % (model, field)]), 404
+    try:
+        # One indexed query, no statement timeout round trip
+        result = response_cache.get_or_set(['lookup', model, field, value], lookup.tables, lambda: lookup.get(value))
+    except Exception as ex:
+        return jsonify(errors=[str(ex)]), 400
+    if result is None:
+        return '', 404
+    return jsonify(result), 200
+
+
+@app.route('/api/metrics', methods=["GET"])
+def api_metrics():
+    """
+    Per field resolvers histograms (GRAPHQL_FIELD_METRICS) in prometheus format
+    """
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4')
+
+
+def _is_sync_uwsgi_worker():
+    """
+    :return: True when running in a uwsgi worker without gevent i.e one of the (threads) of uwsgi.ini
+    :rtype: bool
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        # flask run (dev & tests)
+        return False
+    return not uwsgi.opt.get('gevent')
+
+
+@app.route('/api/changes', methods=["GET"])
+def api_changes():
+    """
+    Server sent events of committed changes i.e
+    /api/changes?subscribe=messages&subscribe=deals:deal_state=CLOSED,owner_id=u1
+    see crm.changes
+
+    Served by the gevent uwsgi instance (section [changes] of uwsgi.ini)
+    """
+    if _is_sync_uwsgi_worker():
+        # A connection would hold the worker thread for (API_CHANGES_MAX_AGE) seconds
+        return jsonify(errors=['/api/changes is served by the [changes] uwsgi instance, see uwsgi.ini']), 503
+
+    try:
+        subscriptions = [Subscription.parse(s) for s in request.args.getlist('subscribe')]
+    except ValueError as ex:
+        return jsonify(errors=[str(ex)]), 400
+    if not subscriptions:
+        return jsonify(errors=['subscribe parameter is missing']), 400
+
+    # Nothing is read from DB while streaming, don't hold a connection
+    db.session.close()
+
+    def generate():
+        # Reconnecting clients wait for the keepalive period at most
+        yield 'retry: %d\n\n' % (API_CHANGES_KEEPALIVE * 1000)
+        for event in listen_changes(subscriptions, keepalive=API_CHANGES_KEEPALIVE, max_age=API_CHANGES_MAX_AGE):
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield 'event: change\ndata: %s\n\n' % json.dumps(event, default=str)
+
+    return Response(
+        stream_with_context(generate()),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# {(query, operation name): result} of introspection queries, schema doesn't change while running
+_introspection_results = LRUCache(16)
+
+
+def _is_introspection_query(query):
+    """
+    :return: True if query only selects (__schema) and (__type) fields
+    :rtype: bool
+    """
+    if '__schema' not in query and '__type' not in query:
+        return False
+    try:
+        document = parse(Source(query, 'GraphQL request'))
+    except Exception:
+        return False
+    for definition in document.definitions:
+        if not isinstance(definition, ast.OperationDefinition):
+            continue
+        if definition.operation != 'query':
+            return False
+        for selection in definition.selection_set.selections:
+            if not isinstance(selection, ast.Field) or not selection.name.value.startswith('__'):
+                return False
+    return True
+
+
+class CRMGraphQLView(GraphQLView):
+    """
+    GraphQLView that serves read only queries from the response cache
+    and applies query limits
+
+    A JSON array of operations (apollo transportBatching) is executed in order
+    within the same request and answered with an array of results
+
+    Introspection queries (i.e sent by GraphiQL on each page load) are answered
+    from a per process cache
+    """
+
+    @property
+    def schema(self):
+        # Built on first request, unless prebuilt on startup (GRAPHQL_SCHEMA_PREBUILD)
+        return crm.graphql_schema
+
+    def parse_body(self, request):
+        if self.get_content_type(request) == 'application/json':
+            try:
+                request_json = json.loads(request.data.decode('utf8'))
+                if isinstance(request_json, list):
+                    assert all(isinstance(entry, dict) for entry in request_json)
+                else:
+                    assert isinstance(request_json, dict)
+                return request_json
+            except Exception:
+                raise HttpError(BadRequest('POST body sent invalid JSON.'))
+        return super().parse_body(request)
+
+    def dispatch_request(self):
+        is_batch = request.method.lower() == 'post' and \
+            self.get_content_type(request) == 'application/json' and \
+            request.data.lstrip().startswith(b'[')
+        if not is_batch:
+            if request.method.lower() == 'get':
+                return self.dispatch_conditional_get()
+            return super().dispatch_request()
+
         try:
-            execresult = app.graphql_schema.execute(query)
-            if execresult.errors:
-                # BAD REQUEST ON ERRORS
-                return jsonify(errors=[str(e) for e in execresult.errors]), 400
-            result = list(execresult.data.items())[0][1]
-            if result is None:
-                return '', 404
-            return jsonify(execresult.data), 200
+            data = self.parse_body(request)
+            if len(data) > GRAPHQL_MAX_BATCH_SIZE:
+                raise HttpError(BadRequest('A batch can have %d operations at most' % GRAPHQL_MAX_BATCH_SIZE))
+            responses = [self.get_response(request, entry) for entry in data]
+        except HttpError as e:
+            return Response(
+                self.json_encode(request, {'errors': [self.format_error(e)]}),
+                status=e.response.code,
+                content_type='application/json'
+            )
+
+        # Errors of each operation are part of its own result
+        return Response(
+            '[{}]'.format(','.join(response[0] for response in responses)),
+            status=200,
+            content_type='application/json'
+        )
+
+    def dispatch_conditional_get(self):
+        """
+        GET queries i.e /graphql?query={deal(uid:"d7y2t"){name}} are answered with
+        validators (ETag/Last-Modified), and (304) if client copy is up to date
+        """
+        etag = last_modified = None
+        try:
+            query, variables, operation_name, _ = self.get_graphql_params(request, {})
+            if query and not (self.graphiql and self.can_display_graphiql({})):
+                document = parse(Source(query, 'GraphQL request'))
+                if not validate(self.schema, document):
+                    etag, last_modified = document_validators(self.schema, document, variables, operation_name)
+        except Exception:
+            # Invalid requests are answered by GraphQLView
+            etag = last_modified = None
+
+        if (etag or last_modified) and is_not_modified(etag, last_modified):
+            return set_validators(Response(status=304), etag, last_modified)
+
+        response = super().dispatch_request()
+        # GraphiQL page (str) never has validators
+        if (etag or last_modified) and response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+
+    def execute(self, document, *args, **kwargs):
+        # Called with the parsed & validated document, errors raised here
+        # are returned as (invalid) results by GraphQLView
+        check_query(self.schema, document, kwargs.get('variable_values'), kwargs.get('operation_name'))
+
+        instrumentation = _get_instrumentation()
+        if instrumentation is not None:
+            kwargs['middleware'] = instrumentation.middleware()
+        with statement_timeout(GRAPHQL_STATEMENT_TIMEOUT):
+            result = super().execute(document, *args, **kwargs)
+        self._extensions = _finish_instrumentation(instrumentation)
+        return result
+
+    def json_encode(self, request, d, show_graphiql=False):
+        # Called right after executing each operation
+        extensions = getattr(self, '_extensions', None)
+        if extensions:
+            d = dict(d, extensions=extensions)
+            self._extensions = None
+        return super().json_encode(request, d, show_graphiql)
+
+    def execute_graphql_request(self, data, query, variables, operation_name, *args, **kwargs):
+        if query and _is_introspection_query(query):
+            if query == introspection_query:
+                return ExecutionResult(data=crm.graphql_introspection)
+            key = (query, operation_name)
+            introspection = _introspection_results.get(key)
+            if introspection is not None:
+                return ExecutionResult(data=introspection)
+            result = super().execute_graphql_request(data, query, variables, operation_name, *args, **kwargs)
+            if result is not None and not result.errors and not result.invalid:
+                _introspection_results.set(key, result.data)
+            return result
+
+        cached = None
+        if query and request.method.lower() == 'post' and not request.headers.get(DEBUG_HEADER):
+            cached = response_cache.lookup(self.schema, query, variables, operation_name)
+            if cached is not None and cached.data is not None:
+                return ExecutionResult(data=cached.data)
+
+        result = super().execute_graphql_request(data, query, variables, operation_name, *args, **kwargs)
 
-        except Exception as ex:
-            return jsonify(errors=[str(ex)]), 400
+        if cached is not None and result is not None and not result.errors and not result.invalid:
+            cached.store(result.data)
+        return result
 
 
-app.add_url_rule('/graphql', view_func=GraphQLView.as_view('graphql', schema=app.graphql_schema, graphiql=True))
+app.add_url_rule('/graphql', view_func=CRMGraphQLView.as_view('graphql', graphiql=True))
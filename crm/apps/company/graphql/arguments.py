@@ -39,3 +39,8 @@ class CreateCompanyArguments(CompanyArguments):
 
 class UpdateCompanyArguments(CompanyArguments):
     uid = graphene.String(required=True)
+
+
+class UpsertCompanyArguments(CompanyArguments):
+    # Natural key when upserting with key "email" (matched on emails of companies, default key is vatnumber)
+    email = graphene.String()
@@ -0,0 +1,27 @@
+import graphene
+
+from crm.apps.company.models import Company
+from crm.graphql import BaseMutation, UpsertMutationMixin
+from .arguments import UpsertCompanyArguments
+
+
+class UpsertCompanies(UpsertMutationMixin, graphene.Mutation):
+    model = Company
+    natural_keys = {'vatnumber': 'vatnumber', 'email': 'emails.email'}
+    default_key = 'vatnumber'
+    # As required by CreateCompanyArguments
+    create_required_fields = ('name',)
+
+    class Arguments:
+        """
+            Mutation Arguments
+        """
+        records = graphene.List(UpsertCompanyArguments, required=True)
+        key = graphene.String()
+
+
+class CompanyMutation(BaseMutation):
+    """
+    Put all company mutations here
+    """
+    upsert_companies = UpsertCompanies.Field()
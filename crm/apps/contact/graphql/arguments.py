@@ -53,3 +53,8 @@ class CreateContactArguments(ContactArguments):
 
 class UpdateContactArguments(ContactArguments):
     uid = graphene.String(required=True)
+
+
+class UpsertContactArguments(ContactArguments):
+    # Natural key when upserting with key "email" (default, matched on emails of contacts)
+    email = graphene.String()
@@ -1,85 +1,45 @@
 import graphene
 from graphql.error.base import GraphQLError
-from sqlalchemy.inspection import inspect
 
 from crm import db
 from crm.apps.contact.models import Contact
-from crm.graphql import BaseMutation
-from .arguments import CreateContactArguments, UpdateContactArguments
+from crm.graphql import BaseMutation, CreateMutationMixin, UpdateMutationMixin, UpsertMutationMixin
+from .arguments import CreateContactArguments, UpdateContactArguments, UpsertContactArguments
 
 
-class CreateContacts(graphene.Mutation):
+class CreateContacts(CreateMutationMixin, graphene.Mutation):
+    model = Contact
+
     class Arguments:
         """
             Mutation Arguments        
         """
         records = graphene.List(CreateContactArguments, required=True)
 
-    ok = graphene.Boolean()
-    ids = graphene.List(graphene.String)
-
-    @classmethod
-    def mutate(cls, root, context, **kwargs):
-        """
-        Mutation logic is handled here
-        """
-        # 'before_insert' hooks won't work with db.session.bulk_save_objects
-        # we need to find a way to get hooks to work with bulk_save_objects @todo
-
-        objs = []
-
-        for data in kwargs.get('records', []):
-            c = Contact.get_object_from_graphql_input(data)
-            db.session.add(c)
-            objs.append(c)
-        try:
-            db.session.commit()
-            return cls(ok=True, ids=[obj.id for obj in objs])
-        except Exception as e:
-            raise GraphQLError(e.args)
 
+class UpdateContacts(UpdateMutationMixin, graphene.Mutation):
+    model = Contact
 
-class UpdateContacts(graphene.Mutation):
     class Arguments:
         """
             Mutation Arguments        
         """
         records = graphene.List(UpdateContactArguments, required=True)
 
-    ok = graphene.Boolean()
-    ids = graphene.List(graphene.String)
 
-    @classmethod
-    def mutate(cls, root, context, **kwargs):
+class UpsertContacts(UpsertMutationMixin, graphene.Mutation):
+    model = Contact
+    natural_keys = {'email': 'emails.email', 'referral_code': 'referral_code'}
+    default_key = 'email'
+    # As required by CreateContactArguments
+    create_required_fields = ('firstname', 'lastname')
+
+    class Arguments:
         """
-        Mutation logic is handled here
+            Mutation Arguments
         """
-
-        # 'before_insert' hooks won't work with db.session.bulk_save_objects
-        # we need to find a way to get hooks to work with bulk_save_objects @todo
-
-        records = []
-        for data in kwargs.get('records', []):
-            actual = Contact.query.get(data['uid'])
-
-            if not actual:
-                raise GraphQLError('Invalid id (%s)' % data['id'])
-
-            c = Contact.get_object_from_graphql_input(data)
-
-            for column_name, _ in inspect(Contact).attrs.items():
-                if column_name == 'id':
-                    continue
-                if column_name not in data:
-                    continue
-                setattr(actual, column_name, getattr(c, column_name))
-            db.session.add(actual)
-            records.append(actual.id)
-        try:
-            db.session.commit()
-            return cls(ok=True, ids=records)
-        except Exception as e:
-            raise GraphQLError(e.args)
+        records = graphene.List(UpsertContactArguments, required=True)
+        key = graphene.String()
 
 
 class DeleteContacts(graphene.Mutation):
@@ -125,3 +85,4 @@ class ContactMutation(BaseMutation):
     create_contacts = CreateContacts.Field()
     delete_contacts = DeleteContacts.Field()
     update_contacts = UpdateContacts.Field()
+    upsert_contacts = UpsertContacts.Field()
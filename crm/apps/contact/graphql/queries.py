@@ -3,7 +3,7 @@ from graphene import relay
 
 from crm.apps.contact.graphql.arguments import ContactArguments
 from crm.apps.contact.graphql.types import ContactType
-from crm.graphql import BaseQuery, CRMConnectionField
+from crm.graphql import BaseQuery, CRMConnectionField, CRMAggregateField
 
 
 class ContactQuery(BaseQuery):
@@ -17,6 +17,12 @@ class ContactQuery(BaseQuery):
         **ContactArguments.fields()
 
     )
+
+    # count/sum/avg/min/max of contacts, optionally grouped by some fields
+    contacts_aggregate = CRMAggregateField(
+        ContactType,
+        **ContactArguments.fields()
+    )
     # contact query to return one contact and takes (uid) argument
     # uid is the original object.id in db
     contact = graphene.Field(ContactType, uid=graphene.String())
@@ -228,6 +228,7 @@ class Contact(db.Model, BaseModel, RootModel):
 
     referral_code = db.Column(
         db.String(255),
+        index=True
     )
 
     addresses = db.relationship(
@@ -3,7 +3,7 @@ from graphene import relay
 
 from crm.apps.country.graphql.arguments import CountryArguments
 from crm.apps.country.graphql.types import CountryType
-from crm.graphql import BaseQuery, CRMConnectionField
+from crm.graphql import BaseQuery, CRMConnectionField, CRMAggregateField
 
 
 class CountryQuery(BaseQuery):
@@ -12,6 +12,12 @@ class CountryQuery(BaseQuery):
         **CountryArguments.fields()
     )
 
+    # count/sum/avg/min/max of countries, optionally grouped by some fields
+    countries_aggregate = CRMAggregateField(
+        CountryType,
+        **CountryArguments.fields()
+    )
+
     country = graphene.Field(CountryType, uid=graphene.String())
 
     def resolve_country(self, context, uid):
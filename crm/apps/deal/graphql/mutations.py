@@ -1,86 +1,31 @@
 import graphene
 from graphql.error.base import GraphQLError
-from sqlalchemy.inspection import inspect
 
 from crm import db
-from crm.graphql import BaseMutation
+from crm.graphql import BaseMutation, CreateMutationMixin, UpdateMutationMixin
 from .arguments import CreateDealArguments, UpdateDealArguments
 from crm.apps.deal.models import Deal
 
 
-class CreateDeals(graphene.Mutation):
+class CreateDeals(CreateMutationMixin, graphene.Mutation):
+    model = Deal
+
     class Arguments:
         """
             Mutation Arguments        
         """
         records = graphene.List(CreateDealArguments, required=True)
 
-    ok = graphene.Boolean()
-    ids = graphene.List(graphene.String)
-
-    @classmethod
-    def mutate(cls, root, context, **kwargs):
-        """
-        Mutation logic is handled here
-        """
-        # 'before_insert' hooks won't work with db.session.bulk_save_objects
-        # we need to find a way to get hooks to work with bulk_save_objects @todo
-
-        objs = []
-
-        for data in kwargs.get('records', []):
-            d = Deal.get_object_from_graphql_input(data)
-            db.session.add(d)
-            objs.append(d)
-        try:
-            db.session.commit()
-            return cls(ok=True, ids=[obj.id for obj in objs])
-        except Exception as e:
-            raise GraphQLError(e.args)
 
+class UpdateDeals(UpdateMutationMixin, graphene.Mutation):
+    model = Deal
 
-class UpdateDeals(graphene.Mutation):
     class Arguments:
         """
             Mutation Arguments        
         """
         records = graphene.List(UpdateDealArguments, required=True)
 
-    ok = graphene.Boolean()
-    ids = graphene.List(graphene.String)
-
-    @classmethod
-    def mutate(cls, root, context, **kwargs):
-        """
-        Mutation logic is handled here
-        """
-
-        # 'before_insert' hooks won't work with db.session.bulk_save_objects
-        # we need to find a way to get hooks to work with bulk_save_objects @todo
-
-        records = []
-        for data in kwargs.get('records', []):
-            actual = Deal.query.get(data['uid'])
-
-            if not actual:
-                raise GraphQLError('Invalid id (%s)' % data['id'])
-
-            d = Deal.get_object_from_graphql_input(data)
-
-            for column_name, _ in inspect(Deal).attrs.items():
-                if column_name == 'id':
-                    continue
-                if column_name not in data:
-                    continue
-                setattr(actual, column_name, getattr(d, column_name))
-            db.session.add(actual)
-            records.append(actual.id)
-        try:
-            db.session.commit()
-            return cls(ok=True, ids=records)
-        except Exception as e:
-            raise GraphQLError(e.args)
-
 
 class DeleteDeals(graphene.Mutation):
     class Arguments:
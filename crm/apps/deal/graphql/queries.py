@@ -3,7 +3,7 @@ from graphene import relay
 
 from crm.apps.deal.graphql.arguments import DealArguments
 from .types import DealType
-from crm.graphql import BaseQuery, CRMConnectionField
+from crm.graphql import BaseQuery, CRMConnectionField, CRMAggregateField
 
 
 
@@ -19,6 +19,12 @@ class DealQuery(BaseQuery):
 
     )
 
+    # count/sum/avg/min/max of deals, optionally grouped by some fields
+    deals_aggregate = CRMAggregateField(
+        DealType,
+        **DealArguments.fields()
+    )
+
     # Deal query to return one Deal and takes (uid) argument
     # uid is the original object.id in db
     deal = graphene.Field(DealType, uid=graphene.String())
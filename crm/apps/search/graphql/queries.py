@@ -0,0 +1,45 @@
+import graphene
+from graphene import relay
+from graphql.error.base import GraphQLError
+
+from crm.apps.api.graphql.queries import get_node_types
+from crm.graphql import BaseQuery
+from ..index import DOCUMENTS, load_results, search
+
+
+class SearchQuery(BaseQuery):
+    """
+    Full text search on all indexed types, best matches first
+
+    {
+      search(query: "john", types: ["Contact", "Deal"], first: 10) {
+        ... on Contact { firstname lastname }
+        ... on Deal { name }
+      }
+    }
+    """
+    search = graphene.List(
+        relay.Node,
+        query=graphene.String(required=True),
+        types=graphene.List(graphene.String, description='Searched types, all indexed types if not given'),
+        first=graphene.Int(default_value=20)
+    )
+
+    def resolve_search(self, info, query, types=None, first=20):
+        # {model: graphene type} of indexed models
+        graphene_types = {}
+        for name, graphene_type in get_node_types(info).items():
+            model = graphene_type._meta.model
+            if model in DOCUMENTS and (types is None or name in types):
+                graphene_types[model] = graphene_type
+
+        if types is not None and len(graphene_types) != len(set(types)):
+            raise GraphQLError('Invalid types (%s), searchable types are %s' % (
+                ', '.join(types),
+                ', '.join(sorted(n for n, t in get_node_types(info).items() if t._meta.model in DOCUMENTS))
+            ))
+
+        results = search(query, models=list(graphene_types), limit=first)
+        if results is None:
+            raise GraphQLError('Search index is not available')
+        return load_results(results, lambda model: graphene_types[model].get_query(info))
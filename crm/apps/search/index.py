@@ -0,0 +1,361 @@
+"""
+Full text search index, one search document per root object
+
+A document is the text of some fields of a record and of its relations
+i.e a deal is found by its name, its contact names, its owner names and its currency.
+Documents live in table (search_documents)
+
+- PostgreSQL: (content) text with a trigram index (pg_trgm) for substring matches
+  and (document) tsvector with a GIN index for words matches
+- SQLite (dev & tests): FTS5 virtual table, words prefix matches
+
+Tables are created by `flask build_search_index` which indexes all records,
+then documents are updated from change events of each commit (crm.events.update_search_index).
+"""
+
+import re
+from collections import OrderedDict
+from enum import Enum
+
+from sqlalchemy import and_, column, desc, select, table, text
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.orm.interfaces import ONETOMANY
+
+from crm.apps.company.models import Company
+from crm.apps.contact.models import Contact
+from crm.apps.deal.models import Deal
+from crm.apps.organization.models import Organization
+from crm.apps.project.models import Project
+from crm.apps.sprint.models import Sprint
+from crm.apps.user.models import User
+from crm.db import db, chunks
+
+SEARCH_TABLE = 'search_documents'
+
+search_documents = table(SEARCH_TABLE, column('model'), column('id'), column('content'))
+
+
+class SearchDocument(object):
+    """
+    Search document of (model) records made of (fields) values i.e ('firstname', 'emails.email')
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.name = model.__tablename__
+        self.fields = fields
+        self._relationships = None
+
+    def relationships(self):
+        """
+        :return: {name: relationship} of relationships used by fields
+        :rtype: OrderedDict
+        """
+        if self._relationships is None:
+            mapper = sa_inspect(self.model)
+            self._relationships = OrderedDict(
+                (field.split('.')[0], mapper.relationships[field.split('.')[0]])
+                for field in self.fields if '.' in field
+            )
+        return self._relationships
+
+    def tables(self):
+        """
+        :return: tables whose changes update documents
+        :rtype: set
+        """
+        return {self.name} | {r.mapper.local_table.name for r in self.relationships().values()}
+
+    def load_options(self):
+        return [
+            subqueryload(getattr(self.model, name)) if relationship.uselist else joinedload(getattr(self.model, name))
+            for name, relationship in self.relationships().items()
+        ]
+
+    def content(self, obj):
+        """
+        :return: text of the document of (obj)
+        :rtype: str
+        """
+        values = []
+        for field in self.fields:
+            items = [obj]
+            for name in field.split('.'):
+                next_items = []
+                for item in items:
+                    value = getattr(item, name, None)
+                    next_items.extend(value if isinstance(value, (list, tuple)) else [value])
+                items = [i for i in next_items if i is not None]
+            values.extend(i.name if isinstance(i, Enum) else str(i) for i in items)
+        return ' '.join(v for v in values if v)
+
+    def affected_ids(self, session, event):
+        """
+        :param event: change event (crm.changes)
+        :return: ids of documents to update after the change
+        :rtype: set
+        """
+        if event['model'] == self.name:
+            return {event['id']}
+
+        ids = set()
+        for name, relationship in self.relationships().items():
+            if relationship.mapper.local_table.name != event['model']:
+                continue
+            if relationship.direction is ONETOMANY:
+                # Children referencing the root i.e emails.contact_id, known even for deleted children.
+                # Children moved to another root update documents of both roots
+                for values in (event.get('values') or {}, event.get('previous') or {}):
+                    for _, remote in relationship.local_remote_pairs:
+                        if values.get(remote.key):
+                            ids.add(values[remote.key])
+            else:
+                # Roots referencing the changed record i.e deals of a renamed contact
+                target = relationship.mapper.class_
+                query = session.query(self.model.id).join(getattr(self.model, name)).filter(target.id == event['id'])
+                ids.update(id for id, in query)
+        return ids
+
+
+SEARCH_DOCUMENTS = [
+    SearchDocument(Contact, ('firstname', 'lastname', 'referral_code', 'emails.email', 'telephones.telephone')),
+    SearchDocument(Company, ('name', 'vatnumber', 'website', 'emails.email', 'telephones.telephone')),
+    SearchDocument(Deal, (
+        'name', 'referral_code', 'contact.firstname', 'contact.lastname', 'company.name',
+        'owner.username', 'owner.firstname', 'owner.lastname', 'currency.name'
+    )),
+    SearchDocument(User, ('username', 'firstname', 'lastname', 'emails.email', 'telephones.telephone')),
+    SearchDocument(Organization, ('name',)),
+    SearchDocument(Project, ('name',)),
+    SearchDocument(Sprint, ('name',)),
+]
+
+# {model: SearchDocument}
+DOCUMENTS = OrderedDict((d.model, d) for d in SEARCH_DOCUMENTS)
+
+
+class PostgresBackend(object):
+    create_statements = [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE TABLE IF NOT EXISTS search_documents ('
+        'model VARCHAR(64) NOT NULL, id VARCHAR(64) NOT NULL, content TEXT NOT NULL, document TSVECTOR NOT NULL, '
+        'PRIMARY KEY (model, id))',
+        'CREATE INDEX IF NOT EXISTS search_documents_document_idx ON search_documents USING GIN (document)',
+        'CREATE INDEX IF NOT EXISTS search_documents_content_idx ON search_documents USING GIN (content gin_trgm_ops)',
+    ]
+
+    def upsert(self, connection, model, rows):
+        statement = text(
+            "INSERT INTO search_documents (model, id, content, document) "
+            "VALUES (:model, :id, :content, to_tsvector('simple', :content)) "
+            "ON CONFLICT (model, id) DO UPDATE SET content = EXCLUDED.content, document = EXCLUDED.document"
+        )
+        connection.execute(statement, [{'model': model, 'id': id, 'content': content} for id, content in rows])
+
+    def match(self, term):
+        """
+        :return: (condition, order by), every word of (term) is matched as a word or a substring
+        """
+        words = term.split()
+        if not words:
+            return None
+
+        conditions = []
+        for i, word in enumerate(words):
+            pattern = '%%%s%%' % word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append(text(
+                "(search_documents.document @@ plainto_tsquery('simple', :search_word_{0}) "
+                "OR search_documents.content ILIKE :search_pattern_{0})".format(i)
+            ).bindparams(**{'search_word_%d' % i: word, 'search_pattern_%d' % i: pattern}))
+
+        rank = text(
+            "ts_rank(search_documents.document, plainto_tsquery('simple', :rank_words)) "
+            "+ similarity(search_documents.content, :rank_term)"
+        ).bindparams(rank_words=term, rank_term=term)
+        return and_(*conditions), desc(rank)
+
+
+class SQLiteBackend(object):
+    create_statements = [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5(model UNINDEXED, id UNINDEXED, content)',
+    ]
+
+    def upsert(self, connection, model, rows):
+        delete(connection, model, [id for id, _ in rows])
+        connection.execute(
+            text('INSERT INTO search_documents (model, id, content) VALUES (:model, :id, :content)'),
+            [{'model': model, 'id': id, 'content': content} for id, content in rows]
+        )
+
+    def match(self, term):
+        # Every word as a prefix i.e (joh smi) finds John Smith
+        words = re.findall(r'\w+', term, re.UNICODE)
+        if not words:
+            return None
+        query = ' '.join('"%s"*' % w for w in words)
+        return text('search_documents MATCH :search_query').bindparams(search_query=query), text('rank')
+
+
+BACKENDS = {
+    'postgresql': PostgresBackend(),
+    'sqlite': SQLiteBackend(),
+}
+
+_available = False
+
+
+def get_backend():
+    """
+    :return: backend of current database if supported & index table exists, None otherwise
+    """
+    global _available
+
+    backend = BACKENDS.get(db.engine.dialect.name)
+    if backend is None:
+        return None
+    if not _available:
+        # Checked until the index is built
+        _available = db.engine.has_table(SEARCH_TABLE)
+    return backend if _available else None
+
+
+def create_index():
+    """
+    Create index table if missing
+
+    :return: backend
+    """
+    global _available
+
+    backend = BACKENDS.get(db.engine.dialect.name)
+    if backend is None:
+        raise Exception('Full text search is not supported on (%s)' % db.engine.dialect.name)
+    with db.engine.begin() as connection:
+        for statement in backend.create_statements:
+            connection.execute(text(statement))
+    _available = True
+    return backend
+
+
+def delete(connection, model, ids):
+    for chunk in chunks(list(ids)):
+        connection.execute(
+            search_documents.delete().where(search_documents.c.model == model).where(search_documents.c.id.in_(chunk))
+        )
+
+
+def index_records(session, document, ids):
+    """
+    Update documents of records (ids), documents of deleted records are removed
+
+    :param session: db session used to load records
+    :param document: SearchDocument
+    """
+    backend = get_backend()
+    if backend is None or not ids:
+        return
+
+    for chunk in chunks(list(ids)):
+        objs = session.query(document.model).filter(document.model.id.in_(chunk)).options(*document.load_options())
+        rows = [(obj.id, document.content(obj)) for obj in objs]
+        with db.engine.begin() as connection:
+            delete(connection, document.name, set(chunk) - {id for id, _ in rows})
+            if rows:
+                backend.upsert(connection, document.name, rows)
+
+
+def index_all(session):
+    """
+    Index all records of all documents
+
+    :return: {model name: number of indexed records}
+    :rtype: dict
+    """
+    indexed = {}
+    for document in SEARCH_DOCUMENTS:
+        ids = [id for id, in session.query(document.model.id)]
+        index_records(session, document, ids)
+        session.expunge_all()
+        indexed[document.name] = len(ids)
+    return indexed
+
+
+def index_changes(session, events):
+    """
+    Update documents affected by change events of one commit
+    """
+    wanted = OrderedDict()
+    for event in events:
+        for document in SEARCH_DOCUMENTS:
+            if event['model'] in document.tables():
+                wanted.setdefault(document, set()).update(document.affected_ids(session, event))
+
+    for document, ids in wanted.items():
+        index_records(session, document, ids)
+
+
+def search_condition(model, term):
+    """
+    Condition on (model) ids matching (term) i.e for admin searches
+
+    :return: condition or None if model isn't indexed or search index isn't available
+    """
+    document = DOCUMENTS.get(model)
+    backend = get_backend()
+    match = backend.match(term) if document is not None and backend is not None else None
+    if match is None:
+        return None
+
+    condition, _ = match
+    ids = select([search_documents.c.id]).where(search_documents.c.model == document.name).where(condition)
+    return model.id.in_(ids)
+
+
+def search(term, models=None, limit=20):
+    """
+    :param term: searched text
+    :param models: searched models, all indexed models if not given
+    :param limit: max number of results
+    :return: [(model, id)] best matches first, None if search index isn't available
+    :rtype: list
+    """
+    backend = get_backend()
+    if backend is None:
+        return None
+    match = backend.match(term)
+    if match is None:
+        return []
+
+    documents = {d.name: d for d in SEARCH_DOCUMENTS if models is None or d.model in models}
+    if not documents:
+        return []
+
+    condition, order_by = match
+    statement = select([search_documents.c.model, search_documents.c.id]) \
+        .where(search_documents.c.model.in_(list(documents))) \
+        .where(condition) \
+        .order_by(order_by) \
+        .limit(limit)
+    return [(documents[name].model, id) for name, id in db.session.execute(statement)]
+
+
+def load_results(results, query=None):
+    """
+    Load records of search results, one query per model
+
+    :param results: [(model, id)] as returned by search()
+    :param query: function returning base query of a model, session query by default
+    :return: records in results order
+    :rtype: list
+    """
+    wanted = OrderedDict()
+    for model, id in results:
+        wanted.setdefault(model, []).append(id)
+
+    found = {}
+    for model, ids in wanted.items():
+        base = query(model) if query is not None else db.session.query(model)
+        for obj in base.filter(model.id.in_(ids)):
+            found[(model, obj.id)] = obj
+    return [found[key] for key in results if key in found]
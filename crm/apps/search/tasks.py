@@ -0,0 +1,19 @@
+# RQ tasks
+
+
+def update_search_index(events):
+    """
+    Update search documents affected by change events of one commit.
+    Enqueued by crm.events.update_search_index
+
+    :param events: change events (crm.changes)
+    """
+    from crm.db import db
+    from .index import index_changes
+
+    # Own session, this can run right after a commit of the request session
+    session = db.session.session_factory()
+    try:
+        index_changes(session, events)
+    finally:
+        session.close()
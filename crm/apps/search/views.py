@@ -0,0 +1,29 @@
+from flask import request
+from flask_admin import BaseView
+
+from crm import app
+from .index import load_results, search
+
+SEARCH_PAGE_SIZE = 50
+
+
+class SearchAdminView(BaseView):
+    def __init__(self, *args, **kwargs):
+        self._default_view = True
+        super(SearchAdminView, self).__init__(*args, **kwargs)
+        self.admin = app.admin
+
+
+@app.route('/search', methods=["GET"])
+def search_view():
+    """
+    Global search box, searches all indexed models i.e /search?q=john
+    """
+    term = request.args.get('q', '').strip()
+    results = search(term, limit=SEARCH_PAGE_SIZE) if term else []
+    return SearchAdminView().render(
+        'search/search.html',
+        term=term,
+        available=results is not None,
+        results=load_results(results or [])
+    ), 200
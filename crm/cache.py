@@ -0,0 +1,126 @@
+"""
+Low level caching helpers shared by the API and the admin interface
+
+- A Redis connection derived from (CACHE_BACKEND_URI) on a dedicated db number
+  so that keys written here never show up in `flask dumpcache` which walks all
+  keys of the flask cache db
+- A thread safe in-process LRU used on its own when the cache backend is
+  (memory://) and as a first level cache in front of Redis otherwise
+"""
+
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, urlunparse
+
+from crm.settings import CACHE_BACKEND_URI, API_CACHE_REDIS_DB
+
+_redis = None
+
+
+def get_redis():
+    """
+    Get Redis client for API caches
+
+    :return: Redis connection or None if cache backend is not redis
+    :rtype: redis.StrictRedis
+    """
+    global _redis
+
+    if not CACHE_BACKEND_URI or not CACHE_BACKEND_URI.startswith('redis://'):
+        return None
+
+    if _redis is None:
+        from redis import StrictRedis
+
+        url = urlunparse(urlparse(CACHE_BACKEND_URI)._replace(path='/%d' % API_CACHE_REDIS_DB))
+        _redis = StrictRedis.from_url(url)
+    return _redis
+
+
+class LRUCache(object):
+    """
+    Bounded in-process cache, least recently used items are evicted first
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+TABLE_VERSION_KEY = 'crm:table_version:%s'
+
+_local_table_versions = {}
+_local_table_versions_lock = threading.Lock()
+
+
+def get_table_versions(tables):
+    """
+    Current version counter of each table
+
+    :param tables: table names
+    :return: {table_name: version}
+    :rtype: dict
+    """
+    tables = sorted(tables)
+    redis = get_redis()
+    if redis is None:
+        return {t: _local_table_versions.get(t, 0) for t in tables}
+
+    if not tables:
+        return {}
+    values = redis.mget([TABLE_VERSION_KEY % t for t in tables])
+    return {t: int(v or 0) for t, v in zip(tables, values)}
+
+
+def bump_table_versions(tables):
+    """
+    Increment version counter of each table, invalidating every cache entry
+    depending on these tables
+
+    :param tables: table names
+    """
+    if not tables:
+        return
+
+    redis = get_redis()
+    if redis is None:
+        with _local_table_versions_lock:
+            for t in tables:
+                _local_table_versions[t] = _local_table_versions.get(t, 0) + 1
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    for t in tables:
+        pipe.incr(TABLE_VERSION_KEY % t)
+    pipe.execute()
@@ -0,0 +1,242 @@
+"""
+Change feed of committed records, published by (crm.events.publish_changes)
+
+Every commit publishes one message holding its change events
+    {"model": "deals", "id": "d7y2t", "op": "updated", "updated_at": "2017-09-01T10:00:00",
+     "values": {...}, "previous": {...}}
+(values) holds filterable columns of the record i.e foreign keys, enums & booleans
+and is used to match subscriptions, (previous) holds values of those changed by updates
+i.e the contact an email was moved from. They're not sent to clients.
+
+Messages go through Redis pub/sub (on the API cache Redis) so every uwsgi worker
+on every node receives changes committed by any other one.
+When cache backend is not redis, changes are only delivered within the process.
+
+Handlers added by add_change_handler() are called with events of each commit
+in the committing process i.e to update the search index (crm.events.update_search_index),
+once events are published. Their errors are logged, they can't fail the commit nor other handlers.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import Boolean, Enum
+from sqlalchemy.orm import object_mapper
+from sqlalchemy.orm.attributes import instance_state
+
+from crm.cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+CHANGES_CHANNEL = 'crm:changes'
+
+OPERATIONS = ('created', 'updated', 'deleted')
+
+_local_subscribers = set()
+_local_subscribers_lock = threading.Lock()
+
+_change_handlers = []
+
+# {mapper: [column keys]} of columns published with change events to be used in subscription filters
+_filterable_columns = {}
+
+
+def get_filterable_columns(mapper):
+    columns = _filterable_columns.get(mapper)
+    if columns is None:
+        columns = _filterable_columns[mapper] = [
+            prop.key for prop in mapper.column_attrs
+            if prop.columns[0].foreign_keys or isinstance(prop.columns[0].type, (Enum, Boolean))
+        ]
+    return columns
+
+
+def change_event(obj, op, written=None):
+    """
+    :param obj: changed record
+    :param written: {column: value} written without the session (i.e by bulk UPDATE statements),
+        (obj) holds previous values then
+    :return: change event or None for records without change feed (many to many models)
+    :rtype: dict
+    """
+    mapper = object_mapper(obj)
+    if 'id' not in mapper.columns or 'updated_at' not in mapper.columns:
+        # Many to many models
+        return None
+
+    # Read loaded values only, never trigger a query from here
+    obj_state = instance_state(obj)
+    state = dict(obj_state.dict)
+    state.update(written or {})
+    values = {}
+    previous = {}
+    for key in get_filterable_columns(mapper):
+        value = getattr(state.get(key), 'name', state.get(key))
+        values[key] = value
+        if op != 'updated':
+            continue
+        if written is not None:
+            old_values = [obj_state.dict[key]] if key in written and key in obj_state.dict else []
+        else:
+            # Flushed changes, history is kept until the flush ends
+            old_values = obj_state.attrs[key].history.deleted or []
+        for old_value in old_values:
+            old_value = getattr(old_value, 'name', old_value)
+            if old_value != value:
+                previous[key] = old_value
+
+    event = {
+        'model': mapper.local_table.name,
+        'id': state.get('id'),
+        'op': op,
+        'updated_at': state.get('updated_at'),
+        'values': values
+    }
+    if previous:
+        event['previous'] = previous
+    return event
+
+
+def add_pending_changes(db_session, events):
+    """
+    Publish (events) once (db_session) transaction is committed, with events of flushed objects
+    (crm.events.publish_changes) i.e for records updated by bulk UPDATE statements which skip flush events
+    """
+    db_session.info.setdefault('change_events', []).extend(e for e in events if e is not None)
+
+
+def add_change_handler(handler):
+    """
+    :param handler: function called with change events of each commit, after commit
+    """
+    _change_handlers.append(handler)
+
+
+def publish_changes(events):
+    """
+    :param events: list of change events of one commit
+    """
+    if not events:
+        return
+
+    message = json.dumps(events, default=str)
+    redis = get_redis()
+    if redis is not None:
+        try:
+            redis.publish(CHANGES_CHANNEL, message)
+        except Exception:
+            # Data is committed already, subscribers miss this commit
+            logger.exception('Publishing change events failed')
+    else:
+        with _local_subscribers_lock:
+            subscribers = list(_local_subscribers)
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    for handler in _change_handlers:
+        try:
+            handler(events)
+        except Exception:
+            logger.exception('Change handler (%s) failed', getattr(handler, '__name__', handler))
+
+
+class Subscription(object):
+    """
+    One (model) and optional {column: value} filters i.e deals where deal_state=CLOSED
+
+    Parsed from strings like (messages) or (deals:deal_state=CLOSED,owner_id=u1)
+    """
+
+    def __init__(self, model, filters=None):
+        self.model = model
+        self.filters = filters or {}
+
+    @classmethod
+    def parse(cls, value):
+        """
+        :raises ValueError: if value is malformed
+        """
+        model, _, filters = value.partition(':')
+        if not model:
+            raise ValueError('Missing model in subscription (%s)' % value)
+
+        parsed = {}
+        for item in filter(None, filters.split(',')):
+            column, sep, expected = item.partition('=')
+            if not sep or not column:
+                raise ValueError('Invalid filter (%s), use column=value' % item)
+            parsed[column] = expected
+        return cls(model, parsed)
+
+    def matches(self, event):
+        """
+        Updated records match with their previous values too
+        i.e a deal reassigned from u1 to u2 matches (deals:owner_id=u1)
+        """
+        if event['model'] != self.model:
+            return False
+        values = event.get('values') or {}
+        previous = event.get('previous')
+        candidates = [values, dict(values, **previous)] if previous else [values]
+        return any(self._matches_values(v) for v in candidates)
+
+    def _matches_values(self, values):
+        for column, expected in self.filters.items():
+            value = values.get(column)
+            if value is None or str(value) != expected:
+                return False
+        return True
+
+
+def listen_changes(subscriptions, keepalive=15, max_age=None):
+    """
+    Generate events matching any of (subscriptions), (values) removed
+
+    :param subscriptions: list of Subscription
+    :param keepalive: seconds after which None is generated if nothing happened
+    :param max_age: seconds after which generation stops (client is expected to reconnect)
+    """
+    redis = get_redis()
+    if redis is not None:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANGES_CHANNEL)
+
+        def get_message(timeout):
+            message = pubsub.get_message(timeout=timeout)
+            return message['data'].decode('utf-8') if message else None
+
+        close = pubsub.close
+    else:
+        subscriber = queue.Queue()
+        with _local_subscribers_lock:
+            _local_subscribers.add(subscriber)
+
+        def get_message(timeout):
+            try:
+                return subscriber.get(timeout=timeout)
+            except queue.Empty:
+                return None
+
+        def close():
+            with _local_subscribers_lock:
+                _local_subscribers.discard(subscriber)
+
+    started = last_sent = time.time()
+    try:
+        while max_age is None or time.time() - started < max_age:
+            message = get_message(timeout=1)
+            if message is not None:
+                for event in json.loads(message):
+                    if any(s.matches(event) for s in subscriptions):
+                        event.pop('values', None)
+                        event.pop('previous', None)
+                        last_sent = time.time()
+                        yield event
+            if time.time() - last_sent >= keepalive:
+                last_sent = time.time()
+                yield None
+    finally:
+        close()
@@ -0,0 +1,14 @@
+from crm import app
+
+
+@app.cli.command()
+def build_search_index():
+    """
+    Create full text search index if missing and index all records.
+    """
+    from crm.apps.search.index import create_index, index_all
+    from crm.db import db
+
+    create_index()
+    for model, count in index_all(db.session).items():
+        print('%s: %d' % (model, count))
@@ -11,8 +11,8 @@ def generate_graphql_docs():
     requires graphdoc to be installed.
 
     """
-    from crm import app
-    sc = app.graphql_schema
+    from crm import crm
+    sc = crm.graphql_schema
 
     with open('./schema.graphql', "w") as f:
         f.write(str(sc))
@@ -0,0 +1,27 @@
+import click
+
+from crm import app
+
+
+@app.cli.command()
+@click.argument('directory')
+def register_queries(directory):
+    """
+    Register (*.graphql) files in a directory as persisted queries.
+    """
+    from crm import crm
+    from crm.apps.api.persisted_queries import PersistedQueryStore, PersistedQueryError
+    from crm.cache import get_redis
+
+    if get_redis() is None:
+        print('NOT SUPPORTED CACHE BACKEND, ONLY SUPPORTED IS (redis)')
+        exit(1)
+
+    store = PersistedQueryStore()
+    for query_id in store.load_directory(directory):
+        try:
+            store.register(crm.graphql_schema, store.get(query_id))
+        except PersistedQueryError as ex:
+            print('%s NOT REGISTERED: %s' % (query_id, ', '.join(ex.args)))
+            continue
+        print(query_id)
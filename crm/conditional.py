@@ -0,0 +1,75 @@
+"""
+Conditional GET helpers (ETag / Last-Modified) shared by the API and the admin interface
+
+Validators are computed from cheap data only, i.e (model, id, updated_at) of a record
+or version counters of tables (crm.cache.get_table_versions), so that a client
+holding an up to date copy gets (304 Not Modified) without running resolvers or
+rendering templates.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+
+from flask import request, session
+
+from crm.cache import get_table_versions
+
+
+def make_etag(*parts):
+    """
+    :param parts: JSON serializable parts identifying a representation, current user is added
+    :return: strong etag value
+    :rtype: str
+    """
+    user = session.get('user') or {} if session else {}
+    key = json.dumps([parts, user.get('id')], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def record_etag(model, id, updated_at, *parts):
+    """
+    :return: etag of one record representation
+    :rtype: str
+    """
+    return make_etag(model.__tablename__, id, updated_at.isoformat() if updated_at else None, *parts)
+
+
+def tables_etag(tables, *parts):
+    """
+    :return: etag of a representation depending on whole tables i.e lists
+    :rtype: str
+    """
+    return make_etag(get_table_versions(tables), *parts)
+
+
+def is_not_modified(etag=None, last_modified=None):
+    """
+    Check current request validators (If-None-Match takes precedence over If-Modified-Since)
+
+    :param etag: current etag
+    :param last_modified: current last modification time (naive UTC datetime)
+    :return: True if client copy is up to date
+    :rtype: bool
+    """
+    if request.if_none_match:
+        return etag is not None and request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates have no fractions of seconds
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def set_validators(response, etag=None, last_modified=None):
+    """
+    Add validators to a response, clients have to revalidate on each use
+
+    :return: response
+    """
+    if etag is not None:
+        response.set_etag(etag)
+    if isinstance(last_modified, datetime):
+        response.last_modified = last_modified
+    if etag is not None or last_modified is not None:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -16,6 +16,34 @@ from crm.apps.admin.mixins import AdminLinksMixin
 
 db = SQLAlchemy()
 
+# {table name: model class} filled lazily by ParentModel._get_model_from_table_name()
+_models_by_table_name = {}
+
+
+def chunks(items, size=500):
+    """
+    Split a list into lists of at most (size) items
+    i.e to keep IN queries under database limits on number of parameters
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def assign_uids(objs):
+    """
+    Give IDs to all new objects missing them, one batch of IDs per model
+    so update_auto_fields() doesn't have to look for a free ID per object
+    :param objs: model objects
+    """
+    missing = {}
+    for obj in objs:
+        if isinstance(obj, BaseModel) and not obj.id:
+            missing.setdefault(obj.__class__, []).append(obj)
+
+    for model, model_objs in missing.items():
+        for obj, uid in zip(model_objs, model.generate_uids(len(model_objs))):
+            obj.id = uid
+
 
 class RootModel(object):
 
@@ -180,6 +208,29 @@ class ParentModel(AdminLinksMixin):
             )
         )
 
+    @classmethod
+    def generate_uids(cls, count):
+        """
+        Generate unique IDs for (count) new records of this model
+        using one IN query per chunk of candidates instead of one query per record
+        :param count: number of IDs needed
+        :return: list of unused IDs
+        :rtype: list
+        """
+        uids = set()
+        while len(uids) < count:
+            candidates = set(
+                ''.join(random.sample(string.ascii_lowercase + string.digits, 5))
+                for _ in range(count - len(uids))
+            ) - uids
+
+            taken = set()
+            with db.session.no_autoflush:
+                for chunk in chunks(list(candidates)):
+                    taken.update(r[0] for r in db.session.query(cls.id).filter(cls.id.in_(chunk)))
+            uids.update(candidates - taken)
+        return list(uids)
+
     @classmethod
     def get_object_from_graphql_input(cls, graphql_input_dict):
         """
@@ -190,33 +241,71 @@ class ParentModel(AdminLinksMixin):
         :param graphql_input_dict: {'forstname': 'blah', 'tasks': [{'nam':'task1'}]}
         :return: Model object from cls
         """
+        return cls.get_objects_from_graphql_input([graphql_input_dict])[0]
 
-        d = dict(graphql_input_dict)
+    @classmethod
+    def get_objects_from_graphql_input(cls, graphql_input_dicts):
+        """
+        Same as get_object_from_graphql_input() but for many records at once
+        :param graphql_input_dicts: list of graphql mutation inputs
+        :return: list of Model objects from cls
+        :rtype: list
+        """
+        return [cls(**d) for d in cls.resolve_graphql_input(graphql_input_dicts)]
 
-        if 'uid' in d:
-            d['id'] = d.pop('uid')
+    @classmethod
+    def resolve_graphql_input(cls, graphql_input_dicts):
+        """
+        Given list of graphql mutation inputs, return list of dicts
+        with `uid` replaced by `id` and relation fields replaced by model objects
+        All referenced records i.e {'contact': {'uid': 'xxxxx'}} across all
+        records are resolved using one IN query per referenced model
+        :param graphql_input_dicts: list of graphql mutation inputs
+        :return: list of dicts ready to be used as model attributes
+        :rtype: list
+        """
 
-        for k, v in d.items():
-            if isinstance(v, dict):
-                m = cls()._get_model_from_table_name(getattr(cls, k).prop.table.name)
-                if 'uid' in v:
-                    id = v.pop('uid')
-                    d[k] = m.query.filter_by(id=id).first()
-                    if not d[k]:
-                        raise Exception('Invalid uid %s' % id)
-                else:
-                    d[k] = m(**dict(v))
-            elif isinstance(v, list):
-                m = cls()._get_model_from_table_name(getattr(cls, k).prop.table.name)
-                for i, item in enumerate(v):
+        # {model: set(ids)} of all referenced records
+        references = {}
+
+        for d in graphql_input_dicts:
+            for k, v in d.items():
+                items = [v] if isinstance(v, dict) else v if isinstance(v, list) else []
+                for item in items:
                     if 'uid' in item:
-                        id = item.pop('uid')
-                        v[i] = m.query.filter_by(id=id).first()
-                        if not v[i]:
-                            raise Exception('Invalid uid %s' % id)
-                    else:
-                        v[i] = m(**dict(item))
-        return cls(**d)
+                        m = getattr(cls, k).prop.mapper.class_
+                        references.setdefault(m, set()).add(item['uid'])
+
+        # {model: {id: object}}
+        resolved = {}
+        for m, ids in references.items():
+            resolved[m] = {}
+            for chunk in chunks(list(ids)):
+                resolved[m].update((obj.id, obj) for obj in m.query.filter(m.id.in_(chunk)))
+
+        def resolve(m, item):
+            if 'uid' not in item:
+                return m(**dict(item))
+            obj = resolved[m].get(item['uid'])
+            if obj is None:
+                raise Exception('Invalid uid %s' % item['uid'])
+            return obj
+
+        result = []
+        for graphql_input_dict in graphql_input_dicts:
+            d = dict(graphql_input_dict)
+
+            if 'uid' in d:
+                d['id'] = d.pop('uid')
+
+            for k, v in d.items():
+                if isinstance(v, dict):
+                    d[k] = resolve(getattr(cls, k).prop.mapper.class_, v)
+                elif isinstance(v, list):
+                    m = getattr(cls, k).prop.mapper.class_
+                    d[k] = [resolve(m, item) for item in v]
+            result.append(d)
+        return result
 
     @classmethod
     def decode_graphene_id(cls, id):
@@ -241,9 +330,12 @@ class ParentModel(AdminLinksMixin):
         :return: model class associated with this table name
         :rtype: db.Model
         """
-        for c in self.__class__._decl_class_registry.values():
-            if hasattr(c, '__tablename__') and c.__tablename__ == name:
-                return c
+        if name not in _models_by_table_name:
+            for c in self.__class__._decl_class_registry.values():
+                if hasattr(c, '__tablename__') and c.__tablename__ == name:
+                    _models_by_table_name[name] = c
+                    break
+        return _models_by_table_name.get(name)
 
     def _get_fk_pk_for(self, model_cls):
         """
@@ -0,0 +1,37 @@
+from sqlalchemy.engine import Engine
+from sqlalchemy.event import listen
+from sqlalchemy.sql.dml import UpdateBase
+
+from crm.cache import bump_table_versions
+from crm.db import db
+
+
+def collect_written_tables_after_execute(conn, clauseelement, multiparams, params, result):
+    """
+    Catch every INSERT/UPDATE/DELETE statement executed, including statements
+    issued by flush, bulk query updates/deletes & core statements executed in
+    mapper events (i.e crm.events.notify_new_task)
+    and keep track of written tables in db_session.info['written_tables']
+    """
+    if not isinstance(clauseelement, UpdateBase):
+        return
+    db.session.info.setdefault('written_tables', set()).add(clauseelement.table.name)
+
+
+def bump_table_versions_after_commit(db_session):
+    """
+    Data is in DB now, bump version counter of all written tables
+    so cache entries depending on these tables are invalidated
+    """
+    tables = db_session.info.pop('written_tables', None)
+    if tables:
+        bump_table_versions(tables)
+
+
+def discard_written_tables_after_rollback(db_session):
+    db_session.info.pop('written_tables', None)
+
+
+listen(Engine, 'after_execute', collect_written_tables_after_execute)
+listen(db.session, 'after_commit', bump_table_versions_after_commit)
+listen(db.session, 'after_rollback', discard_written_tables_after_rollback)
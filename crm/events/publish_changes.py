@@ -0,0 +1,51 @@
+from sqlalchemy.event import listen
+
+from crm.changes import add_pending_changes, change_event, publish_changes
+from crm.db import db
+
+
+def collect_changes_after_flush(db_session, flush_context):
+    """
+    Keep change events of flushed objects in db_session.info['change_events']
+    until the transaction is committed, ids & python side defaults are set by now
+    """
+    events = []
+    for op, objs in (('created', db_session.new), ('updated', db_session.dirty), ('deleted', db_session.deleted)):
+        for obj in objs:
+            if op == 'updated' and not db_session.is_modified(obj):
+                continue
+            events.append(change_event(obj, op))
+    add_pending_changes(db_session, events)
+
+
+def publish_changes_after_commit(db_session):
+    """
+    Data is in DB now, tell subscribers (/api/changes) about it
+    """
+    events = db_session.info.pop('change_events', None)
+    if not events:
+        return
+
+    # Several flushes in one transaction, keep last event per record
+    latest = {}
+    for event in events:
+        key = (event['model'], event['id'])
+        previous = latest.get(key)
+        if previous is not None and previous['op'] == 'created' and event['op'] == 'updated':
+            event['op'] = 'created'
+            event.pop('previous', None)
+        elif previous is not None and previous.get('previous') and event['op'] == 'updated':
+            # Values before the first update of the transaction
+            event['previous'] = dict(event.get('previous') or {}, **previous['previous'])
+        latest.pop(key, None)
+        latest[key] = event
+    publish_changes(list(latest.values()))
+
+
+def discard_changes_after_rollback(db_session):
+    db_session.info.pop('change_events', None)
+
+
+listen(db.session, 'after_flush', collect_changes_after_flush)
+listen(db.session, 'after_commit', publish_changes_after_commit)
+listen(db.session, 'after_rollback', discard_changes_after_rollback)
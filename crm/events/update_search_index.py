@@ -0,0 +1,26 @@
+from crm.apps.search.index import SEARCH_DOCUMENTS
+from crm.apps.search.tasks import update_search_index
+from crm.cache import get_redis
+from crm.changes import add_change_handler
+from crm.rq import queue
+
+# Tables whose changes affect search documents
+_indexed_tables = set().union(*(d.tables() for d in SEARCH_DOCUMENTS))
+
+
+def update_search_index_after_commit(events):
+    """
+    Update search documents affected by committed changes, in a RQ worker
+    when running with redis, right away otherwise (dev & tests)
+    """
+    events = [e for e in events if e['model'] in _indexed_tables]
+    if not events:
+        return
+
+    if get_redis() is not None:
+        queue.enqueue(update_search_index, events)
+    else:
+        update_search_index(events)
+
+
+add_change_handler(update_search_index_after_commit)
@@ -1,9 +1,20 @@
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
 import graphene
 from graphene import AbstractType
 from graphene_sqlalchemy import SQLAlchemyObjectType
 from graphene_sqlalchemy.fields import SQLAlchemyConnectionField
+from graphene.types.json import JSONString
+from graphene.utils.str_converters import to_snake_case
+from graphql.error.base import GraphQLError
+from sqlalchemy import and_, or_, func, Integer, Float, Numeric, Date, DateTime
+from sqlalchemy.inspection import inspect
 
-from sqlalchemy import and_, or_
+from crm.changes import add_pending_changes, change_event
+from crm.db import db, assign_uids, chunks
 
 
 class BaseMutation(graphene.ObjectType):
@@ -13,6 +24,296 @@ class BaseMutation(graphene.ObjectType):
     pass
 
 
+def _same_value(current, new):
+    if isinstance(current, Enum):
+        return new in (current, current.name, current.value)
+    return current == new
+
+
+def create_records(model, records, batch_size=500):
+    """
+    Insert new records of a model (without committing)
+
+    - All referenced records ({uid: ...}) across the whole payload are resolved
+      using one IN query per model
+    - IDs are generated in batches per model
+    - Objects are flushed in batches of (batch_size)
+      (before_flush hooks still set authors)
+
+    :param model: model class
+    :param records: graphql create inputs
+    :return: created objects
+    :rtype: list
+    """
+    objs = model.get_objects_from_graphql_input(records)
+
+    for chunk in chunks(objs, batch_size):
+        db.session.add_all(chunk)
+        # new nested objects i.e deal.tasks are in session now
+        assign_uids(list(db.session.new))
+        db.session.flush()
+    return objs
+
+
+def update_records(model, records):
+    """
+    Update existing records of a model (without committing)
+
+    - All target records are loaded using one IN query
+    - Only provided fields that differ from current values are applied
+    - Records changing plain columns only are updated using grouped
+      UPDATE ... WHERE id IN (...) statements (one per distinct set of values)
+      unless model has before_update/after_update hooks that need the objects.
+      Their change events (crm.changes) are published on commit like those of flushed objects
+
+    :param model: model class
+    :param records: graphql update inputs, each must have (uid)
+    :return: updated ids
+    :rtype: list
+    """
+    actual = {}
+    for chunk in chunks(list(set(r['uid'] for r in records))):
+        actual.update((obj.id, obj) for obj in model.query.filter(model.id.in_(chunk)))
+
+    for r in records:
+        if r['uid'] not in actual:
+            raise GraphQLError('Invalid id (%s)' % r['uid'])
+
+    mapper = inspect(model)
+    columns = set(c.key for c in mapper.column_attrs)
+    bulk = not (bool(mapper.dispatch.before_update) or bool(mapper.dispatch.after_update))
+
+    # {frozenset(values.items()): [ids]}
+    groups = {}
+    # [(obj, changed values)] of grouped records
+    grouped = []
+
+    for d in model.resolve_graphql_input(records):
+        obj = actual[d.pop('id')]
+        changed = {}
+        for k, v in d.items():
+            if isinstance(v, list) or isinstance(v, db.Model) or not _same_value(getattr(obj, k), v):
+                changed[k] = v
+
+        if not changed:
+            continue
+        if bulk and set(changed).issubset(columns):
+            groups.setdefault(frozenset(changed.items()), []).append(obj.id)
+            grouped.append((obj, changed))
+            continue
+        for k, v in changed.items():
+            setattr(obj, k, v)
+
+    # Objects in session first (before_flush sets their last author)
+    db.session.flush()
+
+    if groups:
+        from flask import session
+        cur_user = session.get('user') or {} if session else {}
+        # Set here rather than by column onupdate so change events carry it
+        now = datetime.utcnow()
+
+        for values, ids in groups.items():
+            values = dict(values)
+            # Same as update_auto_fields(update=True) does for objects
+            values['author_last_id'] = func.coalesce(model.author_last_id, cur_user.get('id'))
+            if 'updated_at' in columns:
+                values['updated_at'] = now
+            for chunk in chunks(ids):
+                model.query.filter(model.id.in_(chunk)).update(values, synchronize_session=False)
+
+        add_pending_changes(db.session, [
+            change_event(obj, 'updated', dict(changed, updated_at=now)) for obj, changed in grouped
+        ])
+
+    return [r['uid'] for r in records]
+
+
+class CreateMutationMixin(object):
+    """
+    Bulk create logic shared by all Create{Model}s mutations
+    see create_records()
+
+    usage:
+        class CreateDeals(CreateMutationMixin, graphene.Mutation):
+            model = Deal
+
+            class Arguments:
+                records = graphene.List(CreateDealArguments, required=True)
+    """
+    model = None
+    batch_size = 500
+
+    ok = graphene.Boolean()
+    ids = graphene.List(graphene.String)
+
+    @classmethod
+    def mutate(cls, root, context, **kwargs):
+        """
+        Mutation logic is handled here
+        """
+        try:
+            objs = create_records(cls.model, kwargs.get('records', []), cls.batch_size)
+            db.session.commit()
+            return cls(ok=True, ids=[obj.id for obj in objs])
+        except Exception as e:
+            db.session.rollback()
+            raise GraphQLError(e.args)
+
+
+class UpdateMutationMixin(object):
+    """
+    Update logic shared by all Update{Model}s mutations
+    see update_records()
+
+    usage:
+        class UpdateDeals(UpdateMutationMixin, graphene.Mutation):
+            model = Deal
+
+            class Arguments:
+                records = graphene.List(UpdateDealArguments, required=True)
+    """
+    model = None
+
+    ok = graphene.Boolean()
+    ids = graphene.List(graphene.String)
+
+    @classmethod
+    def mutate(cls, root, context, **kwargs):
+        """
+        Mutation logic is handled here
+        """
+        try:
+            ids = update_records(cls.model, kwargs.get('records', []))
+            db.session.commit()
+            return cls(ok=True, ids=ids)
+        except Exception as e:
+            db.session.rollback()
+            raise GraphQLError(e.args)
+
+
+class UpsertMutationMixin(object):
+    """
+    Insert or update records matched by a natural key in one transaction
+
+    (natural_keys) maps key names accepted in (key) argument to a model column
+    i.e 'referral_code' or to a column in a related model i.e 'emails.email'
+    Each record carries the key value in a field with the key name.
+    When a new record is created with a related key, the related object
+    is created too i.e Email(email=...), next to the other provided ones.
+    Records that are created must have values for (create_required_fields)
+    like inputs of create mutations
+
+    usage:
+        class UpsertContacts(UpsertMutationMixin, graphene.Mutation):
+            model = Contact
+            natural_keys = {'email': 'emails.email', 'referral_code': 'referral_code'}
+            default_key = 'email'
+            create_required_fields = ('firstname', 'lastname')
+
+            class Arguments:
+                records = graphene.List(UpsertContactArguments, required=True)
+                key = graphene.String()
+    """
+    model = None
+    natural_keys = {}
+    default_key = None
+    create_required_fields = ()
+    batch_size = 500
+
+    ok = graphene.Boolean()
+    created = graphene.List(graphene.String)
+    updated = graphene.List(graphene.String)
+
+    @classmethod
+    def match(cls, key, values):
+        """
+        :param key: natural key name
+        :param values: key values
+        :return: {key value: record id} for existing records
+        :rtype: dict
+        :raises GraphQLError: if a value matches several records, natural keys aren't unique columns
+            i.e an email shared by two companies
+        """
+        path = cls.natural_keys[key]
+        if '.' in path:
+            relation, column = path.split('.')
+            related = getattr(cls.model, relation).prop.mapper.class_
+            attr = getattr(related, column)
+            query = db.session.query(attr, cls.model.id).select_from(cls.model).join(getattr(cls.model, relation))
+        else:
+            attr = getattr(cls.model, path)
+            query = db.session.query(attr, cls.model.id)
+
+        matched = {}
+        ambiguous = set()
+        for chunk in chunks(list(values)):
+            for value, id in query.filter(attr.in_(chunk)):
+                if matched.setdefault(value, id) != id:
+                    ambiguous.add(value)
+        if ambiguous:
+            raise GraphQLError('Ambiguous (%s) values matching several %s: %s' % (
+                key, cls.model.__tablename__, ', '.join(sorted(str(v) for v in ambiguous))
+            ))
+        return matched
+
+    @classmethod
+    def mutate(cls, root, context, **kwargs):
+        """
+        Mutation logic is handled here
+        """
+        key = kwargs.get('key') or cls.default_key
+        if key not in cls.natural_keys:
+            raise GraphQLError('Invalid key (%s), supported keys are %s' % (key, ', '.join(sorted(cls.natural_keys))))
+
+        records = [dict(r) for r in kwargs.get('records', [])]
+        values = [r.get(key) for r in records]
+        if not all(values):
+            raise GraphQLError('All records must have a value for (%s)' % key)
+        if len(set(values)) != len(values):
+            raise GraphQLError('Duplicate values for (%s)' % key)
+
+        matched = cls.match(key, values)
+
+        path = cls.natural_keys[key]
+        to_create, to_update = [], []
+        for record in records:
+            value = record.pop(key)
+            if value in matched:
+                record['uid'] = matched[value]
+                if '.' not in path:
+                    record[key] = value
+                to_update.append(record)
+            else:
+                missing = [f for f in cls.create_required_fields if not record.get(f)]
+                if missing:
+                    raise GraphQLError('New %s must have a value for (%s), missing for (%s) %s' % (
+                        cls.model.__tablename__, ', '.join(missing), key, value
+                    ))
+                if '.' in path:
+                    relation, column = path.split('.')
+                    related = record.get(relation)
+                    if isinstance(related, str):
+                        # i.e emails: "info@example.com, sales@example.com"
+                        related = [{column: v.strip()} for v in related.split(',') if v.strip()]
+                    related = list(related or [])
+                    if not any(item.get(column) == value for item in related):
+                        related.append({column: value})
+                    record[relation] = related
+                else:
+                    record[key] = value
+                to_create.append(record)
+
+        try:
+            updated = update_records(cls.model, to_update) if to_update else []
+            created = create_records(cls.model, to_create, cls.batch_size) if to_create else []
+            db.session.commit()
+            return cls(ok=True, created=[obj.id for obj in created], updated=updated)
+        except Exception as e:
+            db.session.rollback()
+            raise GraphQLError(e.args)
+
+
 class CRMConnectionField(SQLAlchemyConnectionField):
     @classmethod
     def flatten_query(cls, prefix=None, flat_query={}, query={}):
@@ -193,10 +494,140 @@ class CRMConnectionField(SQLAlchemyConnectionField):
                 final_query = final_query.filter(filter)
         return final_query
 
+    @staticmethod
+    def get_streamed_query(info):
+        """
+        :return: StreamedQuery (crm.apps.api.streaming) if (info) is of its streamed root field
+        """
+        streamed = info.context
+        if hasattr(streamed, 'is_streamed_field') and streamed.is_streamed_field(info):
+            return streamed
+        return None
+
     @classmethod
     def get_query(cls, model, info, **args):
+        """
+        Return the query itself rather than all records, so that
+        connection slicing (first, after, ...) is done in SQL (LIMIT/OFFSET)
+
+        Streamed fields are read in id order after the last streamed record (keyset)
+        """
         flat_query = cls.flatten_query(None, {}, args)
-        return cls.compile_query(model, flat_query, info,).all()
+        query = cls.compile_query(model, flat_query, info,)
+        streamed = cls.get_streamed_query(info)
+        if streamed is not None:
+            query = query.order_by(model.id)
+            if streamed.after_id is not None:
+                query = query.filter(model.id > streamed.after_id)
+        return query
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, model, root, info, **args):
+        result = super(CRMConnectionField, cls).connection_resolver(resolver, connection, model, root, info, **args)
+        streamed = cls.get_streamed_query(info)
+        if streamed is not None:
+            streamed.chunk_loaded(result.edges)
+        return result
+
+
+def _json_value(value):
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class AggregateRow(graphene.ObjectType):
+    """
+    One row of an aggregate query, (group) holds values of groupBy fields
+    and (sum), (avg), (min), (max) hold {field: value} of requested fields
+    """
+    group = JSONString()
+    count = graphene.Int()
+    sum = JSONString()
+    avg = JSONString()
+    min = JSONString()
+    max = JSONString()
+
+
+class CRMAggregateField(graphene.Field):
+    """
+    Aggregate records of a model server side using one SQL GROUP BY
+
+    Accepts same filters as CRMConnectionField plus
+    (groupBy) and (sum), (avg), (min), (max) lists of field names
+
+    usage:
+        deals_aggregate = CRMAggregateField(DealType, **DealArguments.fields())
+
+    query:
+        {
+          dealsAggregate(dealState: "NEW", groupBy: ["dealType"], sum: ["value"]) {
+            group
+            count
+            sum
+          }
+        }
+    """
+    FUNCTIONS = ('sum', 'avg', 'min', 'max')
+    NUMERIC_TYPES = (Integer, Float, Numeric)
+
+    def __init__(self, type, *args, **kwargs):
+        self.model = type._meta.model
+        kwargs['group_by'] = graphene.List(graphene.String)
+        for name in self.FUNCTIONS:
+            kwargs[name] = graphene.List(graphene.String)
+        super().__init__(graphene.List(AggregateRow), *args, **kwargs)
+
+    def get_resolver(self, parent_resolver):
+        return self.resolve_aggregate
+
+    def get_column(self, field_name, function=None):
+        """
+        :param field_name: snake_case or camelCase field name
+        :param function: aggregate function to be applied on the field
+        :return: model column
+        """
+        field_name = to_snake_case(field_name)
+        columns = inspect(self.model).columns
+        if field_name not in columns:
+            raise GraphQLError('Invalid field (%s) for %s' % (field_name, self.model.__name__))
+
+        column = columns[field_name]
+        allowed = self.NUMERIC_TYPES if function in ('sum', 'avg') else self.NUMERIC_TYPES + (Date, DateTime)
+        if function is not None and not isinstance(column.type, allowed):
+            raise GraphQLError('Can not apply (%s) on field (%s)' % (function, field_name))
+        return getattr(self.model, column.key)
+
+    def resolve_aggregate(self, root, info, **args):
+        group_by = args.pop('group_by', None) or []
+        functions = [(name, args.pop(name, None) or []) for name in self.FUNCTIONS]
+
+        group_columns = [self.get_column(name) for name in group_by]
+        entities = list(group_columns) + [func.count(self.model.id)]
+        for name, field_names in functions:
+            for field_name in field_names:
+                entities.append(getattr(func, name)(self.get_column(field_name, name)))
+
+        flat_query = CRMConnectionField.flatten_query(None, {}, args)
+        query = CRMConnectionField.compile_query(self.model, flat_query, info)
+        query = query.with_entities(*entities)
+        if group_columns:
+            query = query.group_by(*group_columns).order_by(*group_columns)
+
+        result = []
+        for row in query:
+            row = list(row)
+            group = OrderedDict((name, _json_value(row.pop(0))) for name in group_by)
+            aggregate = AggregateRow(group=group, count=row.pop(0))
+            for name, field_names in functions:
+                if field_names:
+                    setattr(aggregate, name, OrderedDict((f, _json_value(row.pop(0))) for f in field_names))
+            result.append(aggregate)
+        return result
 
 
 class BaseQuery(graphene.ObjectType):
@@ -9,7 +9,7 @@ from pyblake2 import blake2b
 import sendgrid
 from sendgrid.helpers.mail import Email, Content, Mail, Attachment as SendGridAttachment
 from crm.settings import ATTACHMENTS_DIR, STATIC_URL_PATH, SENDGRID_API_KEY, SUPPORT_EMAIL
-from flask_misaka import markdown
+from crm.markdown_cache import render_markdown
 
 
 Attachment = namedtuple(
@@ -136,7 +136,7 @@ def sendemail(to=None, from_=None, subject=None, body=None, attachments=None, re
         from_email = Email(reply_to)
 
     to_email = Email(to[0])
-    content = Content("text/html", markdown(body))
+    content = Content("text/html", render_markdown(body))
 
     mail = Mail(from_email, subject, to_email, content)
     if reply_to is not None:
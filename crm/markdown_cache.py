@@ -0,0 +1,48 @@
+"""
+Cache of rendered markdown shared by admin formatters and the mailer
+
+Rendered HTML is keyed by blake2b hash of the markdown source, so entries never
+need invalidation: an edited description is a new key, unused keys expire.
+A bounded in-process LRU sits in front of Redis (if CACHE_BACKEND_URI is a redis URL).
+Short sources are rendered directly, misaka is faster than a cache round trip for them.
+"""
+
+from flask_misaka import markdown
+from jinja2 import Markup
+from pyblake2 import blake2b
+
+from crm.cache import LRUCache, get_redis
+from crm.settings import MARKDOWN_CACHE_SIZE, MARKDOWN_CACHE_TIMEOUT, MARKDOWN_CACHE_MIN_LENGTH
+
+MARKDOWN_KEY = 'crm:markdown:%s'
+
+_local = LRUCache(MARKDOWN_CACHE_SIZE)
+
+
+def render_markdown(source):
+    """
+    :param source: markdown text
+    :return: rendered HTML
+    :rtype: Markup
+    """
+    if not source or len(source) < MARKDOWN_CACHE_MIN_LENGTH:
+        return markdown(source)
+
+    key = blake2b(source.encode('utf-8'), digest_size=20).hexdigest()
+    html = _local.get(key)
+    if html is not None:
+        return Markup(html)
+
+    redis = get_redis()
+    if redis is not None:
+        cached = redis.get(MARKDOWN_KEY % key)
+        if cached is not None:
+            html = cached.decode('utf-8')
+            _local.set(key, html)
+            return Markup(html)
+
+    html = str(markdown(source))
+    _local.set(key, html)
+    if redis is not None:
+        redis.setex(MARKDOWN_KEY % key, MARKDOWN_CACHE_TIMEOUT, html)
+    return Markup(html)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from importlib import import_module
 from os.path import dirname
 
@@ -42,6 +43,76 @@ SUPPORT_EMAIL = os.getenv('SUPPORT_EMAIL')
 
 SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
 
+# Redis db number (on the CACHE_BACKEND_URI server) used by API caches & stores
+API_CACHE_REDIS_DB = int(os.getenv('API_CACHE_REDIS_DB', 2))
+
+# Directory of (*.graphql) files registered as persisted queries on startup
+PERSISTED_QUERIES_DIR = os.getenv('PERSISTED_QUERIES_DIR')
+
+# When enabled, /api executes persisted queries only, free query texts are rejected
+PERSISTED_QUERIES_ONLY = os.getenv('PERSISTED_QUERIES_ONLY', '').lower() in ('1', 'true', 'yes')
+
+# When enabled, clients register new persisted queries by sending a query with its id (enabled in dev)
+PERSISTED_QUERIES_REGISTRATION = os.getenv('PERSISTED_QUERIES_REGISTRATION', '').lower() in ('1', 'true', 'yes')
+
+# Max number of registered queries kept per process, queries of PERSISTED_QUERIES_DIR aren't counted
+PERSISTED_QUERIES_CACHE_SIZE = int(os.getenv('PERSISTED_QUERIES_CACHE_SIZE', 1024))
+
+# Cache results of read only graphql queries, invalidated by table version counters
+GRAPHQL_RESPONSE_CACHE = os.getenv('GRAPHQL_RESPONSE_CACHE', '').lower() in ('1', 'true', 'yes')
+GRAPHQL_RESPONSE_CACHE_TIMEOUT = int(os.getenv('GRAPHQL_RESPONSE_CACHE_TIMEOUT', 3600))
+
+# Build graphql schema (and its introspection) on startup rather than on first use
+# i.e in uwsgi master before forking workers
+GRAPHQL_SCHEMA_PREBUILD = os.getenv('GRAPHQL_SCHEMA_PREBUILD', '').lower() in ('1', 'true', 'yes')
+
+# Graphql queries over these limits are rejected before execution (0 disables a limit)
+GRAPHQL_MAX_COST = int(os.getenv('GRAPHQL_MAX_COST', 50000))
+GRAPHQL_MAX_DEPTH = int(os.getenv('GRAPHQL_MAX_DEPTH', 10))
+# Items assumed for lists & connections queried without (first) argument
+GRAPHQL_DEFAULT_LIST_SIZE = int(os.getenv('GRAPHQL_DEFAULT_LIST_SIZE', 100))
+# Database statement timeout for graphql requests in milliseconds (0 disables)
+GRAPHQL_STATEMENT_TIMEOUT = int(os.getenv('GRAPHQL_STATEMENT_TIMEOUT', 30000))
+# Max number of operations in one batched request
+GRAPHQL_MAX_BATCH_SIZE = int(os.getenv('GRAPHQL_MAX_BATCH_SIZE', 20))
+# Records fetched & sent per chunk by streamed /api list queries
+API_STREAM_CHUNK_SIZE = int(os.getenv('API_STREAM_CHUNK_SIZE', 500))
+
+# Aggregate per field resolver timings of all graphql requests, exported on /api/metrics
+GRAPHQL_FIELD_METRICS = os.getenv('GRAPHQL_FIELD_METRICS', '').lower() in ('1', 'true', 'yes')
+
+# Admin list pages row counts (crm.apps.admin.counts), cached counts timeout in seconds
+# and estimates under which rows are counted exactly
+ADMIN_COUNT_CACHE_TIMEOUT = int(os.getenv('ADMIN_COUNT_CACHE_TIMEOUT', 24 * 3600))
+ADMIN_COUNT_ESTIMATE_MIN = int(os.getenv('ADMIN_COUNT_ESTIMATE_MIN', 10000))
+
+# Rendered markdown cache (crm.markdown_cache), sources shorter than min length aren't cached
+MARKDOWN_CACHE_SIZE = int(os.getenv('MARKDOWN_CACHE_SIZE', 1024))
+MARKDOWN_CACHE_TIMEOUT = int(os.getenv('MARKDOWN_CACHE_TIMEOUT', 7 * 24 * 3600))
+MARKDOWN_CACHE_MIN_LENGTH = int(os.getenv('MARKDOWN_CACHE_MIN_LENGTH', 256))
+
+# Seconds between keepalive comments sent to idle /api/changes connections
+API_CHANGES_KEEPALIVE = int(os.getenv('API_CHANGES_KEEPALIVE', 15))
+# Seconds after which /api/changes connections are closed, clients reconnect automatically
+API_CHANGES_MAX_AGE = int(os.getenv('API_CHANGES_MAX_AGE', 300))
+
+# Admin exports (crm.apps.admin.exports): records loaded per query, exports of more records than
+# sync max rows are written by the RQ worker into export dir & kept (ttl) seconds
+ADMIN_EXPORT_CHUNK_SIZE = int(os.getenv('ADMIN_EXPORT_CHUNK_SIZE', 1000))
+ADMIN_EXPORT_SYNC_MAX_ROWS = int(os.getenv('ADMIN_EXPORT_SYNC_MAX_ROWS', 5000))
+ADMIN_EXPORT_DIR = os.getenv('ADMIN_EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'crm_exports'))
+ADMIN_EXPORT_TTL = int(os.getenv('ADMIN_EXPORT_TTL', 24 * 3600))
+ADMIN_EXPORT_JOB_TIMEOUT = int(os.getenv('ADMIN_EXPORT_JOB_TIMEOUT', 3600))
+
+# Items per page of related panels in admin details pages (crm.apps.admin.panels)
+ADMIN_DETAILS_PANEL_SIZE = int(os.getenv('ADMIN_DETAILS_PANEL_SIZE', 20))
+
+# Rows of inline collections rendered in admin edit pages, next rows are loaded on demand (crm.apps.admin.inline)
+ADMIN_INLINE_WINDOW_SIZE = int(os.getenv('ADMIN_INLINE_WINDOW_SIZE', 20))
+
+# Max options returned per request by AJAX relationship select fields of admin forms (crm.apps.admin.ajax)
+ADMIN_AJAX_LOOKUP_LIMIT = int(os.getenv('ADMIN_AJAX_LOOKUP_LIMIT', 20))
+
 ######################
 # Leave as the last line
 ########################
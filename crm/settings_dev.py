@@ -21,6 +21,8 @@ SQLALCHEMY_RECORD_QUERIES = True
 
 CACHE_BACKEND_URI = 'memory://'
 
+PERSISTED_QUERIES_REGISTRATION = True
+
 DATA_DIR = 'data'
 
 SUPPORT_EMAIL = os.getenv('SUPPORT_EMAIL', None)
@@ -1 +1,13 @@
-from .settings_dev import *
\ No newline at end of file
+import os
+import tempfile
+
+from .settings_dev import *
+
+# Tests drop & create all tables, never run them against SQLALCHEMY_DATABASE_URI
+SQLALCHEMY_DATABASE_URI = os.getenv(
+    'TEST_DATABASE_URI',
+    'sqlite:///%s' % os.path.join(tempfile.gettempdir(), 'crm_test.db')
+)
+
+SUPPORT_EMAIL = os.getenv('SUPPORT_EMAIL', 'support@example.com')
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", 'test')
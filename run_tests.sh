@@ -1,4 +1,6 @@
 #!/bin/bash
 set -e
 
-nosetests --with-coverage --cover-package=crm --cover-html --cover-erase
\ No newline at end of file
+export ENV=test
+
+nosetests --with-coverage --cover-package=crm --cover-html --cover-erase
@@ -0,0 +1,4 @@
+import os
+
+# Settings are loaded when (crm) is first imported
+os.environ.setdefault('ENV', 'test')
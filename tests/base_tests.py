@@ -2,6 +2,9 @@ import os
 import unittest
 import tempfile
 import sys
+from contextlib import contextmanager
+
+from sqlalchemy.event import listen, remove
 
 # crm_base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # sys.path.insert(0, crm_base)
@@ -32,5 +35,86 @@ class BaseTestCase(unittest.TestCase):
         os.unlink(crm.app.config['DATABASE'])
 
 
+class DBTestCase(BaseTestCase):
+    """
+    Base testcase on empty tables of the test database (crm.settings_test)
+    with DB events (crm.events) registered
+    """
+
+    def setUp(self):
+        """
+        Setup
+        """
+        super().setUp()
+        import crm.events
+        from crm.apps.admin import counts
+        from crm.cache import _local_table_versions
+        from crm.db import db
+
+        self.db = db
+        # Session of a previous test may hold a transaction or objects of dropped tables
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        _local_table_versions.clear()
+        # Cached by versions of tables, which restart from scratch
+        counts._local.clear()
+        crm.app.cache.clear()
+
+    def tearDown(self):
+        """
+        Teardown
+        """
+        self.db.session.remove()
+        super().tearDown()
+
+    def add(self, *objs):
+        """
+        Commit new records (objs)
+
+        :return: first of objs
+        """
+        self.db.session.add_all(objs)
+        self.db.session.commit()
+        return objs[0]
+
+    @contextmanager
+    def count_queries(self):
+        """
+        Collect SQL statements executed within the block
+
+        :return: list of executed statements
+        """
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        listen(self.db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            remove(self.db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    def add_deal(self, **kwargs):
+        """
+        Commit a new deal with its required contact, currency & owner
+        """
+        from crm.apps.contact.models import Contact
+        from crm.apps.currency.models import Currency
+        from crm.apps.deal.models import Deal
+        from crm.apps.user.models import User
+
+        kwargs.setdefault('name', 'deal')
+        if 'contact' not in kwargs:
+            kwargs['contact'] = Contact(firstname='contact')
+        if 'currency' not in kwargs:
+            kwargs['currency'] = Currency.query.first() or Currency(name='USD')
+        if 'owner' not in kwargs:
+            kwargs['owner'] = User.query.filter_by(username='owner').first() or \
+                User(username='owner', firstname='deal', lastname='owner')
+        return self.add(Deal(**kwargs))
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,424 @@
+"""
+Tests for admin pages (crm.apps.admin)
+"""
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy.orm import subqueryload
+
+from crm import app
+from crm.apps.admin import views
+from crm.apps.admin.formatters import format_tasks, prefetch
+from crm.apps.admin.tasks import export_view
+from crm.apps.comment.models import Comment
+from crm.apps.contact.models import Contact
+from crm.apps.country.countries import CountriesEnum
+from crm.apps.country.models import Country
+from crm.apps.deal.models import DealState
+from crm.apps.email.models import Email
+from crm.apps.phone.models import Phone
+from crm.apps.task.models import Task
+from crm.apps.user.models import User
+from crm.settings import ADMIN_INLINE_WINDOW_SIZE
+from tests.base_tests import DBTestCase
+
+
+class PanelViewsTest(DBTestCase):
+    """
+    Test for views embedded in index & details pages
+    """
+
+    def test_registered_views_reused(self):
+        with app.test_request_context('/'):
+            view = views.get_panel_view(views.ContactModelView, Contact)
+        assert view in app.admin._views
+        assert views.get_panel_view(views.ContactModelView, Contact) is view
+
+    def test_pages_build_no_views(self):
+        """
+        Once built, rendering pages embedding panels constructs no view
+        """
+        contact_id = self.add(Contact(firstname='john', tasks=[Task(title='t1')])).id
+        urls = ['/', '/contact/details/?id=%s' % contact_id]
+        for url in urls:
+            assert self.app.get(url).status_code == 200
+
+        with mock.patch.object(views.EnhancedModelView, '__init__', side_effect=AssertionError('view built')):
+            for url in urls:
+                rv = self.app.get(url)
+                assert rv.status_code == 200
+        assert b'john' in rv.data
+
+
+class ListEagerLoadTest(DBTestCase):
+    """
+    Test for relationships of column_list loaded with list pages rows
+    """
+
+    def list_queries(self, url):
+        with self.count_queries() as statements:
+            rv = self.app.get(url)
+        assert rv.status_code == 200
+        return statements
+
+    def test_eager_load_paths(self):
+        with app.test_request_context('/'):
+            view = views.get_panel_view(views.DealModelView, views.DealModel)
+        assert view.get_eager_load_paths() == ['currency', 'contact', 'owner', 'referrer1']
+
+    def test_collections(self):
+        """
+        One query per collection whatever the number of rows
+        """
+        def add_contacts(count):
+            self.add(*[Contact(firstname='c%d' % i, emails=[Email(email='c%d@example.com' % i)],
+                               telephones=[Phone(telephone='+32%d' % i)]) for i in range(count)])
+
+        add_contacts(2)
+        statements = self.list_queries('/contact/')
+        assert any(s.startswith('SELECT emails.') for s in statements)
+        assert any(s.startswith('SELECT phones.') for s in statements)
+
+        add_contacts(4)
+        assert len(self.list_queries('/contact/')) == len(statements)
+
+    def test_ordered_pages(self):
+        """
+        Pages & collections loaded with them are ordered by primary key, after the chosen sort if any
+        """
+        self.add(Contact(firstname='john', emails=[Email(email='john@example.com')]))
+        for url, order in (('/contact/', 'ORDER BY contacts.id'), ('/contact/?sort=0', 'contacts.firstname, contacts.id')):
+            # Page query & the same query in subqueries loading emails & phones
+            paged = [s for s in self.list_queries(url) if 'LIMIT' in s]
+            assert len(paged) == 3
+            assert all(order in s for s in paged)
+
+    def test_joined(self):
+        """
+        Many to one relationships are joined to the list query
+        """
+        self.add_deal(name='d1')
+        assert len(self.list_queries('/deal/')) == 2
+        for i in range(4):
+            self.add_deal(name='d%d' % i)
+        assert len(self.list_queries('/deal/')) == 2
+
+
+class PrefetchTest(DBTestCase):
+    """
+    Test for formatters data loaded once per page
+    """
+
+    def render_tasks(self, view, models):
+        prefetch(view, models, ['tasks'])
+        with self.count_queries() as statements:
+            rendered = [format_tasks(view, None, m, 'tasks') for m in models]
+        assert statements == []
+        assert all('assigned to' in r and 'u2' in r for r in rendered)
+
+    def test_nested(self):
+        """
+        Tasks & their assignees are rendered from memory, loaded with the page or not
+        """
+        users = [User(username='u%d' % i) for i in range(3)]
+        self.add(*[Contact(firstname='c%d' % i, tasks=[Task(title='t%d' % j, assignee=u) for j, u in enumerate(users)])
+                   for i in range(3)])
+
+        with app.test_request_context('/'):
+            view = views.get_panel_view(views.ContactModelView, Contact)
+            self.render_tasks(view, Contact.query.all())
+
+            self.db.session.expire_all()
+            self.render_tasks(view, Contact.query.options(subqueryload(Contact.tasks)).all())
+
+    def test_authors(self):
+        """
+        Authors of a list page are loaded by one query whatever the number of rows
+        """
+        def add_contacts(start, stop):
+            pairs = [(self.add(Contact(firstname='c%d' % i)).id, self.add(User(username='a%d' % i)).id)
+                     for i in range(start, stop)]
+            with self.db.engine.begin() as connection:
+                for id, user_id in pairs:
+                    connection.execute(Contact.__table__.update().where(Contact.id == id)
+                                       .values(author_last_id=user_id))
+            # Bump versions of contacts, not bumped by the engine update
+            self.add(Contact(firstname='no author'))
+
+        add_contacts(0, 2)
+        with self.count_queries() as statements:
+            rv = self.app.get('/contact/')
+        assert b'a1' in rv.data
+
+        add_contacts(2, 6)
+        with self.count_queries() as more:
+            rv = self.app.get('/contact/')
+        assert b'a5' in rv.data
+        assert len(more) == len(statements)
+        assert len([s for s in more if s.startswith('SELECT users.')]) == 1
+
+
+class CountsTest(DBTestCase):
+    """
+    Test for row count strategies of list pages
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.add(*[Contact(firstname='c%d' % i) for i in range(3)])
+
+    def count_statements(self, url='/contact/'):
+        with self.count_queries() as statements:
+            rv = self.app.get(url)
+        assert rv.status_code == 200
+        return [s for s in statements if s.startswith('SELECT count(')]
+
+    def test_cached(self):
+        """
+        Counts are run again once one of their tables is written
+        """
+        assert len(self.count_statements()) == 1
+        assert self.count_statements() == []
+        # Filtered counts are cached separately
+        assert len(self.count_statements('/contact/?search=c1')) == 1
+
+        self.add(Contact(firstname='c3'))
+        assert len(self.count_statements()) == 1
+
+    def test_exact(self):
+        with mock.patch.object(views.ContactModelView, 'count_strategy', 'exact'):
+            for _ in range(2):
+                assert len(self.count_statements()) == 1
+
+    def test_estimate(self):
+        """
+        Other databases than PostgreSQL fall back to cached counts
+        """
+        with mock.patch.object(views.ContactModelView, 'count_strategy', 'estimate'):
+            assert len(self.count_statements()) == 1
+            assert self.count_statements() == []
+
+        with app.test_request_context('/'):
+            query = views.get_panel_view(views.TaskModelView, Task).get_count_query()
+            assert query.count_strategy == 'estimate'
+            assert query.scalar() == 0
+
+
+class ExportsTest(DBTestCase):
+    """
+    Test for csv & xlsx exports of list pages
+    """
+
+    def rows(self, data):
+        return list(csv.reader(io.StringIO(data.decode('utf-8'))))
+
+    def test_csv(self):
+        """
+        Raw values of records loaded by chunks in list page order
+        """
+        self.add_deal(name='d1', value=10, deal_state=DealState.CLOSED)
+        rv = self.app.get('/deal/export/csv/')
+        assert rv.status_code == 200
+        assert rv.mimetype == 'text/csv'
+        header, row = self.rows(rv.data)
+        row = dict(zip(header, row))
+        assert (row['Name'], row['Currency.Name'], row['Contact'], row['Deal State']) == ('d1', 'USD', 'contact', 'CLOSED')
+
+        self.add(*[Contact(firstname='x%d' % i) for i in range(5)])
+        with mock.patch('crm.apps.admin.exports.ADMIN_EXPORT_CHUNK_SIZE', 2):
+            with self.count_queries() as statements:
+                # Streamed while read
+                rows = self.rows(self.app.get('/contact/export/csv/?sort=0&desc=1&search=x').data)
+        assert [row[0] for row in rows] == ['Firstname', 'x4', 'x3', 'x2', 'x1', 'x0']
+        assert len([s for s in statements if s.startswith('SELECT contacts.created_at')]) == 3
+
+    def test_xlsx(self):
+        self.add(Contact(firstname='john'))
+        rv = self.app.get('/contact/export/xlsx/')
+        assert rv.status_code == 200
+        assert rv.headers['Content-Disposition'].endswith('.xlsx')
+        assert rv.data.startswith(b'PK')
+
+    def test_background(self):
+        """
+        Background exports are written in (ADMIN_EXPORT_DIR) named after their job
+        """
+        self.add(Contact(firstname='john'), Contact(firstname='jim'))
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir)
+        with mock.patch('crm.apps.admin.exports.ADMIN_EXPORT_DIR', export_dir), \
+                mock.patch('rq.get_current_job', return_value=mock.Mock(id='job1')):
+            filename = export_view('contact', 'csv', 'search=john')
+
+        assert filename.startswith('job1_Contact_')
+        with open(os.path.join(export_dir, filename), encoding='utf-8') as f:
+            assert [row[0] for row in csv.reader(f)] == ['Firstname', 'john']
+
+
+class DetailsPanelsTest(DBTestCase):
+    """
+    Test for collections of details pages loaded by pages
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.contact_id = self.add(Contact(firstname='john', tasks=[Task(title='t%d' % i) for i in range(5)])).id
+
+    def test_lazy_columns(self):
+        with app.test_request_context('/'):
+            view = views.get_panel_view(views.ContactModelView, Contact)
+        assert {'tasks', 'messages', 'deals', 'comments'} <= view.get_details_lazy_columns()
+        assert 'emails' not in view.get_details_lazy_columns()
+
+    def test_details(self):
+        """
+        Details page has a placeholder instead of the collection
+        """
+        with self.count_queries() as statements:
+            rv = self.app.get('/contact/details/?id=%s' % self.contact_id)
+        assert rv.status_code == 200
+        assert b'/contact/details/panel/?' in rv.data
+        assert b't1' not in rv.data
+        assert not any(s.startswith('SELECT tasks.') for s in statements)
+
+    def test_pages(self):
+        """
+        Items after the last rendered one, until there are no more
+        """
+        titles, url = [], '/contact/details/panel/?id=%s&name=tasks' % self.contact_id
+        with mock.patch.object(views.ContactModelView, 'details_panel_size', 2):
+            while url:
+                rv = self.app.get(url)
+                assert rv.status_code == 200
+                data = rv.data.decode('utf-8')
+                titles.append(sorted(re.findall(r'>(t\d)<', data)))
+                url = re.search(r'data-url="([^"]+)"', data)
+                url = url.group(1).replace('&amp;', '&') if url else None
+        assert [len(page) for page in titles] == [2, 2, 1]
+        assert sorted(sum(titles, [])) == ['t0', 't1', 't2', 't3', 't4']
+
+    def test_errors(self):
+        url = '/contact/details/panel/?id=%s&name=' % self.contact_id
+        assert self.app.get(url + 'messages').data == b''
+        # Not a lazy panel
+        assert self.app.get(url + 'emails').status_code == 404
+        assert self.app.get('/contact/details/panel/?id=nope&name=tasks').status_code == 404
+        # Last rendered item deleted since
+        rv = self.app.get(url + 'tasks&after=nope')
+        assert rv.status_code == 200
+        assert b't1' not in rv.data
+
+
+class InlineWindowsTest(DBTestCase):
+    """
+    Test for inline collections of edit pages rendered & submitted by windows
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.contact_id = self.add(Contact(
+            firstname='john', lastname='smith', tasks=[Task(title='t1')],
+            comments=[Comment(content='c%d' % i) for i in range(ADMIN_INLINE_WINDOW_SIZE + 2)]
+        )).id
+
+    def rows(self, data):
+        return re.findall(r'name="comments-(\d+)-id"', data.decode('utf-8'))
+
+    def test_window(self):
+        """
+        Newest (ADMIN_INLINE_WINDOW_SIZE) rows, then rows after the last one
+        """
+        with self.count_queries() as statements:
+            rv = self.app.get('/contact/edit/?id=%s' % self.contact_id)
+        assert rv.status_code == 200
+        assert len(self.rows(rv.data)) == ADMIN_INLINE_WINDOW_SIZE
+        select, = [s for s in statements if s.startswith('SELECT comments.')]
+        assert 'LIMIT' in select
+
+        url = re.search(r'data-url="([^"]*/edit/inline/[^"]*)"', rv.data.decode('utf-8')).group(1).replace('&amp;', '&')
+        rv = self.app.get(url)
+        assert rv.status_code == 200
+        assert self.rows(rv.data) == [str(ADMIN_INLINE_WINDOW_SIZE), str(ADMIN_INLINE_WINDOW_SIZE + 1)]
+        assert b'/edit/inline/' not in rv.data
+
+        assert self.app.get('/contact/edit/inline/?id=%s&name=firstname' % self.contact_id).status_code == 404
+
+    def test_submitted_rows(self):
+        """
+        Only submitted rows are loaded & applied, other children aren't touched
+        """
+        ids = {c.content: c.id for c in Comment.query}
+        with self.count_queries() as statements:
+            rv = self.app.post('/contact/edit/?id=%s' % self.contact_id, data={
+                'firstname': 'john', 'lastname': 'smith', 'gender': 'MALE',
+                'comments-0-id': ids['c3'], 'comments-0-content': 'edited',
+                'comments-1-id': ids['c5'], 'comments-1-content': 'c5', 'del-comments-1': 'y',
+                'comments-2-content': 'new',
+            })
+        assert rv.status_code == 302
+
+        contents = {c.content for c in Comment.query}
+        assert {'edited', 'new'} <= contents
+        assert not contents & {'c3', 'c5'}
+        assert len(contents) == ADMIN_INLINE_WINDOW_SIZE + 2
+        assert [t.title for t in Task.query] == ['t1']
+
+        select, = [s for s in statements if s.startswith('SELECT comments.')]
+        assert 'comments.id IN' in select
+        assert len([s for s in statements if s.startswith('UPDATE comments')]) == 1
+
+
+class AjaxLookupsTest(DBTestCase):
+    """
+    Test for AJAX select fields of relationships in admin forms
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.add(*[User(username='jo%d' % i) for i in range(3)], User(username='bob'))
+
+    def lookup(self, name, query):
+        rv = self.app.get('/contact/ajax/lookup/', query_string={'name': name, 'query': query})
+        assert rv.status_code == 200
+        return [label for _, label in json.loads(rv.data.decode('utf-8'))]
+
+    def test_lookup(self):
+        """
+        Options starting with typed text, inline forms fields too
+        """
+        assert self.lookup('owner', 'jo') == ['jo0', 'jo1', 'jo2']
+        assert self.lookup('task-assignee', 'B') == ['bob']
+        assert self.app.get('/contact/ajax/lookup/?name=nope&query=b').status_code == 404
+
+    def test_limit(self):
+        with mock.patch('crm.apps.admin.ajax.ADMIN_AJAX_LOOKUP_LIMIT', 2):
+            assert self.lookup('owner', '') == ['bob', 'jo0']
+
+    def test_enum(self):
+        """
+        Enum fields are matched by their values
+        """
+        self.add(*[Country(name=c) for c in (CountriesEnum.BE, CountriesEnum.BY, CountriesEnum.BR)])
+        assert sorted(self.lookup('countries', 'bel')) == ['Belarus', 'Belgium']
+
+    def test_edit_page(self):
+        """
+        Select fields don't render users as options
+        """
+        contact_id = self.add(Contact(firstname='john')).id
+        with self.count_queries() as statements:
+            rv = self.app.get('/contact/edit/?id=%s' % contact_id)
+        assert rv.status_code == 200
+        assert b'jo1' not in rv.data
+        assert not any(s.startswith('SELECT users.') for s in statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests for aggregate queries (crm.graphql.CRMAggregateField)
+"""
+import json
+import unittest
+
+from crm.apps.contact.models import Contact
+from crm.apps.deal.models import DealState, DealType
+from tests.base_tests import DBTestCase
+
+
+class AggregateTest(DBTestCase):
+    """
+    Test for {model}Aggregate queries
+    """
+
+    def setUp(self):
+        super().setUp()
+        for state, type, value in [
+            (DealState.NEW, DealType.HOSTER, 10),
+            (DealState.NEW, DealType.HOSTER, 20),
+            (DealState.CLOSED, DealType.HOSTER, 5),
+            (DealState.CLOSED, DealType.ITO, 100),
+        ]:
+            self.add_deal(deal_state=state, deal_type=type, value=value)
+
+    def query(self, query):
+        rv = self.app.post('/api', data=json.dumps({'query': '{ %s }' % query}), content_type='application/json')
+        return rv.status_code, json.loads(rv.data.decode('utf-8'))
+
+    def test_group_by(self):
+        """
+        One row per group with its count & aggregated values
+        """
+        status, data = self.query(
+            'dealsAggregate(groupBy: ["dealState"], sum: ["value"], max: ["value"]) { group count sum max }')
+        assert status == 200, data
+        rows = [
+            (json.loads(r['group']), r['count'], json.loads(r['sum']), json.loads(r['max']))
+            for r in data['dealsAggregate']
+        ]
+        assert sorted(rows, key=lambda r: r[0]['dealState']) == [
+            ({'dealState': 'CLOSED'}, 2, {'value': 105}, {'value': 100}),
+            ({'dealState': 'NEW'}, 2, {'value': 30}, {'value': 20}),
+        ]
+
+    def test_filters(self):
+        """
+        Aggregates apply the same filters as list queries
+        """
+        status, data = self.query('dealsAggregate(dealType: HOSTER, avg: ["value"]) { group count avg }')
+        assert status == 200, data
+        row, = data['dealsAggregate']
+        assert row['count'] == 3
+        assert json.loads(row['group']) == {}
+        assert json.loads(row['avg']) == {'value': 35 / 3.0}
+
+    def test_count(self):
+        """
+        Records are counted without group nor aggregate function
+        """
+        self.add(Contact(firstname='john'))
+        status, data = self.query('contactsAggregate { count }')
+        assert status == 200, data
+        assert data['contactsAggregate'] == [{'count': 5}]
+
+    def test_invalid_fields(self):
+        """
+        Unknown fields & functions on non numeric fields are rejected
+        """
+        status, data = self.query('dealsAggregate(sum: ["nope"]) { count }')
+        assert status == 400
+        assert 'Invalid field (nope) for Deal' in data['errors'][0]
+
+        status, data = self.query('dealsAggregate(sum: ["name"]) { count }')
+        assert status == 400
+        assert 'Can not apply (sum) on field (name)' in data['errors'][0]
+
+
+if __name__ == '__main__':
+    unittest.main()
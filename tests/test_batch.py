@@ -0,0 +1,54 @@
+"""
+Tests for batched operations on /api & /graphql
+"""
+import json
+import unittest
+from unittest import mock
+
+from tests.base_tests import DBTestCase
+
+CREATE = 'mutation { createContacts(records: [{firstname: "john", lastname: "smith"}]) { ok } }'
+LIST = '{ contacts { edges { node { firstname } } } }'
+
+
+class BatchTest(DBTestCase):
+    """
+    Test for arrays of operations
+    """
+
+    def post(self, url, operations):
+        rv = self.app.post(url, data=json.dumps(operations), content_type='application/json')
+        return rv.status_code, json.loads(rv.data.decode('utf-8'))
+
+    def test_api(self):
+        """
+        Operations are executed in order, each has its own result or errors
+        """
+        status, data = self.post('/api', [{'query': CREATE}, {'query': LIST}, {'query': '{ nope }'}])
+        assert status == 200, data
+        assert data[0] == {'data': {'createContacts': {'ok': True}}}
+        assert data[1] == {'data': {'contacts': {'edges': [{'node': {'firstname': 'john'}}]}}}
+        assert 'errors' in data[2] and 'data' not in data[2]
+
+    def test_graphql(self):
+        """
+        Same on /graphql with graphql results
+        """
+        status, data = self.post('/graphql', [{'query': CREATE}, {'query': LIST}])
+        assert status == 200, data
+        assert data[0]['data'] == {'createContacts': {'ok': True}}
+        assert data[1]['data'] == {'contacts': {'edges': [{'node': {'firstname': 'john'}}]}}
+
+    def test_max_size(self):
+        """
+        Batches over GRAPHQL_MAX_BATCH_SIZE are rejected
+        """
+        with mock.patch('crm.apps.api.views.GRAPHQL_MAX_BATCH_SIZE', 1):
+            for url in ('/api', '/graphql'):
+                status, data = self.post(url, [{'query': LIST}, {'query': LIST}])
+                assert status == 400
+                assert 'A batch can have 1 operations at most' in json.dumps(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
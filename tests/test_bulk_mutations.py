@@ -0,0 +1,136 @@
+"""
+Tests for bulk Create* & Update* mutations (crm.graphql)
+"""
+import json
+import unittest
+
+from crm import app
+from crm.apps.contact.models import Contact
+from crm.apps.task.models import Task
+from crm.apps.user.models import User
+from crm.graphql import create_records, update_records
+from tests.base_tests import DBTestCase
+
+
+class CreateRecordsTest(DBTestCase):
+    """
+    Test for create_records()
+    """
+
+    def test_references_resolved_once(self):
+        """
+        References of all records are loaded with one query per model
+        """
+        owner1 = self.add(User(username='u1')).id
+        owner2 = self.add(User(username='u2')).id
+        records = [
+            {'firstname': 'c%d' % i, 'lastname': 'x', 'owner': {'uid': uid}}
+            for i, uid in enumerate([owner1, owner2, owner1])
+        ]
+        with app.test_request_context('/'), self.count_queries() as statements:
+            ids = [obj.id for obj in create_records(Contact, records)]
+            self.db.session.commit()
+
+        assert len([s for s in statements if s.startswith('SELECT') and 'FROM users' in s]) == 1
+        owners = {c.id: (c.firstname, c.owner_id) for c in Contact.query}
+        assert sorted(owners.values()) == [('c0', owner1), ('c1', owner2), ('c2', owner1)]
+        assert sorted(ids) == sorted(owners)
+
+    def test_invalid_reference(self):
+        """
+        Nothing is created when a record references a missing record
+        """
+        rv = self.app.post('/api', data=json.dumps({
+            'query': 'mutation { createContacts(records: [{firstname: "a", lastname: "b"}, '
+                     '{firstname: "c", lastname: "d", owner: {uid: "nope"}}]) { ok ids } }'
+        }), content_type='application/json')
+        assert rv.status_code == 400
+        assert b'Invalid uid nope' in rv.data
+        assert Contact.query.count() == 0
+
+    def test_mutation(self):
+        """
+        Created records with their nested records
+        """
+        rv = self.app.post('/api', data=json.dumps({
+            'query': 'mutation { createContacts(records: [{firstname: "a", lastname: "b", '
+                     'tasks: [{title: "t1"}, {title: "t2"}]}]) { ok ids } }'
+        }), content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        result = json.loads(rv.data.decode('utf-8'))['createContacts']
+        assert result['ok']
+
+        contact = Contact.query.get(result['ids'][0])
+        assert contact.firstname == 'a'
+        assert sorted(t.title for t in contact.tasks) == ['t1', 't2']
+        assert all(t.id for t in contact.tasks)
+
+
+class UpdateRecordsTest(DBTestCase):
+    """
+    Test for update_records()
+    """
+
+    def update(self, model, records):
+        with app.test_request_context('/'), self.count_queries() as statements:
+            update_records(model, records)
+            self.db.session.commit()
+        return [s for s in statements if s.startswith('UPDATE')]
+
+    def test_targets_loaded_once(self):
+        """
+        All target records are loaded with one query
+        """
+        ids = [self.add(Contact(firstname='c%d' % i)).id for i in range(3)]
+        with app.test_request_context('/'), self.count_queries() as statements:
+            update_records(Contact, [{'uid': id, 'firstname': 'n%s' % id} for id in ids])
+        assert len([s for s in statements if s.startswith('SELECT') and 'FROM contacts' in s]) == 1
+
+    def test_unchanged_values_skipped(self):
+        """
+        Records whose provided values are the current ones aren't written
+        """
+        id = self.add(Contact(firstname='john', lastname='smith')).id
+        assert self.update(Contact, [{'uid': id, 'firstname': 'john'}]) == []
+
+        assert len(self.update(Contact, [{'uid': id, 'firstname': 'john', 'lastname': 'doe'}])) == 1
+        contact = Contact.query.get(id)
+        assert (contact.firstname, contact.lastname) == ('john', 'doe')
+
+    def test_grouped_updates(self):
+        """
+        Records getting the same values are updated by one statement, with updated_at & last author
+        """
+        ids = [self.add(Contact(firstname='c%d' % i)).id for i in range(4)]
+        records = [{'uid': id, 'lastname': 'same'} for id in ids[:3]] + [{'uid': ids[3], 'lastname': 'other'}]
+        statements = self.update(Contact, records)
+
+        assert len(statements) == 2 and all('IN' in s for s in statements)
+        assert {c.id: c.lastname for c in Contact.query} == dict([(id, 'same') for id in ids[:3]] + [(ids[3], 'other')])
+        assert all(c.updated_at is not None for c in Contact.query)
+
+    def test_objects_with_update_hooks(self):
+        """
+        Models with update hooks (i.e Task) are updated through their objects
+        """
+        ids = [self.add(Task(title='t%d' % i)).id for i in range(2)]
+        statements = self.update(Task, [{'uid': id, 'title': 'done'} for id in ids])
+        assert statements and not any('tasks.id IN' in s for s in statements)
+        assert [t.title for t in Task.query] == ['done', 'done']
+
+    def test_invalid_id(self):
+        """
+        Nothing is updated when a record is missing
+        """
+        id = self.add(Contact(firstname='john')).id
+        rv = self.app.post('/api', data=json.dumps({
+            'query': 'mutation { updateContacts(records: [{uid: "%s", firstname: "jim"}, '
+                     '{uid: "nope", firstname: "x"}]) { ok ids } }' % id
+        }), content_type='application/json')
+        assert rv.status_code == 400
+        assert b'Invalid id (nope)' in rv.data
+        assert Contact.query.get(id).firstname == 'john'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Tests for the change feed (crm.changes)
+"""
+import threading
+import unittest
+
+from crm import app
+from crm.changes import Subscription, _change_handlers, add_change_handler, listen_changes, publish_changes
+from crm.apps.contact.models import Contact
+from crm.apps.deal.models import Deal, DealState
+from crm.apps.email.models import Email
+from crm.apps.user.models import User
+from crm.graphql import update_records
+from tests.base_tests import DBTestCase
+
+
+class SubscriptionTest(unittest.TestCase):
+    """
+    Test for subscriptions parsing & filtering
+    """
+
+    def test_parse(self):
+        subscription = Subscription.parse('deals:deal_state=CLOSED,owner_id=u1')
+        assert subscription.model == 'deals'
+        assert subscription.filters == {'deal_state': 'CLOSED', 'owner_id': 'u1'}
+        assert Subscription.parse('messages').filters == {}
+        for value in (':a=b', 'deals:deal_state', 'deals:=CLOSED'):
+            with self.assertRaises(ValueError):
+                Subscription.parse(value)
+
+    def test_matches(self):
+        """
+        Events match on their values or on values before an update
+        """
+        subscription = Subscription.parse('deals:deal_state=CLOSED,owner_id=u1')
+        event = {'model': 'deals', 'values': {'deal_state': 'CLOSED', 'owner_id': 'u1'}}
+        assert subscription.matches(event)
+        assert not subscription.matches(dict(event, model='contacts'))
+        assert not subscription.matches(dict(event, values={'deal_state': 'NEW', 'owner_id': 'u1'}))
+
+        # Reassigned from u1 to u2
+        moved = {'model': 'deals', 'values': {'deal_state': 'CLOSED', 'owner_id': 'u2'}, 'previous': {'owner_id': 'u1'}}
+        assert subscription.matches(moved)
+
+
+class ChangesTest(DBTestCase):
+    """
+    Test for change events published on commit
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.events = []
+        add_change_handler(self.events.extend)
+        self.addCleanup(_change_handlers.remove, self.events.extend)
+
+    def test_flushed_changes(self):
+        """
+        One event per committed record with its filterable values and previous ones
+        """
+        contact_id = self.add(Contact(firstname='john')).id
+        assert [(e['model'], e['id'], e['op']) for e in self.events] == [('contacts', contact_id, 'created')]
+
+        other_id = self.add(Contact(firstname='jim')).id
+        email_id = self.add(Email(email='john@example.com', contact_id=contact_id)).id
+        del self.events[:]
+        email = Email.query.get(email_id)
+        email.contact_id = other_id
+        self.db.session.commit()
+
+        event, = [e for e in self.events if e['model'] == 'emails']
+        assert event['op'] == 'updated'
+        assert event['values']['contact_id'] == other_id
+        assert event['previous'] == {'contact_id': contact_id}
+
+    def test_grouped_updates(self):
+        """
+        Records updated by grouped UPDATE statements have their events too
+        """
+        ids = [self.add_deal(deal_state=DealState.NEW).id for _ in range(2)]
+        del self.events[:]
+        with app.test_request_context('/'):
+            update_records(Deal, [{'uid': id, 'deal_state': DealState.CLOSED} for id in ids])
+            self.db.session.commit()
+
+        events = sorted((e for e in self.events if e['model'] == 'deals'), key=lambda e: e['id'])
+        assert [(e['id'], e['op']) for e in events] == [(id, 'updated') for id in sorted(ids)]
+        assert all(e['values']['deal_state'] == 'CLOSED' for e in events)
+        assert all(e['previous'] == {'deal_state': 'NEW'} for e in events)
+        assert all(e['updated_at'] is not None for e in events)
+
+    def test_rollback(self):
+        """
+        Nothing is published for rolled back changes
+        """
+        self.db.session.add(User(username='u1'))
+        self.db.session.flush()
+        self.db.session.rollback()
+        self.add(Contact(firstname='john'))
+        assert [e['model'] for e in self.events] == ['contacts']
+
+    def test_failing_handler(self):
+        """
+        Handlers errors don't affect other handlers
+        """
+        def fail(events):
+            raise ValueError('failed')
+
+        _change_handlers.insert(0, fail)
+        self.addCleanup(_change_handlers.remove, fail)
+        self.add(Contact(firstname='john'))
+        assert [e['model'] for e in self.events] == ['contacts']
+
+    def test_listen(self):
+        """
+        Subscribers get matching events without their values
+        """
+        events = [
+            {'model': 'deals', 'id': 'd1', 'op': 'updated', 'values': {'deal_state': 'NEW'}},
+            {'model': 'deals', 'id': 'd2', 'op': 'updated', 'values': {'deal_state': 'CLOSED'}},
+        ]
+        # Published once the listener is registered
+        timer = threading.Timer(0.2, publish_changes, [events])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        changes = listen_changes([Subscription.parse('deals:deal_state=CLOSED')], max_age=5)
+        assert next(changes) == {'model': 'deals', 'id': 'd2', 'op': 'updated'}
+        changes.close()
+
+    def test_endpoint_errors(self):
+        """
+        Missing & invalid subscriptions are rejected
+        """
+        assert self.app.get('/api/changes').status_code == 400
+        rv = self.app.get('/api/changes?subscribe=deals:deal_state')
+        assert rv.status_code == 400
+        assert b'Invalid filter (deal_state)' in rv.data
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+Tests for conditional GET requests (crm.conditional)
+"""
+import json
+import unittest
+from unittest import mock
+
+from werkzeug.http import http_date
+
+from crm.apps.admin.views import ContactModelView
+from crm.apps.contact.models import Contact
+from tests.base_tests import DBTestCase
+
+LIST = '{ contacts { edges { node { firstname } } } }'
+
+
+class ConditionalTest(DBTestCase):
+    """
+    Test for ETag & Last-Modified validators of /api, /graphql & admin details pages
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.contact_id = self.add(Contact(firstname='john')).id
+        self.record = '{ contact(uid: "%s") { firstname } }' % self.contact_id
+
+    def rename(self, firstname):
+        Contact.query.get(self.contact_id).firstname = firstname
+        self.db.session.commit()
+
+    def test_record(self):
+        """
+        Queries of one record are validated by its updated_at
+        """
+        rv = self.app.get('/api', query_string={'query': self.record})
+        assert rv.status_code == 200, rv.data
+        etag, last_modified = rv.headers['ETag'], rv.headers['Last-Modified']
+
+        rv = self.app.get('/api', query_string={'query': self.record}, headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+        rv = self.app.get('/api', query_string={'query': self.record}, headers={'If-Modified-Since': last_modified})
+        assert rv.status_code == 304
+
+        self.rename('jim')
+        rv = self.app.get('/api', query_string={'query': self.record}, headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        assert rv.headers['ETag'] != etag
+        assert json.loads(rv.data.decode('utf-8')) == {'contact': {'firstname': 'jim'}}
+
+    def test_list(self):
+        """
+        Other queries are validated by versions of their tables
+        """
+        rv = self.app.get('/api', query_string={'query': LIST})
+        etag = rv.headers['ETag']
+        assert 'Last-Modified' not in rv.headers
+        assert self.app.get('/api', query_string={'query': LIST}, headers={'If-None-Match': etag}).status_code == 304
+
+        self.add(Contact(firstname='jim'))
+        rv = self.app.get('/api', query_string={'query': LIST}, headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        assert len(json.loads(rv.data.decode('utf-8'))['contacts']['edges']) == 2
+
+    def test_graphql(self):
+        """
+        GET queries on /graphql too
+        """
+        rv = self.app.get('/graphql', query_string={'query': self.record}, headers={'Accept': 'application/json'})
+        assert rv.status_code == 200, rv.data
+        rv = self.app.get('/graphql', query_string={'query': self.record},
+                          headers={'Accept': 'application/json', 'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 304
+
+    def test_unconditional(self):
+        """
+        POST requests have no validators, mutations can't be sent with GET
+        """
+        rv = self.app.post('/api', data=json.dumps({'query': self.record}), content_type='application/json',
+                           headers={'If-Modified-Since': http_date()})
+        assert rv.status_code == 200
+        assert 'ETag' not in rv.headers
+
+        rv = self.app.get('/api', query_string={
+            'query': 'mutation { deleteContacts(uids: ["%s"]) { ok } }' % self.contact_id
+        })
+        assert rv.status_code == 405
+        assert Contact.query.count() == 1
+
+    def test_admin_details(self):
+        """
+        Admin details pages are validated by the record & versions of related tables
+        """
+        url = '/contact/details/?id=%s' % self.contact_id
+        rv = self.app.get(url)
+        assert rv.status_code == 200
+        etag = rv.headers['ETag']
+        assert self.app.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+        self.rename('jim')
+        assert self.app.get(url, headers={'If-None-Match': etag}).status_code == 200
+
+    def test_admin_details_checks(self):
+        """
+        Permissions are checked & pending flashed messages rendered before answering (304)
+        """
+        url = '/contact/details/?id=%s' % self.contact_id
+        etag = self.app.get(url).headers['ETag']
+
+        with mock.patch.object(ContactModelView, 'can_view_details', False):
+            assert self.app.get(url, headers={'If-None-Match': etag}).status_code == 302
+
+        with self.app.session_transaction() as session:
+            session['_flashes'] = [('message', 'Record was successfully saved.')]
+        rv = self.app.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        assert b'Record was successfully saved.' in rv.data
+        # Not cached by the browser with the message
+        assert 'ETag' not in rv.headers
+        assert self.app.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+
+if __name__ == '__main__':
+    unittest.main()
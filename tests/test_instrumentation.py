@@ -0,0 +1,52 @@
+"""
+Tests for graphql field instrumentation (crm.apps.api.instrumentation)
+"""
+import json
+import unittest
+
+from crm.apps.api.instrumentation import DEBUG_HEADER
+from crm.apps.contact.models import Contact
+from crm.apps.task.models import Task
+from tests.base_tests import DBTestCase
+
+
+class InstrumentationTest(DBTestCase):
+    """
+    Test for per path summaries returned with (DEBUG_HEADER)
+    """
+
+    def test_summary(self):
+        """
+        Paths of nested fields, lazy loads are counted on the field triggering them
+        """
+        self.add(
+            Contact(firstname='a', tasks=[Task(title='t1'), Task(title='t2')]),
+            Contact(firstname='b', tasks=[Task(title='t3')]),
+        )
+        rv = self.app.post('/api', data=json.dumps({
+            'query': '{ contacts { edges { node { firstname tasks { edges { node { title } } } } } } }'
+        }), content_type='application/json', headers={DEBUG_HEADER: '1'})
+        assert rv.status_code == 200, rv.data
+        data = json.loads(rv.data.decode('utf-8'))
+        assert len(data['contacts']['edges']) == 2
+
+        fields = {f['path']: f for f in data['extensions']['instrumentation']['fields']}
+        tasks = fields['contacts.edges.node.tasks']
+        assert tasks['field'] == 'Contact.tasks'
+        assert tasks['calls'] == 2
+        assert tasks['sql'] >= 2
+        assert fields['contacts.edges.node.tasks.edges.node.title']['calls'] == 3
+        assert fields['contacts']['sql'] >= 1
+
+    def test_not_instrumented(self):
+        """
+        Responses have no extensions without (DEBUG_HEADER)
+        """
+        rv = self.app.post('/api', data=json.dumps({'query': '{ contacts { edges { node { firstname } } } }'}),
+                           content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        assert 'extensions' not in json.loads(rv.data.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Tests for graphql query limits (crm.apps.api.limits)
+"""
+import json
+import unittest
+
+from graphql.language.parser import parse
+from sqlalchemy.exc import OperationalError
+
+from crm import app, crm
+from crm.apps.api.limits import QueryLimitError, check_query, estimate, statement_timeout
+from crm.apps.contact.models import Contact
+from tests.base_tests import DBTestCase
+
+NESTED = 'query($n: Int) { contacts(first: 10) { edges { node { deals(first: $n) { edges { node { name } } } } } } }'
+
+# Rows generated one by one, long enough to be interrupted
+SLOW_QUERY = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :count) SELECT count(*) FROM n'
+
+
+class EstimateTest(unittest.TestCase):
+    """
+    Test for static cost & depth estimation
+    """
+
+    def test_paginated(self):
+        """
+        Nested connections multiply costs by their (first), edges & node aren't levels
+        """
+        assert estimate(crm.graphql_schema, parse(NESTED), {'n': 5}) == (10 * (1 + 5), 2)
+
+    def test_unpaginated(self):
+        """
+        Connections without (first) count for the default list size
+        """
+        document = parse('{ contacts { edges { node { firstname } } } }')
+        assert estimate(crm.graphql_schema, document, default_list_size=100) == (100, 1)
+
+    def test_rejected(self):
+        """
+        Queries over budget are rejected
+        """
+        document = parse(NESTED)
+        with self.assertRaises(QueryLimitError):
+            check_query(crm.graphql_schema, document, {'n': 5}, max_cost=59)
+        with self.assertRaises(QueryLimitError):
+            check_query(crm.graphql_schema, document, {'n': 5}, max_depth=1)
+        assert check_query(crm.graphql_schema, document, {'n': 5}, max_cost=60, max_depth=2) == (60, 2)
+
+
+class LimitsTest(DBTestCase):
+    """
+    Test for limits applied by /api
+    """
+
+    def query(self, query, variables=None):
+        rv = self.app.post('/api', data=json.dumps({'query': query, 'variables': variables}),
+                           content_type='application/json')
+        return rv.status_code, json.loads(rv.data.decode('utf-8'))
+
+    def test_expensive_query(self):
+        """
+        Queries over GRAPHQL_MAX_COST are rejected before execution
+        """
+        status, data = self.query(NESTED, {'n': 100000})
+        assert status == 400
+        assert 'exceeds the maximum allowed cost' in data['errors'][0]
+
+    def test_unpaginated(self):
+        """
+        Unpaginated connections return all rows, they're costed GRAPHQL_DEFAULT_LIST_SIZE items each
+        """
+        self.add(*[Contact(firstname='c%d' % i) for i in range(5)])
+        status, data = self.query('{ contacts { edges { node { deals { edges { node { name } } } } } } }')
+        assert status == 200, data
+        assert len(data['contacts']['edges']) == 5
+
+        status, data = self.query(
+            '{ contacts { edges { node { deals { edges { node { tasks { edges { node { title } } } } } } } } } }')
+        assert status == 400
+        assert 'exceeds the maximum allowed cost' in data['errors'][0]
+
+    def test_statement_timeout(self):
+        """
+        Statements are interrupted after the timeout, commits within the block are allowed
+        """
+        with app.test_request_context('/'):
+            with self.assertRaises(OperationalError):
+                with statement_timeout(50):
+                    self.db.session.execute(SLOW_QUERY, {'count': 10 ** 9}).scalar()
+            self.db.session.rollback()
+
+            with statement_timeout(1000):
+                self.add(Contact(firstname='john'))
+                assert self.db.session.execute(SLOW_QUERY, {'count': 10}).scalar() == 10
+
+
+if __name__ == '__main__':
+    unittest.main()
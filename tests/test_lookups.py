@@ -0,0 +1,75 @@
+"""
+Tests for REST lookups (crm.apps.api.lookups)
+"""
+import json
+import unittest
+
+from crm.apps.api import views
+from crm.apps.contact.models import Contact, Gender
+from crm.apps.deal.models import Deal, DealState
+from crm.apps.email.models import Email
+from tests.base_tests import DBTestCase
+
+
+class LookupTest(DBTestCase):
+    """
+    Test for /api/lookup/{model}/{field}/{value}
+    """
+
+    def get(self, url):
+        rv = self.app.get(url)
+        return rv.status_code, json.loads(rv.data.decode('utf-8')) if rv.data else None
+
+    def test_via_related_table(self):
+        """
+        Contact looked up by one of its emails, enums as names & dates as ISO strings
+        """
+        id = self.add(Contact(firstname='john', gender=Gender.MALE, emails=[Email(email='john@example.com')])).id
+        status, data = self.get('/api/lookup/contact/email/john@example.com')
+        assert status == 200, data
+        assert data['uid'] == id
+        assert data['firstname'] == 'john'
+        assert data['gender'] == 'MALE'
+        assert isinstance(data['updatedAt'], str)
+
+    def test_column(self):
+        """
+        Deal looked up by its referral code
+        """
+        id = self.add_deal(name='big deal', value=10, deal_state=DealState.CLOSED, referral_code='r1').id
+        status, data = self.get('/api/lookup/deal/referral_code/r1')
+        assert status == 200, data
+        assert (data['uid'], data['name'], data['value'], data['dealState']) == (id, 'big deal', 10, 'CLOSED')
+
+    def test_not_found(self):
+        """
+        Missing records & unknown lookups
+        """
+        assert self.get('/api/lookup/contact/email/nope@example.com') == (404, None)
+        status, data = self.get('/api/lookup/contact/nope/x')
+        assert status == 404
+        assert data['errors'] == ['Unknown lookup (contact/nope)']
+
+    def test_cached(self):
+        """
+        Cached lookups are invalidated by changes of their tables
+        """
+        views.response_cache.enabled = True
+        views.response_cache._local.clear()
+        self.addCleanup(setattr, views.response_cache, 'enabled', False)
+
+        id = self.add_deal(name='big deal', referral_code='r1').id
+        assert self.get('/api/lookup/deal/referral_code/r1')[1]['name'] == 'big deal'
+
+        # Committed outside the session, table versions aren't bumped
+        with self.db.engine.begin() as connection:
+            connection.execute(Deal.__table__.update().values(name='stale'))
+        assert self.get('/api/lookup/deal/referral_code/r1')[1]['name'] == 'big deal'
+
+        Deal.query.filter_by(id=id).update({'name': 'bigger deal'})
+        self.db.session.commit()
+        assert self.get('/api/lookup/deal/referral_code/r1')[1]['name'] == 'bigger deal'
+
+
+if __name__ == '__main__':
+    unittest.main()
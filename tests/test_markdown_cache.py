@@ -0,0 +1,45 @@
+"""
+Tests for rendered markdown cache (crm.markdown_cache)
+"""
+import unittest
+from unittest import mock
+
+from crm import markdown_cache
+from crm.settings import MARKDOWN_CACHE_MIN_LENGTH
+
+LONG = '# Title\n\n' + 'some *long* text ' * (MARKDOWN_CACHE_MIN_LENGTH // 10)
+
+
+class MarkdownCacheTest(unittest.TestCase):
+    """
+    Test for markdown rendered once per source
+    """
+
+    def setUp(self):
+        markdown_cache._local.clear()
+        patcher = mock.patch('crm.markdown_cache.markdown', wraps=markdown_cache.markdown)
+        self.markdown = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        html = markdown_cache.render_markdown(LONG)
+        assert '<h1>Title</h1>' in html
+        assert markdown_cache.render_markdown(LONG) == html
+        assert self.markdown.call_count == 1
+
+        # Edited source is a new key
+        assert '<h1>Edited</h1>' in markdown_cache.render_markdown(LONG.replace('Title', 'Edited'))
+        assert self.markdown.call_count == 2
+
+    def test_short(self):
+        """
+        Short sources are rendered each time
+        """
+        for _ in range(2):
+            assert '<em>short</em>' in markdown_cache.render_markdown('*short*')
+        assert self.markdown.call_count == 2
+        assert markdown_cache.render_markdown('') == ''
+
+
+if __name__ == '__main__':
+    unittest.main()
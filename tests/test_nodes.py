@@ -0,0 +1,68 @@
+"""
+Tests for nodes(uids:) query (crm.apps.api.graphql.queries)
+"""
+import json
+import unittest
+
+from graphene import relay
+
+from crm.apps.contact.models import Contact
+from tests.base_tests import DBTestCase
+
+NODES = 'query($uids: [String]!, $type: String) { nodes(uids: $uids, type: $type) { ' \
+        '... on Contact { firstname } ... on Deal { name } } }'
+
+
+class NodesTest(DBTestCase):
+    """
+    Test for records of many types fetched at once
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.contact_id = self.add(Contact(firstname='john')).id
+        self.deal_id = self.add_deal(name='big deal').id
+
+    def nodes(self, uids, type=None):
+        with self.count_queries() as statements:
+            rv = self.app.post('/api', data=json.dumps({'query': NODES, 'variables': {'uids': uids, 'type': type}}),
+                               content_type='application/json')
+        return rv.status_code, json.loads(rv.data.decode('utf-8')), statements
+
+    def test_global_ids(self):
+        """
+        Records in uids order, missing ones are null, one query per type
+        """
+        status, data, statements = self.nodes([
+            relay.Node.to_global_id('Deal', self.deal_id),
+            relay.Node.to_global_id('Contact', 'nope'),
+            relay.Node.to_global_id('Contact', self.contact_id),
+        ])
+        assert status == 200, data
+        assert data['nodes'] == [{'name': 'big deal'}, None, {'firstname': 'john'}]
+        assert len([s for s in statements if s.startswith('SELECT')]) == 2
+
+    def test_raw_ids(self):
+        """
+        Raw uids are looked up in (type) or in all types
+        """
+        status, data, statements = self.nodes([self.contact_id], 'Contact')
+        assert status == 200, data
+        assert data['nodes'] == [{'firstname': 'john'}]
+        assert len([s for s in statements if s.startswith('SELECT')]) == 1
+
+        status, data, _ = self.nodes([self.deal_id, self.contact_id])
+        assert status == 200, data
+        assert data['nodes'] == [{'name': 'big deal'}, {'firstname': 'john'}]
+
+    def test_invalid_type(self):
+        """
+        Unknown (type) is rejected
+        """
+        status, data, _ = self.nodes([self.contact_id], 'Nope')
+        assert status == 400
+        assert 'Invalid type (Nope)' in data['errors'][0]
+
+
+if __name__ == '__main__':
+    unittest.main()
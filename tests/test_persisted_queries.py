@@ -0,0 +1,109 @@
+"""
+Tests for persisted queries of /api (crm.apps.api.persisted_queries)
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from crm import crm
+from crm.apps.api import views
+from crm.apps.api.persisted_queries import PersistedQueryStore
+from crm.apps.contact.models import Contact
+from tests.base_tests import DBTestCase
+
+QUERY = '{ contacts { edges { node { firstname } } } }'
+
+
+class PersistedQueriesTest(DBTestCase):
+    """
+    Test for queries registered & executed by their id
+    """
+
+    def setUp(self):
+        super().setUp()
+        views.persisted_queries._registered.clear()
+        views.persisted_queries._documents.clear()
+        self.add(Contact(firstname='john'))
+
+    def post(self, data):
+        rv = self.app.post('/api', data=json.dumps(data), content_type='application/json')
+        return rv.status_code, json.loads(rv.data.decode('utf-8'))
+
+    def test_register(self):
+        """
+        Query sent with its id is registered, then executed by its id only
+        """
+        query_id = PersistedQueryStore.query_id(QUERY)
+        status, data = self.post({'query': QUERY, 'id': query_id})
+        assert status == 200, data
+        assert views.persisted_queries.get(query_id) == QUERY
+
+        status, data = self.post({'id': query_id})
+        assert status == 200, data
+        assert data == {'contacts': {'edges': [{'node': {'firstname': 'john'}}]}}
+
+        # Apollo format
+        status, data = self.post({'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': query_id}}})
+        assert status == 200, data
+
+    def test_hash_mismatch(self):
+        status, data = self.post({'query': QUERY, 'id': 'nope'})
+        assert status == 400
+        assert data['errors'] == ['provided sha does not match query']
+        assert views.persisted_queries.get(PersistedQueryStore.query_id(QUERY)) is None
+
+    def test_unknown_id(self):
+        status, data = self.post({'id': PersistedQueryStore.query_id(QUERY)})
+        assert status == 400
+        assert data['errors'] == ['PersistedQueryNotFound']
+
+    def test_invalid_query(self):
+        """
+        Invalid queries aren't registered
+        """
+        for query in ('{ contacts { nope } }', '{ contacts {'):
+            query_id = PersistedQueryStore.query_id(query)
+            status, data = self.post({'query': query, 'id': query_id})
+            assert status == 400
+            assert views.persisted_queries.get(query_id) is None
+
+    def test_registration_disabled(self):
+        """
+        Query sent with its id is executed without being registered
+        """
+        query_id = PersistedQueryStore.query_id(QUERY)
+        with mock.patch('crm.apps.api.views.PERSISTED_QUERIES_REGISTRATION', False):
+            status, data = self.post({'query': QUERY, 'id': query_id})
+            assert status == 200, data
+            assert views.persisted_queries.get(query_id) is None
+            assert self.post({'query': QUERY, 'id': 'nope'})[0] == 400
+
+
+class PersistedQueryStoreTest(unittest.TestCase):
+    """
+    Test for registered queries kept in memory
+    """
+
+    def test_bounded(self):
+        """
+        Least recently used registered queries are evicted, queries of the directory are kept
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'contacts.graphql'), 'w') as f:
+            f.write(QUERY)
+
+        store = PersistedQueryStore(directory, queries_cache_size=2)
+        queries = ['{ deals { edges { node { name } } } }', '{ countries { edges { node { name } } } }',
+                   '{ contacts { edges { node { lastname } } } }']
+        ids = [store.register(crm.graphql_schema, query) for query in queries]
+        assert store.get(ids[0]) is None
+        assert [store.get(id) for id in ids[1:]] == queries[1:]
+        assert store.get(PersistedQueryStore.query_id(QUERY)) == QUERY
+
+
+if __name__ == '__main__':
+    unittest.main()
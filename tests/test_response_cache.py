@@ -0,0 +1,101 @@
+"""
+Tests for graphql response cache (crm.apps.api.response_cache)
+"""
+import json
+import time
+import unittest
+from unittest import mock
+
+from graphql.language.parser import parse
+
+from crm import crm
+from crm.apps.api import views
+from crm.apps.api.response_cache import document_tables
+from crm.apps.contact.models import Contact
+from crm.apps.deal.models import Deal, DealState
+from tests.base_tests import DBTestCase
+
+CLOSED_DEALS_CONTACTS = '{ contacts(deals: [{dealState: CLOSED}]) { edges { node { firstname } } } }'
+
+
+class ResponseCacheTest(DBTestCase):
+    """
+    Test for response cache invalidation by table versions
+    """
+
+    def setUp(self):
+        super().setUp()
+        views.response_cache.enabled = True
+        views.response_cache._local.clear()
+
+    def tearDown(self):
+        views.response_cache.enabled = False
+        super().tearDown()
+
+    def query(self, query):
+        rv = self.app.post('/api', data=json.dumps({'query': query}), content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        return json.loads(rv.data.decode('utf-8'))
+
+    def firstnames(self, query):
+        return sorted(e['node']['firstname'] for e in self.query(query)['contacts']['edges'])
+
+    def test_document_tables(self):
+        """
+        Tables of selected types and of filter arguments
+        """
+        schema = crm.graphql_schema
+        assert document_tables(schema, parse('{ contacts { edges { node { firstname } } } }')) == {'contacts'}
+        assert 'deals' in document_tables(schema, parse(CLOSED_DEALS_CONTACTS))
+        assert 'deals' in document_tables(schema, parse(
+            'query($d: [DealArguments]) { contacts(deals: $d) { edges { node { firstname } } } }'))
+
+    def test_invalidated_on_commit(self):
+        """
+        Cached result is served until a written table is committed
+        """
+        contact_id = self.add(Contact(firstname='john')).id
+        query = '{ contacts { edges { node { firstname } } } }'
+        assert self.firstnames(query) == ['john']
+
+        # Committed outside the session, table versions aren't bumped
+        with self.db.engine.begin() as connection:
+            connection.execute(Contact.__table__.update().values(firstname='jim'))
+        assert self.firstnames(query) == ['john']
+
+        contact = Contact.query.get(contact_id)
+        contact.lastname = 'smith'
+        self.db.session.commit()
+        assert self.firstnames(query) == ['jim']
+
+    def test_invalidated_by_filter_tables(self):
+        """
+        Results filtered on relations are invalidated by changes of these relations
+        """
+        deal_id = self.add_deal(contact=Contact(firstname='john'), deal_state=DealState.NEW).id
+        assert self.firstnames(CLOSED_DEALS_CONTACTS) == []
+
+        deal = Deal.query.get(deal_id)
+        deal.deal_state = DealState.CLOSED
+        self.db.session.commit()
+        assert self.firstnames(CLOSED_DEALS_CONTACTS) == ['john']
+
+    def test_local_entries_expire(self):
+        """
+        In-process entries aren't served after (timeout) like Redis entries
+        """
+        self.add(Contact(firstname='john'))
+        query = '{ contacts { edges { node { firstname } } } }'
+        assert self.firstnames(query) == ['john']
+
+        with self.db.engine.begin() as connection:
+            connection.execute(Contact.__table__.update().values(firstname='jim'))
+        assert self.firstnames(query) == ['john']
+
+        expired = time.time() + views.response_cache.timeout
+        with mock.patch('crm.apps.api.response_cache.time.time', return_value=expired):
+            assert self.firstnames(query) == ['jim']
+
+
+if __name__ == '__main__':
+    unittest.main()
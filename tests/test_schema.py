@@ -0,0 +1,61 @@
+"""
+Tests for graphql schema built on first use (crm.CRM.graphql_schema)
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+from crm import crm
+
+
+class LazySchemaTest(unittest.TestCase):
+    """
+    Test for schema & its introspection built once per process
+    """
+
+    def test_not_built_at_import(self):
+        """
+        Importing the app entry point (app.py) doesn't build the schema
+        """
+        env = dict(os.environ, ENV='test', GRAPHQL_SCHEMA_PREBUILD='')
+        code = 'import app, crm; assert crm.crm._graphql_schema is None; assert crm.crm._graphql_introspection is None'
+        subprocess.check_call([sys.executable, '-c', code], env=env, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+    def test_built_once(self):
+        """
+        Concurrent first accesses build the schema once
+        """
+        schema = mock.Mock()
+
+        def init_schema():
+            # Other threads wait for the lock meanwhile
+            time.sleep(0.05)
+            return schema
+
+        with mock.patch.object(crm, '_graphql_schema', None), \
+                mock.patch.object(crm, 'init_graphql_schema', side_effect=init_schema) as init:
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(crm.graphql_schema)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert results == [schema] * 8
+            assert init.call_count == 1
+
+    def test_cached_introspection(self):
+        schema = mock.Mock()
+        schema.introspect.return_value = {'__schema': {}}
+        with mock.patch.object(crm, '_graphql_schema', schema), \
+                mock.patch.object(crm, '_graphql_introspection', None):
+            assert crm.graphql_introspection == {'__schema': {}}
+            assert crm.graphql_introspection is crm.graphql_introspection
+            assert schema.introspect.call_count == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
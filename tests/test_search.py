@@ -0,0 +1,108 @@
+"""
+Tests for full text search index (crm.apps.search) on SQLite FTS5
+"""
+import json
+import unittest
+
+from crm.apps.contact.models import Contact
+from crm.apps.deal.models import Deal
+from crm.apps.email.models import Email
+from crm.apps.search import index
+from crm.apps.search.index import create_index, index_all, search
+from tests.base_tests import DBTestCase
+
+
+class SearchTest(DBTestCase):
+    """
+    Test for documents indexed on commit & searches
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(self.drop_index)
+        self.john_id = self.add(Contact(firstname='John', lastname='Smith', emails=[Email(email='john@example.com')])).id
+        self.jim_id = self.add(Contact(firstname='Jim', lastname='Smithers')).id
+        create_index()
+        index_all(self.db.session)
+
+    def drop_index(self):
+        index._available = False
+        with self.db.engine.begin() as connection:
+            connection.execute('DROP TABLE IF EXISTS %s' % index.SEARCH_TABLE)
+
+    def found(self, term, models=None):
+        return [id for _, id in search(term, models)]
+
+    def test_index_all(self):
+        """
+        Every word of the term is matched as a prefix
+        """
+        assert self.found('joh smi') == [self.john_id]
+        assert sorted(self.found('smith')) == sorted([self.john_id, self.jim_id])
+        assert self.found('john@example') == [self.john_id]
+        assert self.found('nobody') == []
+        assert self.found('***') == []
+
+    def test_unavailable(self):
+        self.drop_index()
+        assert search('john') is None
+
+    def test_changes(self):
+        """
+        Documents are updated by commits
+        """
+        contact = Contact.query.get(self.jim_id)
+        contact.firstname = 'James'
+        self.db.session.commit()
+        assert self.found('jim') == []
+        assert self.found('james') == [self.jim_id]
+
+        self.db.session.delete(Contact.query.get(self.jim_id))
+        self.db.session.commit()
+        assert self.found('james') == []
+
+    def test_related(self):
+        """
+        Documents of roots are updated by changes of their relations
+        """
+        deal_id = self.add_deal(name='big deal', contact=Contact.query.get(self.john_id)).id
+        assert self.found('john', [Deal]) == [deal_id]
+
+        Contact.query.get(self.john_id).firstname = 'Johnny'
+        self.db.session.commit()
+        assert self.found('johnny', [Deal]) == [deal_id]
+        assert self.found('big johnny') == [deal_id]
+
+    def test_moved_child(self):
+        """
+        Children moved to another root update documents of both roots
+        """
+        Email.query.filter_by(email='john@example.com').one().contact_id = self.jim_id
+        self.db.session.commit()
+        assert self.found('john@example') == [self.jim_id]
+
+    def test_admin(self):
+        """
+        Admin searches of indexed models use the index
+        """
+        with self.count_queries() as statements:
+            rv = self.app.get('/contact/?search=joh smi')
+        assert rv.status_code == 200
+        assert b'Smith' in rv.data
+        assert b'Smithers' not in rv.data
+        assert any('search_documents' in s for s in statements)
+
+    def test_views(self):
+        rv = self.app.get('/search?q=smi')
+        assert rv.status_code == 200
+        assert b'Smithers' in rv.data
+
+        rv = self.app.post('/api', data=json.dumps({
+            'query': '{ search(query: "joh") { ... on Contact { firstname } } }'
+        }), content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        assert json.loads(rv.data.decode('utf-8')) == {'search': [{'firstname': 'John'}]}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests for streamed /api list queries (crm.apps.api.streaming)
+"""
+import json
+import unittest
+from unittest import mock
+
+from graphql_relay.connection.arrayconnection import offset_to_cursor
+
+from crm.apps.contact.models import Contact
+from tests.base_tests import DBTestCase
+
+
+class StreamingTest(DBTestCase):
+    """
+    Test for {"stream": true} queries
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.add(*[Contact(firstname='c%d' % i) for i in range(7)])
+        self.ids = sorted(id for id, in self.db.session.query(Contact.id))
+        patcher = mock.patch('crm.apps.api.views.API_STREAM_CHUNK_SIZE', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, query, variables=None):
+        rv = self.app.post('/api', data=json.dumps({'query': query, 'variables': variables, 'stream': True}),
+                           content_type='application/json')
+        return rv.status_code, json.loads(rv.data.decode('utf-8'))
+
+    def test_all_records(self):
+        """
+        Records of all chunks in id order, cursors are offsets
+        """
+        with self.count_queries() as statements:
+            status, data = self.stream('{ contacts { edges { cursor node { uid } } } }')
+        assert status == 200, data
+        edges = data['contacts']['edges']
+        assert [e['node']['uid'] for e in edges] == self.ids
+        # Chunks of 3, 3 & 1 records
+        assert len([s for s in statements if s.startswith('SELECT contacts.') and 'LIMIT' in s]) == 3
+        assert [e['cursor'] for e in edges] == [offset_to_cursor(i) for i in range(7)]
+
+    def test_client_pagination(self):
+        """
+        (first) & (after) of the client are honoured across chunks
+        """
+        status, data = self.stream(
+            'query($n: Int) { contacts(first: $n, after: "%s") { edges { cursor node { uid } } } }' % offset_to_cursor(1),
+            {'n': 4}
+        )
+        assert status == 200, data
+        edges = data['contacts']['edges']
+        assert [e['node']['uid'] for e in edges] == self.ids[2:6]
+        assert [e['cursor'] for e in edges] == [offset_to_cursor(i) for i in range(2, 6)]
+
+    def test_filters(self):
+        """
+        Filter arguments apply to every chunk
+        """
+        status, data = self.stream('{ contacts(firstname: "c1") { edges { node { firstname } } } }')
+        assert status == 200, data
+        assert data['contacts']['edges'] == [{'node': {'firstname': 'c1'}}]
+
+    def test_not_streamable(self):
+        """
+        (last), several root fields & non connection fields are rejected
+        """
+        for query in (
+            '{ contacts(last: 2) { edges { node { uid } } } }',
+            '{ contacts { edges { node { uid } } } deals { edges { node { uid } } } }',
+            '{ contact(uid: "%s") { uid } }' % self.ids[0],
+        ):
+            status, data = self.stream(query)
+            assert status == 400, query
+            assert data['errors']
+
+
+if __name__ == '__main__':
+    unittest.main()
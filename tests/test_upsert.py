@@ -0,0 +1,127 @@
+"""
+Tests for upsert by natural key mutations (crm.graphql.UpsertMutationMixin)
+"""
+import json
+import unittest
+
+from crm.apps.company.models import Company
+from crm.apps.contact.models import Contact
+from crm.apps.email.models import Email
+from tests.base_tests import DBTestCase
+
+
+class UpsertTest(DBTestCase):
+    """
+    Test for upsertContacts & upsertCompanies mutations
+    """
+
+    def mutate(self, mutation):
+        rv = self.app.post('/api', data=json.dumps({'query': 'mutation { %s }' % mutation}),
+                           content_type='application/json')
+        return rv.status_code, json.loads(rv.data.decode('utf-8'))
+
+    def test_match_related_key(self):
+        """
+        Contacts are matched on their emails, new contacts get their email
+        """
+        id = self.add(Contact(firstname='john', lastname='smith', emails=[Email(email='john@example.com')])).id
+
+        status, data = self.mutate(
+            'upsertContacts(records: ['
+            '{email: "john@example.com", lastname: "doe"}, '
+            '{email: "jim@example.com", firstname: "jim", lastname: "beam"}]) { ok created updated }'
+        )
+        assert status == 200, data
+        result = data['upsertContacts']
+        assert result['updated'] == [id]
+        assert len(result['created']) == 1
+
+        contact = Contact.query.get(id)
+        assert (contact.firstname, contact.lastname) == ('john', 'doe')
+        created = Contact.query.get(result['created'][0])
+        assert created.firstname == 'jim'
+        assert [e.email for e in created.emails] == ['jim@example.com']
+
+    def test_match_column_key(self):
+        """
+        Contacts are matched on referral code column
+        """
+        id = self.add(Contact(firstname='john', referral_code='r1')).id
+
+        status, data = self.mutate(
+            'upsertContacts(key: "referral_code", records: [{referralCode: "r1", firstname: "jim"}, '
+            '{referralCode: "r2", firstname: "joe", lastname: "x"}]) { ok created updated }'
+        )
+        assert status == 200, data
+        assert data['upsertContacts']['updated'] == [id]
+        assert sorted(c.referral_code for c in Contact.query) == ['r1', 'r2']
+        assert Contact.query.get(id).firstname == 'jim'
+
+    def test_ambiguous_match(self):
+        """
+        A key value shared by several records is rejected, nothing is written
+        """
+        self.add(
+            Company(name='a', emails=[Email(email='info@example.com')]),
+            Company(name='b', emails=[Email(email='info@example.com')]),
+        )
+
+        status, data = self.mutate(
+            'upsertCompanies(key: "email", records: [{email: "info@example.com", name: "c"}]) { ok }'
+        )
+        assert status == 400
+        assert 'Ambiguous (email) values matching several companies: info@example.com' in data['errors'][0]
+        assert sorted(c.name for c in Company.query) == ['a', 'b']
+
+    def test_invalid_records(self):
+        """
+        Unknown keys, missing & duplicate key values are rejected
+        """
+        status, data = self.mutate('upsertCompanies(key: "name", records: [{name: "a"}]) { ok }')
+        assert status == 400
+        assert 'Invalid key (name)' in data['errors'][0]
+
+        status, data = self.mutate('upsertCompanies(records: [{name: "a"}]) { ok }')
+        assert status == 400
+        assert 'All records must have a value for (vatnumber)' in data['errors'][0]
+
+        status, data = self.mutate(
+            'upsertCompanies(records: [{vatnumber: "v1", name: "a"}, {vatnumber: "v1", name: "b"}]) { ok }'
+        )
+        assert status == 400
+        assert 'Duplicate values for (vatnumber)' in data['errors'][0]
+        assert Company.query.count() == 0
+
+    def test_create_required_fields(self):
+        """
+        Created records must have the fields required by create mutations, updated ones don't
+        """
+        self.add(Company(name='a', vatnumber='v1'))
+
+        status, data = self.mutate(
+            'upsertCompanies(records: [{vatnumber: "v1", website: "a.com"}, {vatnumber: "v2", website: "b.com"}]) { ok }'
+        )
+        assert status == 400
+        assert 'New companies must have a value for (name), missing for (vatnumber) v2' in data['errors'][0]
+        assert [(c.vatnumber, c.website) for c in Company.query] == [('v1', None)]
+
+        status, data = self.mutate('upsertCompanies(records: [{vatnumber: "v1", website: "a.com"}]) { ok updated }')
+        assert status == 200, data
+        assert Company.query.one().website == 'a.com'
+
+    def test_merge_key_email(self):
+        """
+        The key email of a created record is added to the provided emails
+        """
+        status, data = self.mutate(
+            'upsertCompanies(key: "email", records: ['
+            '{email: "info@a.com", name: "a", emails: "sales@a.com, info@a.com"}, '
+            '{email: "info@b.com", name: "b", emails: "sales@b.com"}]) { ok created }'
+        )
+        assert status == 200, data
+        emails = {c.name: sorted(e.email for e in c.emails) for c in Company.query}
+        assert emails == {'a': ['info@a.com', 'sales@a.com'], 'b': ['info@b.com', 'sales@b.com']}
+
+
+if __name__ == '__main__':
+    unittest.main()